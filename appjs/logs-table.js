@@ -27,7 +27,7 @@
  * The fact that you are presently reading this means that you have had
  * knowledge of the CeCILL-C license and that you accept its terms.
  */
-/* global logs */
+/* global logs, logsParams */
 
 import {render} from 'react-dom'
 import {Component, createElement as ce} from 'react'
@@ -36,6 +36,9 @@ import {BootstrapTable, TableHeaderColumn} from 'react-bootstrap-table'
 
 const PropTypes = require('prop-types')
 
+// minimal severities which can be requested to the server
+const LEVELS = ['WARNING', 'ERROR']
+
 function caretRender(direction) {
     const carets = []
     let selected = false
@@ -68,46 +71,99 @@ class LogsTable extends Component {
         this.state = {
             selectedSeverity: this.props.all_levels_default,
             selectedLogs: this.props.logs,
+            total: this.props.params.total,
+            loading: false,
+            error: null,
         }
         this.updateSeverity = this.updateSeverity.bind(this)
         this.buildOptions = this.buildOptions.bind(this)
+        this.loadMore = this.loadMore.bind(this)
+    }
+
+    fetchLogs(severity, offset) {
+        const {url, page_size} = this.props.params,
+            params = new URLSearchParams({offset, limit: page_size})
+        if (severity !== this.props.all_levels_default) {
+            params.set('level', severity)
+        }
+        this.setState({loading: true, error: null})
+        return fetch(`${url}?${params}`, {
+            credentials: 'same-origin',
+            headers: {Accept: 'application/json'},
+        })
+            .then((response) => {
+                if (!response.ok) {
+                    throw new Error(`${response.status} ${response.statusText}`)
+                }
+                return response.json()
+            })
+            .then((page) => {
+                this.setState((state) => ({
+                    selectedLogs:
+                        offset === 0
+                            ? page.data
+                            : state.selectedLogs.concat(page.data),
+                    total: page.total,
+                    loading: false,
+                }))
+            })
+            .catch((e) => {
+                this.setState({
+                    loading: false,
+                    error: `Les journaux n'ont pas pu être chargés : ${e}.`,
+                })
+                console.error(e)
+            })
     }
 
     updateSeverity(ev) {
         ev.preventDefault()
         const selectedSeverity = ev.target.value
-        this.setState({
-            selectedSeverity,
-            selectedLogs:
-                selectedSeverity === this.props.all_levels_default
-                    ? this.props.logs
-                    : this.props.logs.filter(
-                          (d) => d.severity === selectedSeverity,
-                      ),
-        })
+        this.setState({selectedSeverity})
+        this.fetchLogs(selectedSeverity, 0)
     }
 
-    buildOptions() {
-        const all_levels = [this.props.all_levels_default].concat(
-            Array.from(new Set(this.props.logs.map((value) => value.severity))),
+    loadMore(ev) {
+        ev.preventDefault()
+        this.fetchLogs(
+            this.state.selectedSeverity,
+            this.state.selectedLogs.length,
         )
+    }
+
+    buildOptions() {
+        const all_levels = [this.props.all_levels_default].concat(LEVELS)
         return all_levels.map((b, idx) =>
             ce('option', {key: `bfield-${idx}`, value: b}, b),
         )
     }
 
     render() {
-        const {selectedSeverity, selectedLogs} = this.state,
+        const {selectedSeverity, selectedLogs, total, loading, error} =
+                this.state,
             dataLength = selectedLogs.length
         return ce(
             'div',
             null,
-            ce('span', null, 'Sélectionner un niveau : '),
+            ce('span', null, 'Sélectionner un niveau minimal : '),
             ce(
                 'select',
                 {value: selectedSeverity, onChange: this.updateSeverity},
                 this.buildOptions(),
             ),
+            error ? ce('div', {className: 'alert alert-danger'}, error) : null,
+            ce('span', null, ` ${dataLength} / ${total} entrées chargées `),
+            dataLength < total
+                ? ce(
+                      'button',
+                      {
+                          className: 'btn btn-default',
+                          disabled: loading,
+                          onClick: this.loadMore,
+                      },
+                      'Charger les entrées suivantes',
+                  )
+                : null,
             ce(
                 BootstrapTable,
                 {
@@ -200,12 +256,17 @@ class LogsTable extends Component {
 LogsTable.propTypes = {
     all_levels_default: PropTypes.string,
     logs: PropTypes.object.isRequired,
+    params: PropTypes.object.isRequired,
 }
 
 const target = document.getElementById('logs-table-container')
 if (target !== null) {
     render(
-        ce(LogsTable, {logs: logs, all_levels_default: '-- tous --'}),
+        ce(LogsTable, {
+            logs: logs,
+            params: logsParams,
+            all_levels_default: '-- tous --',
+        }),
         target,
     )
 }
@@ -66,6 +66,7 @@ AUTH_URL_PATTERN = re.compile(
 )  # noqa
 
 SUBJECT_IMAGE_SIZE = (440, 220)
+SUBJECT_IMAGE_THUMBNAIL_SIZES = ((220, 110), (110, 55))
 
 
 def geonames_id_from_url(geonameuri):
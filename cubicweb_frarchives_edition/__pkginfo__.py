@@ -35,7 +35,7 @@ from os.path import join
 modname = "frarchives_edition"
 distname = "cubicweb-frarchives-edition"
 
-numversion = (1, 8, 4)
+numversion = (1, 9, 0)
 version = ".".join(str(num) for num in numversion)
 
 license = "CeCILL-C"
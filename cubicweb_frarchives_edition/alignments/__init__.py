@@ -29,10 +29,14 @@
 # knowledge of the CeCILL-C license and that you accept its terms.
 #
 """cubicweb-frarchives_edition geo-alignments data"""
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 
+import hashlib
+import json
 import logging
 
+import os
+import os.path as osp
 import re
 import requests
 
@@ -42,7 +46,7 @@ import time
 import urllib.parse
 
 from cubicweb_frarchives_edition import GEONAMES_RE
-from cubicweb_frarchives_edition.alignments.location import Geodata
+from cubicweb_frarchives_edition.alignments.location import cached_geodata
 
 
 # https://data.bnf.fr/11907966/victor_hugo
@@ -129,25 +133,115 @@ class SparqlRset(object):
         return self._build_row(self._results["results"]["bindings"][idx])
 
 
+def normalize_query(query):
+    """return `query` with normalized whitespaces, used as cache key"""
+    return " ".join(query.split())
+
+
+def sparql_cache_options(config):
+    """return SPARQLDatabase cache options from instance `config`"""
+    return {
+        "cache_dir": config.get("sparql-cache-dir") or None,
+        "ttl": config.get("sparql-cache-ttl", 30) * 86400,
+        "negative_ttl": config.get("sparql-cache-negative-ttl", 1) * 86400,
+    }
+
+
 class SPARQLDatabase(object):
-    def __init__(self, endpoint, cache_dir=None, agent=SPARQLWrapper.__agent__):
+    # number of extids queried at once by agent_infos_many
+    batch_size = 50
+
+    def __init__(
+        self,
+        endpoint,
+        cache_dir=None,
+        agent=SPARQLWrapper.__agent__,
+        ttl=30 * 86400,
+        negative_ttl=86400,
+        raise_errors=False,
+    ):
+        self.endpoint = endpoint
         self.querier = SPARQLWrapper.SPARQLWrapper(endpoint, agent=agent)
         self.querier.setReturnFormat(SPARQLWrapper.JSON)
         self.logger = logging.getLogger("francearchives.alignment")
         # 15 sec must be suffisant, but we could find a better value
         self.querier.setTimeout(15)
+        # responses are cached in `cache_dir` for `ttl` seconds, empty ones
+        # for `negative_ttl` seconds
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # failed queries return no results unless `raise_errors` is set
+        self.raise_errors = raise_errors
+
+    def cache_path(self, query):
+        key = hashlib.sha1(
+            "{}\n{}".format(self.endpoint, normalize_query(query)).encode("utf-8")
+        ).hexdigest()
+        return osp.join(self.cache_dir, key[:2], "{}.json".format(key))
+
+    def cached_results(self, query):
+        """return cached raw results of `query` if they have not expired"""
+        if not self.cache_dir:
+            return None
+        path = self.cache_path(query)
+        try:
+            age = time.time() - os.stat(path).st_mtime
+            with open(path) as f:
+                raw_results = json.load(f)
+            ttl = self.ttl if raw_results["results"]["bindings"] else self.negative_ttl
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if age > ttl:
+            return None
+        return raw_results
+
+    def cache_results(self, query, raw_results):
+        if not self.cache_dir:
+            return
+        path = self.cache_path(query)
+        tmppath = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            os.makedirs(osp.dirname(path), exist_ok=True)
+            with open(tmppath, "w") as f:
+                json.dump(raw_results, f)
+            os.replace(tmppath, path)
+        except OSError:
+            self.logger.exception("failed to cache SPARQL results in %s", path)
 
     def execute(self, query):
         """perform `query` on the database endpoint"""
-        self.logger.info('try query "%s"', query)
-        try:
-            self.querier.setQuery(query)
-            self.querier.query().convert()
-            raw_results = self.querier.query().convert()
-            return SparqlRset(raw_results)
-        except Exception:
-            logging.exception("failed to execute SPARQL query %r", query)
-            return {}
+        raw_results = self.cached_results(query)
+        if raw_results is None:
+            self.logger.info('try query "%s"', query)
+            try:
+                self.querier.setQuery(query)
+                raw_results = self.querier.query().convert()
+                # check results structure before caching them
+                SparqlRset(raw_results)
+            except Exception:
+                if self.raise_errors:
+                    raise
+                logging.exception("failed to execute SPARQL query %r", query)
+                return {}
+            self.cache_results(query, raw_results)
+        return SparqlRset(raw_results)
+
+    def agent_infos(self, extid):
+        raise NotImplementedError
+
+    def agent_infos_batch(self, extids):
+        """return a {extid: agent infos} dict for `extids` using a single query"""
+        raise NotImplementedError
+
+    def agent_infos_many(self, extids):
+        """return a {extid: agent infos} dict, `extids` being queried by chunks
+        of `batch_size`"""
+        extids = list(dict.fromkeys(extids))
+        infos = {}
+        for idx in range(0, len(extids), self.batch_size):
+            infos.update(self.agent_infos_batch(extids[idx : idx + self.batch_size]))
+        return infos
 
 
 def compute_label_from_url(cnx, url):
@@ -174,49 +268,66 @@ def compute_geonames_label(cnx, url):
     :returns: label
     :rtype: str
     """
+    return compute_geonames_labels(cnx, [url]).get(url, "")
+
+
+def compute_geonames_labels(cnx, urls):
+    """Create GeoNames labels ('ville (region, departement)') of several URLs.
+
+    :param Connection cnx: CubicWeb database connection
+    :param list urls: GeoNames URLs
+
+    :returns: a {url: label} dict, URLs not found in `geonames` table are missing
+    :rtype: dict
+    """
     # GeoNames URL is either e.g. https://www.geonames.org/2988507/paris.html
     # or e.g. https://www.geonames.org/2988507
-    match = GEONAMES_RE.search(url)
-    if not match:
-        return ""
-    geonameid = match.group(1)
-    res = cnx.system_sql(
+    geonameids = defaultdict(list)
+    for url in urls:
+        match = GEONAMES_RE.search(url or "")
+        if match:
+            geonameids[int(match.group(1))].append(url)
+    if not geonameids:
+        return {}
+    rows = cnx.system_sql(
         """
-        SELECT name, country_code, admin1_code, admin2_code
-        FROM geonames WHERE geonameid = %(gid)s
+        SELECT g.geonameid, g.name, g.country_code, g.admin1_code, g.admin2_code,
+               alt.alternate_name
+        FROM geonames g
+        LEFT OUTER JOIN (
+            SELECT DISTINCT ON (geonameid) geonameid, alternate_name
+            FROM geonames_altnames
+            WHERE geonameid = ANY(%(gids)s) AND isolanguage = 'fr'
+            ORDER BY geonameid, rank
+        ) AS alt ON alt.geonameid = g.geonameid
+        WHERE g.geonameid = ANY(%(gids)s)
         """,
-        {"gid": geonameid},
+        {"gids": list(geonameids)},
     ).fetchall()
-    if not res:
-        return ""
-    label, country_code, admin1_code, admin2_code = res[0]
-    geodata = Geodata(cnx)
-    if country_code == "FR":
-        admin1_name = geodata.regions.get(admin1_code, "")
-        admin2_name = geodata.departments.get(admin2_code, "")
-        if admin1_name or admin2_name:
-            label = "{} ({})".format(label, ", ".join(v for v in (admin1_name, admin2_name) if v))
-    else:
-        # for other countries
-        # try to retrieve the french name
-        res = cnx.system_sql(
-            """
-            SELECT alternate_name, MIN(rank)
-            FROM geonames_altnames
-            WHERE geonameid = %(gid)s
-            AND isolanguage = 'fr'
-            GROUP BY alternate_name, rank
-            LIMIT 1;
-            """,
-            {"gid": geonameid},
-        ).fetchall()
-        if res:
-            label = res[0][0]
-        # only retrieve the country name
-        res = geodata.countries.get(country_code, "")
-        if res:
-            label = "{} ({})".format(label, res)
-    return label
+    if not rows:
+        return {}
+    geodata = cached_geodata(cnx)
+    labels = {}
+    for geonameid, label, country_code, admin1_code, admin2_code, fr_name in rows:
+        if country_code == "FR":
+            admin1_name = geodata.regions.get(admin1_code, "")
+            admin2_name = geodata.departments.get(admin2_code, "")
+            if admin1_name or admin2_name:
+                label = "{} ({})".format(
+                    label, ", ".join(v for v in (admin1_name, admin2_name) if v)
+                )
+        else:
+            # for other countries
+            # try to retrieve the french name
+            if fr_name:
+                label = fr_name
+            # only retrieve the country name
+            country_name = geodata.countries.get(country_code, "")
+            if country_name:
+                label = "{} ({})".format(label, country_name)
+        for url in geonameids[geonameid]:
+            labels[url] = label
+    return labels
 
 
 class DataGouvQuerier(object):
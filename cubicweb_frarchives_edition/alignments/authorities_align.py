@@ -29,10 +29,33 @@
 # knowledge of the CeCILL-C license and that you accept its terms.
 from collections import OrderedDict, defaultdict
 import logging
+from tempfile import SpooledTemporaryFile
 
-from cubicweb_frarchives_edition.alignments import get_externaluri_data
+from cubicweb_francearchives.dataimport.stores import create_massive_store
+
+from cubicweb_frarchives_edition.alignments import compute_geonames_labels, get_externaluri_data
 from cubicweb_frarchives_edition.alignments.align import Record, ImportAligner
 
+# size of the sameas_history.sameas_uri column
+SAMEAS_URI_MAXSIZE = 256
+
+
+def copy_row(*values):
+    """return a line of `values` in the COPY text format"""
+    return (
+        "\t".join(
+            "\\N"
+            if value is None
+            else str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+            for value in values
+        )
+        + "\n"
+    )
+
 
 class ImportRecord(Record):
     headers = OrderedDict()
@@ -126,6 +149,10 @@ class AgentSubjectImportAligner(ImportAligner):
     """
 
     record_type = AgentImportRecord
+    # alignments are first copied in this temporary table
+    ALIGNMENTS_TABLE = "import_alignments"
+    # and those which cannot be processed in this one
+    REJECTED_TABLE = "rejected_import_alignments"
 
     def find_conflicts(self, to_modify):
         """Find conflicting alignment(s).
@@ -190,150 +217,227 @@ class AgentSubjectImportAligner(ImportAligner):
         """
         return {(str(auth), exturi) for auth, exturi in self.cnx.execute(alignment_query)}
 
-    def _get_eid_from_externaluri_uri(self, externuri):
-        """
-        Return the eid of an ExternalUri having the given externuri as uri.
-        If the ExternalUri does not exist, return None.
+    def load_alignments(self, new_alignment, to_remove_alignment, override_alignments=False):
+        """Copy alignment(s) into the ALIGNMENTS_TABLE temporary table.
 
-        :param externuri: the uri
+        Alignment(s) which cannot be processed are copied into the REJECTED_TABLE
+        temporary table.
+
+        :param dict new_alignment: alignment(s) to add to database
+        :param dict to_remove_alignment: alignment(s) to remove from database
+        :param bool override_alignments: toggle overwriting user-defined alignments on/off
         """
         cursor = self.cnx.cnxset.cu
-        cursor.execute("SELECT cw_eid FROM cw_externaluri WHERE cw_uri = %s LIMIT 1", (externuri,))
-        result = cursor.fetchone()
-        if result:
-            return result[0]
-        else:
-            return None
+        self.drop_alignment_tables()
+        # these tables must survive the commit of the massive store
+        cursor.execute(
+            f"""CREATE TEMPORARY TABLE {self.ALIGNMENTS_TABLE} (
+                line integer, autheid integer, uri text, label text,
+                source text, extid text, keep boolean, ext integer
+            )"""
+        )
+        cursor.execute(
+            f"""CREATE TEMPORARY TABLE {self.REJECTED_TABLE} (
+                autheid text, uri text, keep boolean, reason text
+            )"""
+        )
+        line = 0
+        with SpooledTemporaryFile(max_size=10 * 1024 * 1024, mode="w+") as buf:
+            with SpooledTemporaryFile(max_size=1024 * 1024, mode="w+") as rejected:
+                for keep, alignments in ((True, new_alignment), (False, to_remove_alignment)):
+                    for (autheid, externuri), record in alignments.items():
+                        autheid = str(autheid)
+                        if not autheid.isdigit():
+                            reason = "invalid identifiant"
+                        elif override_alignments and len(externuri) > SAMEAS_URI_MAXSIZE:
+                            # the alignment could not be recorded in sameas_history
+                            reason = "URI is too long"
+                        else:
+                            reason = None
+                        if reason:
+                            rejected.write(copy_row(autheid, externuri, keep, reason))
+                            continue
+                        source, extid = get_externaluri_data(externuri) if keep else (None, None)
+                        label = getattr(record, "externallabel", None) if keep else None
+                        buf.write(copy_row(line, autheid, externuri, label, source, extid, keep))
+                        line += 1
+                buf.seek(0)
+                cursor.copy_expert(
+                    f"""COPY {self.ALIGNMENTS_TABLE}
+                    (line, autheid, uri, label, source, extid, keep) FROM STDIN""",
+                    buf,
+                )
+                rejected.seek(0)
+                cursor.copy_expert(
+                    f"COPY {self.REJECTED_TABLE} (autheid, uri, keep, reason) FROM STDIN", rejected
+                )
+        cursor.execute(f"CREATE INDEX ON {self.ALIGNMENTS_TABLE} (uri)")
+        cursor.execute(f"ANALYZE {self.ALIGNMENTS_TABLE}")
+
+    def drop_alignment_tables(self):
+        self.cnx.system_sql(f"DROP TABLE IF EXISTS {self.ALIGNMENTS_TABLE}, {self.REJECTED_TABLE}")
+
+    def resolve_external_uris(self):
+        """Set the ExternalUri eid of alignment(s) in the ALIGNMENTS_TABLE
+        temporary table. If several ExternalUri have the same uri, the oldest one
+        is used."""
+        self.cnx.system_sql(
+            f"""UPDATE {self.ALIGNMENTS_TABLE} AS a SET ext = e.cw_eid
+            FROM (
+              SELECT DISTINCT ON (cw_uri) cw_uri, cw_eid FROM cw_externaluri
+              WHERE cw_uri IN (SELECT uri FROM {self.ALIGNMENTS_TABLE})
+              ORDER BY cw_uri, cw_eid
+            ) AS e
+            WHERE a.uri = e.cw_uri AND a.ext IS NULL"""
+        )
+
+    def skip_new_alignments(self, override_alignments=False):
+        """Remove new alignment(s) which must not be added from the
+        ALIGNMENTS_TABLE temporary table.
+
+        :param bool override_alignments: toggle overwriting user-defined alignments on/off
+        """
+        missing = self.cnx.system_sql(
+            f"""DELETE FROM {self.ALIGNMENTS_TABLE} AS a
+            WHERE a.keep AND NOT EXISTS (
+              SELECT 1 FROM cw_{self.cw_etype} x WHERE x.cw_eid = a.autheid
+            )
+            RETURNING a.line, a.autheid"""
+        ).fetchall()
+        for _, autheid in sorted(missing):
+            self.log.error("%s %s doesn't exist", self.cw_etype, autheid)
+        if not override_alignments:
+            # user removed alignment, do not re-insert it
+            self.cnx.system_sql(
+                f"""DELETE FROM {self.ALIGNMENTS_TABLE} AS a USING sameas_history AS sh
+                WHERE a.keep AND sh.autheid = a.autheid AND sh.sameas_uri = a.uri
+                AND sh.action = false"""
+            )
+
+    def create_external_uris(self):
+        """Create the missing ExternalUri of new alignment(s) with the massive
+        store.
+
+        The massive store commits the created ExternalUri.
+
+        :returns: number of created ExternalUri
+        :rtype: int
+        """
+        rows = self.cnx.system_sql(
+            f"""SELECT DISTINCT ON (uri) uri, label, source, extid
+            FROM {self.ALIGNMENTS_TABLE} WHERE keep AND ext IS NULL
+            ORDER BY uri, line"""
+        ).fetchall()
+        if not rows:
+            return 0
+        # (possibly mod.) ExternalUri label in CSV takes precedence
+        labels = compute_geonames_labels(
+            self.cnx, [externuri for externuri, label, _, _ in rows if not label]
+        )
+        store = create_massive_store(self.cnx, nodrop=True)
+        for externuri, label, source, extid in rows:
+            store.prepare_insert_entity(
+                "ExternalUri",
+                uri=externuri,
+                label=label or labels.get(externuri, ""),
+                extid=extid,
+                source=source,
+            )
+        store.flush()
+        store.finish()
+        self.resolve_external_uris()
+        return len(rows)
+
+    def log_rejected_alignments(self, keep, total):
+        """Log alignment(s) from the REJECTED_TABLE temporary table.
+
+        :param bool keep: log new alignment(s) or alignment(s) to remove
+        :param int total: number of new alignment(s) or alignment(s) to remove
+
+        :returns: number of rejected alignment(s)
+        :rtype: int
+        """
+        rejected = self.cnx.system_sql(
+            f"""SELECT autheid, uri, reason FROM {self.REJECTED_TABLE}
+            WHERE keep = %(keep)s ORDER BY autheid, uri""",
+            {"keep": keep},
+        ).fetchall()
+        for autheid, externuri, reason in rejected:
+            self.log.error("%s %s (%s): %s", self.cw_etype, autheid, externuri, reason)
+        if rejected:
+            if keep:
+                msg = "failed to add all new alignments : %d/%d alignments could not be added"
+            else:
+                msg = "failed to remove all deprecated alignments : %d/%d could not be removed"
+            self.log.error(msg, len(rejected), total)
+        return len(rejected)
 
     def process_alignments(self, new_alignment, to_remove_alignment, override_alignments=False):
         """
         Add or remove alignements
 
+        Alignments are first copied into a temporary table, then ExternalUri are
+        resolved, created if needed, and same_as relations are added and removed
+        with set-based queries.
+
         :param new_alignment dict: alignments to add
         :param to_remove_alignment dict: alignments to remove
         :param override_alignments bool: user action must or not be overridden
         """
-        # first add new alignments
-        failed = 0
         self.log.info("will create %s new alignments", len(new_alignment))
         if not (new_alignment or to_remove_alignment):
             return
-        for (autheid, externuri), record in new_alignment.items():
-            # check Authority exists
-            authority = self.cnx.system_sql(
-                f"""SELECT 1 FROM cw_{self.cw_etype}
-                WHERE cw_eid=%(autheid)s""",
-                {"autheid": autheid},
-            ).fetchall()
-            if not authority:
-                self.log.error("%s %s doesn't exist", self.cw_etype, autheid)
-                continue
-            try:
-                if not override_alignments:
-                    is_in_sameas_history = self.cnx.system_sql(
-                        """SELECT 1 FROM sameas_history
-                        WHERE autheid=%(autheid)s AND sameas_uri=%(externuri)s
-                        AND action=false""",
-                        {"autheid": autheid, "externuri": externuri},
-                    ).fetchall()
-                    # user removed alignment, do not re-insert it
-                    if is_in_sameas_history:
-                        continue
-                source, externeid = get_externaluri_data(externuri)
-                ext = self._get_eid_from_externaluri_uri(externuri)
-                if not ext:
-                    # (possibly mod.) ExternalUri label in CSV takes precedence
-                    # sameas-label hook will create it if ExternalUries label is not
-                    # given
-                    label = record.externallabel or ""
-                    ext = self.cnx.create_entity(
-                        "ExternalUri",
-                        uri=externuri,
-                        label=label,
-                        extid=externeid,
-                        source=source,
-                    ).eid
-                query = """
-                INSERT INTO same_as_relation (eid_from, eid_to)
-                VALUES (%(l)s, %(ext)s)
-                ON CONFLICT (eid_from, eid_to) DO NOTHING
-                """
-                self.cnx.system_sql(query, {"l": int(autheid), "ext": int(ext)})
-                if override_alignments:
-                    # user-defined alignment takes precedence over any
-                    # existing alignment(s), therefore
-                    # add other existing alignment(s) to list of alignments
-                    # to be removed
-                    result_set = self.cnx.execute(
-                        """Any U WHERE X is ExternalUri, X uri U, A same_as X,
-                        A eid %(autheid)s, X eid != %(ext)s,
-                        X source '%(source)s'""",
-                        {"autheid": autheid, "ext": ext, "source": source},
-                    ).rows
-                    to_remove_alignment.update(
-                        {(autheid, externuri): tuple() for externuri, in result_set}
-                    )
-                    # update same-as relation history
-                    query = """INSERT INTO sameas_history (sameas_uri, autheid, action)
-                    VALUES (%(externuri)s, %(autheid)s, true)
-                    ON CONFLICT (sameas_uri,autheid)
-                    DO UPDATE SET action=true"""
-                    self.cnx.system_sql(query, {"externuri": externuri, "autheid": autheid})
-            except Exception as exception:
-                self.log.error(exception)
-                failed += 1
-        if failed > 0:
-            self.log.error(
-                "failed to add all new alignments : %d/%d alignments could not be added",
-                failed,
-                len(new_alignment),
-            )
-        # then remove unwanted alignment
-        failed = 0
-        self.log.info("will remove %s alignments", len(to_remove_alignment))
-        for autheid, externuri in to_remove_alignment:
-            externeid = self._get_eid_from_externaluri_uri(externuri)
-            if not externeid:
-                continue
-            try:
-                query = """DELETE FROM same_as_relation
-                WHERE eid_from=%(autheid)s AND eid_to=%(ext)s"""
-                if not override_alignments:
-                    query += """
-                    AND
-                    NOT EXISTS(SELECT 1 FROM sameas_history sh
-                    WHERE sh.sameas_uri = %(externuri)s
-                    AND sh.autheid = %(autheid)s
-                    AND sh.action=true
-                    )
-                    """
-                self.cnx.system_sql(
-                    query,
-                    {
-                        "autheid": autheid,
-                        "ext": externeid,
-                        "externuri": externuri,
-                    },
-                )
-                if override_alignments:
-                    query = """INSERT INTO sameas_history (sameas_uri, autheid, action)
-                    VALUES (%(externuri)s, %(autheid)s, false)
-                    ON CONFLICT (sameas_uri,autheid)
-                    DO UPDATE SET action=false"""
-                    self.cnx.system_sql(query, {"autheid": autheid, "externuri": externuri})
-            except Exception:
-                self.log.error("error will trying to remove alignment")
-                failed += 1
-        if failed > 0:
-            self.log.error(
-                "failed to remove all deprecated alignments : %d/%d could not be removed",
-                failed,
-                len(to_remove_alignment),
-            )
+        cnx = self.cnx
         try:
-            self.cnx.commit()
+            self.load_alignments(new_alignment, to_remove_alignment, override_alignments)
+            self.log_rejected_alignments(True, len(new_alignment))
+            # first add new alignments
+            self.skip_new_alignments(override_alignments)
+            self.resolve_external_uris()
+            created = self.create_external_uris()
+            self.log.info("created %s ExternalUri", created)
+            added = cnx.system_sql(
+                f"""INSERT INTO same_as_relation (eid_from, eid_to)
+                SELECT DISTINCT autheid, ext FROM {self.ALIGNMENTS_TABLE}
+                WHERE keep AND ext IS NOT NULL
+                ON CONFLICT (eid_from, eid_to) DO NOTHING"""
+            ).rowcount
+            self.log.info("added %s alignments", added)
+            if override_alignments:
+                # update same-as relation history
+                cnx.system_sql(
+                    f"""INSERT INTO sameas_history (sameas_uri, autheid, action)
+                    SELECT DISTINCT uri, autheid, true FROM {self.ALIGNMENTS_TABLE}
+                    WHERE keep AND ext IS NOT NULL
+                    ON CONFLICT (sameas_uri, autheid) DO UPDATE SET action=true"""
+                )
+            # then remove unwanted alignment
+            self.log.info("will remove %s alignments", len(to_remove_alignment))
+            self.log_rejected_alignments(False, len(to_remove_alignment))
+            query = f"""DELETE FROM same_as_relation AS r USING {self.ALIGNMENTS_TABLE} AS a
+            WHERE NOT a.keep AND r.eid_from = a.autheid AND r.eid_to = a.ext"""
+            if not override_alignments:
+                query += """
+                AND NOT EXISTS (
+                  SELECT 1 FROM sameas_history sh
+                  WHERE sh.sameas_uri = a.uri AND sh.autheid = a.autheid AND sh.action = true
+                )"""
+            removed = cnx.system_sql(query).rowcount
+            self.log.info("removed %s alignments", removed)
+            if override_alignments:
+                cnx.system_sql(
+                    f"""INSERT INTO sameas_history (sameas_uri, autheid, action)
+                    SELECT DISTINCT uri, autheid, false FROM {self.ALIGNMENTS_TABLE}
+                    WHERE NOT keep AND ext IS NOT NULL
+                    ON CONFLICT (sameas_uri, autheid) DO UPDATE SET action=false"""
+                )
+            cnx.commit()
         except Exception:
-            self.log.error("failed to update database, all changes have been lost")
+            cnx.rollback()
+            self.log.exception("failed to update database, all changes have been lost")
+        finally:
+            self.drop_alignment_tables()
+            cnx.commit()
 
 
 class AgentImportAligner(AgentSubjectImportAligner):
@@ -97,16 +97,15 @@ class DataBnfDatabase(SPARQLDatabase):
     def __init__(self, *args, **kwargs):
         super(DataBnfDatabase, self).__init__("http://data.bnf.fr/sparql", *args, **kwargs)
 
-    def author_query(self, extid):
-        query = """
+    author_query_pattern = """
    PREFIX bnf-onto: <http://data.bnf.fr/ontology/bnf-onto/>
    PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
    PREFIX foaf: <http://xmlns.com/foaf/0.1/>
    PREFIX bio: <http://vocab.org/bio/0.1/>
 
-   SELECT ?label ?birthyear ?birthdate ?deathyear ?deathdate ?description WHERE {
-
-        ?concept bnf-onto:FRBNF "%(extid)s"^^xsd:integer;
+   SELECT %(select)s?label ?birthyear ?birthdate ?deathyear ?deathdate ?description WHERE {
+        %(values)s
+        ?concept bnf-onto:FRBNF %(extid)s;
         skos:prefLabel ?label ;
         foaf:focus ?person.
 
@@ -130,18 +129,30 @@ class DataBnfDatabase(SPARQLDatabase):
         ?concept skos:note ?description
         FILTER(lang(?description)="fr")
         }
-   }""" % {
-            "extid": extid
-        }  # noqa
+   }"""  # noqa
+
+    def author_query(self, extid):
+        query = self.author_query_pattern % {
+            "select": "",
+            "values": "",
+            "extid": '"{}"^^xsd:integer'.format(extid),
+        }
         return self.execute(query)
 
-    def agent_infos(self, extid):
-        rset = self.author_query(extid)
+    def authors_query(self, extids):
+        """query all `extids` at once, the first selected variable being the extid"""
+        query = self.author_query_pattern % {
+            "select": "?extid ",
+            "values": "VALUES ?extid { %s }"
+            % " ".join('"{}"^^xsd:integer'.format(extid) for extid in extids),
+            "extid": "?extid",
+        }
+        return self.execute(query)
+
+    def agent_infos_from_rows(self, rows):
         data_infos = {}
         descriptions = set()
-        if not rset:
-            return data_infos
-        for label, birthyear, birthdate, deathyear, deathdate, description in rset:
+        for label, birthyear, birthdate, deathyear, deathdate, description in rows:
             data_infos["label"] = label
             dates = {}
             if birthdate or birthyear:
@@ -154,3 +165,23 @@ class DataBnfDatabase(SPARQLDatabase):
         if descriptions:
             data_infos["description"] = STRING_SEP.join(descriptions)
         return data_infos
+
+    def agent_infos(self, extid):
+        rset = self.author_query(extid)
+        if not rset:
+            return {}
+        return self.agent_infos_from_rows(rset)
+
+    def agent_infos_batch(self, extids):
+        infos = {extid: {} for extid in extids}
+        # FRBNF identifiers are integers
+        extids = {int(extid): extid for extid in extids if str(extid).isdigit()}
+        if not extids:
+            return infos
+        rows = {}
+        for row in self.authors_query(list(extids)):
+            rows.setdefault(int(row[0]), []).append(row[1:])
+        for extid, agent_rows in rows.items():
+            if extid in extids:
+                infos[extids[extid]] = self.agent_infos_from_rows(agent_rows)
+        return infos
@@ -55,10 +55,12 @@ import json
 from itertools import chain
 import os.path as osp
 import re
+import time
 
 from logilab.common.decorators import timed
 
 from cubicweb_frarchives_edition import CANDIDATE_SEP
+from cubicweb_frarchives_edition.alignments.group_locations import group_candidates
 from cubicweb_frarchives_edition.alignments.utils import simplify
 
 NOW = datetime.now()
@@ -180,20 +182,12 @@ class Label(object):
         return 1
 
 
-def update_suggest_es(cnx, entities):
-    service = cnx.vreg['services'].select('reindex-suggest', cnx)
-    try:
-        service.index_authorities(entities)
-    except Exception:
-        import traceback
-        traceback.print_exc()
-
-
 @timed
-def group_location_authorities(cnx, log=None):
+def group_location_authorities(cnx, log=None, dry_run=False):
     """
     group location authorities
     """
+    start = time.perf_counter()
     do_group, do_not_group = compute_location_authorities_to_group(cnx)
     filepath = "not_group_geonamed_locationauthority_{}{}{:02d}.csv".format(
         NOW.year, NOW.day, NOW.month)
@@ -211,24 +205,12 @@ def group_location_authorities(cnx, log=None):
             writer.writerow([label_to.encoded_label] + [
                 l.encoded_label for l in other_labels])
             group_elts += len(other_labels) + 1
-    group_filepath = "grouped_geonamed_locationauthority_{}{}{:02d}.csv".format(
-        NOW.year, NOW.day, NOW.month)
-    write_log('group {} records, {} entities'.format(
-        len(do_group), group_elts), log)
-    with cnx.allow_all_hooks_but('reindex-suggest-es',):
-        with open(group_filepath, "w") as fp:
-            writer = csv.writer(fp)
-            for idx, (label_to, other_labels) in enumerate(do_group.items()):
-                target = cnx.entity_from_eid(label_to.eid)
-                sources = [cnx.entity_from_eid(l.eid) for l in other_labels]
-                sources_info = [l.encoded_label for l in other_labels]
-                line = [target.encoded_label] + sources_info
-                writer.writerow(line)
-                write_log('idx: {}, target: {}, source: {}'.format(
-                    idx, target.encoded_label, ', '.join(sources_info)), log)
-                target.group([l.eid for l in other_labels])
-                cnx.commit()
-                update_suggest_es(cnx, [target] + sources)
+    write_log('computed {} groups of {} entities in {:.1f}s'.format(
+        len(do_group), group_elts, time.perf_counter() - start), log)
+    if dry_run:
+        return
+    # groups are processed by batches and grouped authorities are reindexed at once
+    group_candidates(cnx, do_group, group_elts, log)
 
 
 def process_candidates(candidates):
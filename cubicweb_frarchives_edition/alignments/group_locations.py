@@ -53,16 +53,21 @@ import csv
 from datetime import datetime
 from itertools import chain
 import re
+import time
 
 from logilab.common.decorators import timed
 
-from cubicweb_frarchives_edition import CANDIDATE_SEP, update_suggest_es
+from cubicweb_frarchives_edition import CANDIDATE_SEP
 from cubicweb_frarchives_edition.alignments.utils import simplify
-from cubicweb_frarchives_edition.alignments.location import Geodata
+from cubicweb_frarchives_edition.alignments.location import cached_geodata
+from cubicweb_frarchives_edition.entities.sync import SuggestIndexBuffer
 
 
 NOW = datetime.now()
 
+# number of groups processed in one transaction
+GROUP_BATCH_SIZE = 100
+
 CONTEXT_RE = re.compile(r"([^(]+)\(([^)]+)\)(\s*.*)")
 
 query = """
@@ -87,6 +92,16 @@ GROUP BY ext.cw_uri
 HAVING COUNT(ext.cw_uri) > 1;
 """
 
+documents_count_query = """
+SELECT loc.cw_eid, COUNT(DISTINCT i.eid_to) + COUNT(DISTINCT rar.eid_from)
+FROM cw_locationauthority loc
+LEFT OUTER JOIN cw_geogname g ON g.cw_authority = loc.cw_eid
+LEFT OUTER JOIN index_relation i ON i.eid_from = g.cw_eid
+LEFT OUTER JOIN related_authority_relation rar ON rar.eid_to = loc.cw_eid
+WHERE loc.cw_eid = ANY(%(eids)s)
+GROUP BY loc.cw_eid
+"""
+
 articles = ["la ", "le ", "les "]
 
 
@@ -188,14 +203,16 @@ class Label(object):
 
 
 @timed
-def group_location_authorities(cnx, dry_run=True, log=None):
+def group_location_authorities(cnx, dry_run=True, log=None, batch_size=GROUP_BATCH_SIZE):
     """
     group location authorities
 
     :param Connection cnx: CubicWeb database connection
     :param boolean dry_run: is True do not group entities, juste write the result
     :param Logging log
+    :param int batch_size: number of groups processed in one transaction
     """
+    start = time.perf_counter()
     do_group, do_not_group = compute_location_authorities_to_group(cnx)
     filepath = "locations_not_to_group_{}{}{:02d}.csv".format(NOW.year, NOW.day, NOW.month)
     with open(filepath, "w") as fp:
@@ -209,35 +226,121 @@ def group_location_authorities(cnx, dry_run=True, log=None):
         for idx, (label_to, other_labels) in enumerate(do_group.items()):
             writer.writerow([label_to.encoded_label] + [ol.encoded_label for ol in other_labels])
             group_elts += len(other_labels) + 1
-    if not dry_run:
-        group_candidates(cnx, do_group, group_elts, log)
+    write_log(
+        "computed {} groups of {} entities in {:.1f}s".format(
+            len(do_group), group_elts, time.perf_counter() - start
+        ),
+        log,
+    )
+    if dry_run:
+        write_log('dry run: groups are written in "{}"'.format(to_group_filepath), log)
+    else:
+        group_candidates(cnx, do_group, group_elts, log, batch_size=batch_size)
+
+
+def group_authorities(cnx, groups, log=None, batch_size=GROUP_BATCH_SIZE, progress=None):
+    """Group authorities, `batch_size` groups being processed in one transaction.
+
+    If a batch fails, it is rolled back and its groups are processed again one
+    by one so that only failing groups are skipped.
+
+    :param Connection cnx: CubicWeb database connection
+    :param list groups: list of (target eid, source eids, ...) tuples
+    :param Logging log
+    :param int batch_size: number of groups processed in one transaction
+    :param callable progress: called with the number of processed groups
+
+    :returns: eids of grouped authorities and the list of failed groups
+    :rtype: tuple
+    """
+    grouped, failed = set(), []
+    for idx in range(0, len(groups), batch_size):
+        batch = groups[idx : idx + batch_size]
+        try:
+            group_batch(cnx, batch)
+            cnx.commit()
+        except Exception as error:
+            cnx.rollback()
+            write_log("failed to group a batch ({}), group it row by row".format(error), log)
+            done = []
+            for group in batch:
+                try:
+                    group_batch(cnx, [group])
+                    cnx.commit()
+                except Exception as error:
+                    cnx.rollback()
+                    write_log("could not group {} with {}: {}".format(*group[:2], error), log)
+                    failed.append(group)
+                else:
+                    done.append(group)
+            batch = done
+        for target, sources, *_ in batch:
+            grouped.add(int(target))
+            grouped.update(int(eid) for eid in sources)
+        # remove all cnx.transaction_data cache
+        cnx.drop_entity_cache()
+        if progress is not None:
+            progress(min(idx + batch_size, len(groups)))
+    return grouped, failed
+
+
+def group_batch(cnx, batch):
+    """Group the sources of each group of `batch` with its target, fetching targets at once"""
+    eids = {int(target) for target, *_ in batch}
+    rset = cnx.execute("Any X WHERE X eid IN (%s)" % ", ".join(str(eid) for eid in eids))
+    targets = {entity.eid: entity for entity in rset.entities()}
+    for target, sources, *_ in batch:
+        targets[int(target)].group([int(eid) for eid in sources])
+
+
+def reindex_grouped_authorities(cnx, eids, log=None):
+    """Reindex grouped authorities in the suggest indexes with a single bulk pass"""
+    if cnx.vreg.config.mode == "test" or not eids:
+        return
+    start = time.perf_counter()
+    suggest_buffer = SuggestIndexBuffer(cnx)
+    suggest_buffer.add(eids)
+    try:
+        suggest_buffer.flush()
+    except Exception:
+        import traceback
 
+        traceback.print_exc()
+    write_log(
+        "reindexed {} authorities in {:.1f}s".format(len(eids), time.perf_counter() - start), log
+    )
 
-def group_candidates(cnx, do_group, group_elts, log):
+
+def group_candidates(cnx, do_group, group_elts, log, batch_size=GROUP_BATCH_SIZE):
     group_filepath = "grouped_geonamed_locationauthority_{}{}{:02d}.csv".format(
         NOW.year, NOW.day, NOW.month
     )
     write_log("group {} records, {} entities".format(len(do_group), group_elts), log)
+    groups = [
+        (label_to.eid, [ol.eid for ol in other_labels], label_to, other_labels)
+        for label_to, other_labels in do_group.items()
+    ]
+    start = time.perf_counter()
     with cnx.allow_all_hooks_but(
         "reindex-suggest-es",
     ):
-        with open(group_filepath, "w") as fp:
-            writer = csv.writer(fp)
-            for idx, (label_to, other_labels) in enumerate(do_group.items()):
-                target = cnx.entity_from_eid(label_to.eid)
-                sources = [cnx.entity_from_eid(ol.eid) for ol in other_labels]
-                sources_info = [ol.encoded_label for ol in other_labels]
-                line = [label_to.encoded_label] + sources_info
-                writer.writerow(line)
-                write_log(
-                    "idx: {}, target: {}, source: {}".format(
-                        idx, label_to.encoded_label, ", ".join(sources_info)
-                    ),
-                    log,
+        grouped, failed = group_authorities(cnx, groups, log, batch_size=batch_size)
+    write_log(
+        "grouped {} records in {:.1f}s, {} failed".format(
+            len(groups) - len(failed), time.perf_counter() - start, len(failed)
+        ),
+        log,
+    )
+    failed = {id(group) for group in failed}
+    with open(group_filepath, "w") as fp:
+        writer = csv.writer(fp)
+        for group in groups:
+            if id(group) not in failed:
+                _, _, label_to, other_labels = group
+                writer.writerow(
+                    [label_to.encoded_label] + [ol.encoded_label for ol in other_labels]
                 )
-                target.group([ol.eid for ol in other_labels])
-                cnx.commit()
-                update_suggest_es(cnx, [target] + sources)
+    reindex_grouped_authorities(cnx, grouped, log)
 
 
 def process_candidates(all_candidates):
@@ -248,9 +351,9 @@ def process_candidates(all_candidates):
         sorted_candidates[candidate.simplified_label].append(candidate)
     for label, candidates in list(sorted_candidates.items()):
         if len(candidates) == 1:
-            do_not_group[label] = sorted(
-                all_candidates, key=lambda x: x.simplified_label == label, reverse=True
-            )
+            # the single candidate first, followed by all other candidates
+            single = candidates[0]
+            do_not_group[label] = [single] + [c for c in all_candidates if c is not single]
             continue
         candidates = sorted(candidates, key=lambda x: x.score, reverse=True)
         standard = candidates.pop(0)
@@ -273,55 +376,57 @@ def process_candidates(all_candidates):
 
 
 class CountryLabel(object):
-    def __init__(self, cnx, entity, label):
-        self.eid = entity.eid
+    def __init__(self, cnx, eid, label, count=0):
+        self.eid = eid
         self.label = label
-        self.score = self.compute_score(entity)
+        self.score = count
         self.encoded_label = label.encode("utf-8")
         url = "{}location".format(cnx.base_url())
         self.candidate_info = "{}{}{}".format(
             self.encoded_label, CANDIDATE_SEP, "{}/{}".format(url, self.eid)
         )
 
-    def compute_score(self, entity):
-        serializer = entity.cw_adapt_to("ISuggestIndexSerializable")
-        if serializer:
-            json = serializer.serialize()
-            return json["count"]
-        return 0
+
+def documents_count(cnx, eids):
+    """Return a {eid: number of documents} dict for LocationAuthority `eids`"""
+    if not eids:
+        return {}
+    rows = cnx.system_sql(documents_count_query, {"eids": [int(eid) for eid in eids]}).fetchall()
+    return {str(eid): count for eid, count in rows}
 
 
-def process_countries(cnx, auth_label, auth_eid, countries_to_group):
+def process_countries(auth_label, auth_eid, countries, countries_to_group):
     """to be grouped, country labels must be identical"""
-    geodata = Geodata(cnx)
     try:
         label = simplify(auth_label)
     except ValueError:
         # non ascii characters
         label = auth_label
-    if label in list(geodata.simplified_countries.values()):
-        countries_to_group[label].append(
-            CountryLabel(cnx, cnx.entity_from_eid(auth_eid), auth_label)
-        )  # noqa
+    if label in countries:
+        countries_to_group[label].append((auth_eid, auth_label))
         return True
     return False
 
 
 def compute_location_authorities_to_group(cnx, log=None):
-    geodata = Geodata(cnx)
+    geodata = cached_geodata(cnx)
     do_group = defaultdict(list)
     do_not_group = defaultdict(list)
     countries_to_group = defaultdict(list)
     rset = cnx.system_sql(query).fetchall()  # noqa
     write_log("found {} LocationAuthorities candidates to group".format(len(rset)), log)
-    countries = geodata.simplified_countries.values()
+    countries = set(geodata.simplified_countries.values())
+    departments = set(geodata.simplified_departments.values())
+    regions = set(geodata.simplified_regions.values()) | set(
+        geodata.simplified_historic_regions.values()
+    )
     for items, geonames_url in rset:
         to_be_grouped = []
         candidates = []
         for auth_label, auth_eid, auth_quality in items:
             m = CONTEXT_RE.search(auth_label)
             if not m:
-                process_countries(cnx, auth_label, auth_eid, countries_to_group)
+                process_countries(auth_label, auth_eid, countries, countries_to_group)
                 continue
             elif m.group(3):
                 # got something after brackets
@@ -342,20 +447,13 @@ def compute_location_authorities_to_group(cnx, log=None):
             for ind, token in enumerate(tokens, 1):
                 token = simplify(token)
                 dpt_name = (
-                    token
-                    if token in list(geodata.simplified_departments.values())
-                    else geodata.simplified_departments.get(token)
+                    token if token in departments else geodata.simplified_departments.get(token)
                 )
                 if dpt_name:
                     data["dpt_name"] = dpt_name
                     dpt = ind
                     continue
-                simplified_regions = list(geodata.simplified_regions.values()) + list(
-                    geodata.simplified_historic_regions.values()
-                )
-                region_name = (
-                    token if token in simplified_regions else geodata.simplified_regions.get(token)
-                )
+                region_name = token if token in regions else geodata.simplified_regions.get(token)
                 if region_name:
                     data["region_name"] = region_name
                     region = ind
@@ -389,11 +487,17 @@ def compute_location_authorities_to_group(cnx, log=None):
                     do_group[validated[0]] = validated[1:]
             for rejected in list(not_to_be_grouped.values()):
                 do_not_group[rejected[0]] = list(set(rejected[1:]))
-    # process countries
-    for country, candidates in list(countries_to_group.items()):
-        if len(candidates) > 1:
-            candidates = sorted(candidates, key=lambda x: x.score, reverse=True)
-            do_group[candidates[0]] = candidates[1:]
+    # process countries, ordered by their number of documents
+    countries_to_group = {
+        country: items for country, items in countries_to_group.items() if len(items) > 1
+    }
+    counts = documents_count(
+        cnx, [eid for items in countries_to_group.values() for eid, _ in items]
+    )
+    for country, items in countries_to_group.items():
+        candidates = [CountryLabel(cnx, eid, label, counts.get(eid, 0)) for eid, label in items]
+        candidates = sorted(candidates, key=lambda x: x.score, reverse=True)
+        do_group[candidates[0]] = candidates[1:]
     final_count = len(do_group)
     all_count = final_count + sum([len(i) for i in list(do_group.values())])
     write_log(
@@ -44,10 +44,13 @@ import os.path as osp
 from functools import partial
 import tqdm
 
-from cubicweb_frarchives_edition import update_suggest_es
+from cubicweb_frarchives_edition.entities.sync import SuggestIndexBuffer
 
 NOW = datetime.now()
 
+# number of grouped authorities after which the suggest indexes are updated
+SUGGEST_FLUSH_SIZE = 1000
+
 query = """
  WITH T as (
     SELECT
@@ -85,29 +88,48 @@ def write_log(msg, log=None):
         print(msg)
 
 
+def flush_suggest_buffer(cnx, suggest_buffer):
+    if cnx.vreg.config.mode == "test":
+        return
+    try:
+        suggest_buffer.flush()
+    except Exception:
+        import traceback
+
+        traceback.print_exc()
+
+
 def group_candidates(cnx, candidates, log, limitdoc):
     progress_bar = _tqdm(total=len(candidates))
     write_log(f"Limit docs set to {limitdoc}")
-    for items in candidates:
-        # we group items[1:] with items[0].
-        # Only group items having documents number (item[2]) below limitdoc
-        sub_items = [item for item in items[1:] if int(item[2]) < limitdoc]
-        if not sub_items:
-            continue
-        items = [items[0]] + sub_items
-        eids = [item[0] for item in items]
-        target = cnx.entity_from_eid(eids.pop(0))
-        write_log("grouping {} with {}".format(target.absolute_url(), eids))
-        target.group(eids)
-        cnx.commit()
-        try:
-            progress_bar.update()
-        except Exception:
-            pass
-        write_log("grouped")
-        update_suggest_es(cnx, [target] + [cnx.entity_from_eid(eid) for eid in eids])
-        # remove all cnx.transaction_data cache
-        cnx.drop_entity_cache()
+    # reindex grouped authorities by chunks instead of after each group
+    suggest_buffer = SuggestIndexBuffer(cnx)
+    try:
+        for items in candidates:
+            # we group items[1:] with items[0].
+            # Only group items having documents number (item[2]) below limitdoc
+            sub_items = [item for item in items[1:] if int(item[2]) < limitdoc]
+            if not sub_items:
+                continue
+            items = [items[0]] + sub_items
+            eids = [item[0] for item in items]
+            target = cnx.entity_from_eid(eids.pop(0))
+            write_log("grouping {} with {}".format(target.absolute_url(), eids))
+            target.group(eids)
+            cnx.commit()
+            try:
+                progress_bar.update()
+            except Exception:
+                pass
+            write_log("grouped")
+            suggest_buffer.add([target.eid] + eids)
+            if len(suggest_buffer) >= SUGGEST_FLUSH_SIZE:
+                flush_suggest_buffer(cnx, suggest_buffer)
+            # remove all cnx.transaction_data cache
+            cnx.drop_entity_cache()
+    finally:
+        # committed groups must be reindexed even if a later one fails
+        flush_suggest_buffer(cnx, suggest_buffer)
 
 
 _tqdm = partial(tqdm.tqdm, disable=None)
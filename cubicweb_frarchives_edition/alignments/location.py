@@ -30,6 +30,7 @@
 #
 from collections import defaultdict
 import logging
+import threading
 
 import os.path as osp
 import difflib
@@ -109,6 +110,7 @@ class Geodata(object):
             placeholder = "%s"
         if force:
             self.cnx.system_sql("DROP TABLE IF EXISTS geodata")
+            clear_geodata_cache()
         sql = """CREATE TABLE IF NOT EXISTS geodata AS (
             SELECT geonames.geonameid,coalesce(altnames.alternate_name, name) as name,
                    fclass,fcode,country_code, admin1_code,admin2_code,admin4_code
@@ -126,23 +128,23 @@ class Geodata(object):
         self.cnx.system_sql("""CREATE INDEX IF NOT EXISTS geodata_fclass_idx ON geodata(fclass)""")
         self.cnx.system_sql("""CREATE INDEX IF NOT EXISTS geodata_fcode_idx ON geodata(fcode)""")
         self.cnx.commit()
-        self._cities = {}
-        self._simplified_cities = {}
-        self._departments = {}
-        self._blacklist = {}
-        self._simplified_departments = {}
-        self._simplified_blacklist = {}
-        self._regions = {}
-        self._simplified_regions = {}
-        self._simplified_historic_regions = {}
-        self._countries = {}
-        self._simplified_countries = {}
-        self._simplified_altcountries_codes = {}
+        self._cities = None
+        self._simplified_cities = None
+        self._departments = None
+        self._blacklist = None
+        self._simplified_departments = None
+        self._simplified_blacklist = None
+        self._regions = None
+        self._simplified_regions = None
+        self._simplified_historic_regions = None
+        self._countries = None
+        self._simplified_countries = None
+        self._simplified_altcountries_codes = None
 
     @property
     def cities(self):
         """Map of cities."""
-        if not self._cities:
+        if self._cities is None:
             # admin4_code is not unique if historic towns are included as well
             # in our case, only Val-Couesnon (ADM4) and
             # Saint-Ouen-la-Rouërie (ADM4H) share admin4_code
@@ -160,14 +162,14 @@ class Geodata(object):
     @property
     def simplified_cities(self):
         """Map of simplified cities."""
-        if not self._simplified_cities:
+        if self._simplified_cities is None:
             self._simplified_cities = {code: simplify(name) for (code, name) in self.cities.items()}
         return self._simplified_cities
 
     @property
     def departments(self):
         """Map of departments."""
-        if not self._departments:
+        if self._departments is None:
             rows = self.cnx.system_sql(
                 r"""
                 SELECT admin2_code,
@@ -190,7 +192,7 @@ class Geodata(object):
     def blacklist(self):
         """Map of departments
         (related to https://extranet.logilab.fr/ticket/67923708)."""
-        if not self._blacklist:
+        if self._blacklist is None:
             self._blacklist = {
                 code: name
                 for code, name in self.departments.items()
@@ -201,7 +203,7 @@ class Geodata(object):
     @property
     def simplified_departments(self):
         """Map of simplified departments."""
-        if not self._simplified_departments:
+        if self._simplified_departments is None:
             self._simplified_departments = {
                 code: simplify(name) for (code, name) in self.departments.items()
             }
@@ -211,7 +213,7 @@ class Geodata(object):
     def simplified_blacklist(self):
         """Map of simplified departments
         (related to https://extranet.logilab.fr/ticket/67923708)."""
-        if not self._simplified_blacklist:
+        if self._simplified_blacklist is None:
             self._simplified_blacklist = {
                 code: simplify(name) for code, name in self.blacklist.items()
             }
@@ -220,7 +222,7 @@ class Geodata(object):
     @property
     def regions(self):
         """Map of regions (not including overseas departments)."""
-        if not self._regions:
+        if self._regions is None:
             rows = self.cnx.system_sql(
                 """SELECT admin1_code,name FROM geodata WHERE fclass='A'
                 AND fcode='ADM1'"""
@@ -231,7 +233,7 @@ class Geodata(object):
     @property
     def simplified_regions(self):
         """Map of simplified regions."""
-        if not self._simplified_regions:
+        if self._simplified_regions is None:
             self._simplified_regions = {
                 code: simplify(name) for (code, name) in list(self.regions.items())
             }
@@ -240,7 +242,7 @@ class Geodata(object):
     @property
     def simplified_historic_regions(self):
         """Map of simplified historic regions."""
-        if not self._simplified_historic_regions:
+        if self._simplified_historic_regions is None:
             self._simplified_historic_regions = {
                 code: simplify(name) for (name, code) in list(self.HISTORIC_REGIONS.items())
             }
@@ -252,7 +254,7 @@ class Geodata(object):
 
         ishistoric is True if historic name NULL else
         """
-        if not self._countries:
+        if self._countries is None:
             rows = self.cnx.system_sql(
                 """SELECT temp.alternate_name,geonames.country_code
                 FROM (
@@ -270,7 +272,7 @@ class Geodata(object):
     @property
     def simplified_countries(self):
         """Map of simplified countries in French."""
-        if not self._simplified_countries:
+        if self._simplified_countries is None:
             self._simplified_countries = {
                 code: simplify(name) for (code, name) in self.countries.items()
             }
@@ -279,7 +281,7 @@ class Geodata(object):
     @property
     def simplified_altcountries_codes(self):
         """Map of simplified countries names in French with all alterantive names."""
-        if not self._simplified_altcountries_codes:
+        if self._simplified_altcountries_codes is None:
             rows = self.cnx.system_sql(
                 """SELECT coalesce(temp.alternate_name, geonames.name) as name,geonames.country_code
                 FROM (
@@ -295,6 +297,81 @@ class Geodata(object):
             }
         return self._simplified_altcountries_codes
 
+    # lookup maps computed by `load_maps`
+    MAPS = (
+        "cities",
+        "simplified_cities",
+        "departments",
+        "blacklist",
+        "simplified_departments",
+        "simplified_blacklist",
+        "regions",
+        "simplified_regions",
+        "simplified_historic_regions",
+        "countries",
+        "simplified_countries",
+        "simplified_altcountries_codes",
+    )
+
+    def load_maps(self):
+        """Compute all lookup maps at once."""
+        for name in self.MAPS:
+            getattr(self, name)
+
+
+# process-level (version, Geodata) entries, see `cached_geodata`
+_GEODATA_CACHE = {}
+_GEODATA_LOCK = threading.Lock()
+
+
+def geodata_version(cnx):
+    """Return the oids of the tables Geodata is computed from.
+
+    They change whenever these tables are rebuilt, i.e. when geonames are
+    loaded (tables are swapped and ``geodata`` is dropped) or when ``geodata``
+    is recreated.
+    """
+    return tuple(
+        cnx.system_sql(
+            """SELECT to_regclass('geonames')::oid, to_regclass('geonames_altnames')::oid,
+            to_regclass('geodata')::oid"""
+        ).fetchone()
+    )
+
+
+def cached_geodata(cnx, country_code="FR", isolanguage="fr"):
+    """Return a Geodata shared by the whole process.
+
+    The ``geodata`` table is only initialized once and all the maps are
+    computed when the instance is built, so that the shared instance never
+    queries the database afterwards and can be used from any thread.
+
+    The instance is built again when the geonames tables have been rebuilt,
+    possibly by another process (see `geodata_version`).
+
+    :param Connection cnx: CubicWeb database connection
+    """
+    key = (cnx.repo, country_code, isolanguage)
+    version = geodata_version(cnx)
+    entry = _GEODATA_CACHE.get(key)
+    if entry is None or entry[0] != version:
+        with _GEODATA_LOCK:
+            entry = _GEODATA_CACHE.get(key)
+            if entry is None or entry[0] != version:
+                geodata = Geodata(cnx, country_code=country_code, isolanguage=isolanguage)
+                geodata.load_maps()
+                # do not keep a connection which may be used by another thread or closed
+                geodata.cnx = None
+                # geodata table may have been created by Geodata
+                entry = (geodata_version(cnx), geodata)
+                _GEODATA_CACHE[key] = entry
+    return entry[1]
+
+
+def clear_geodata_cache():
+    """Forget Geodata instances returned by `cached_geodata`."""
+    _GEODATA_CACHE.clear()
+
 
 def create_geonames_label(name, admin1, admin2, geodata):
     """Create GeoNames label.
@@ -28,7 +28,11 @@
 # The fact that you are presently reading this means that you have had
 # knowledge of the CeCILL-C license and that you accept its terms.
 #
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from contextlib import contextmanager
+import os
+import os.path as osp
+import time
 
 from jinja2 import Environment, PackageLoader
 
@@ -38,6 +42,30 @@ import psycopg2
 
 from cubicweb_francearchives import admincnx
 
+from cubicweb_frarchives_edition.alignments.location import clear_geodata_cache
+
+# data files are copied into staging tables by segments of GEODATA_CHUNK_SIZE
+# bytes, using GEODATA_LOAD_WORKERS concurrent connections
+GEODATA_CHUNK_SIZE = 64 * 1024 * 1024
+GEODATA_LOAD_WORKERS = 4
+
+# segments already copied into staging tables, used to resume an interrupted
+# load. This table is unlogged as the staging tables, so that both are emptied
+# together by a crash recovery
+LOADED_SEGMENTS_TABLE = "geodata_loaded_segments"
+
+GEONAMES_TABLES = (
+    "geonames",
+    "geonames_altnames",
+    "adm4_geonames",
+    "adm3_geonames",
+    "adm2_geonames",
+    "adm1_geonames",
+    "country_geonames",
+)
+
+BANO_TABLES = ("bano_whitelisted",)
+
 
 class LoggedCursor(object):
     def __init__(self, crs):
@@ -76,43 +104,261 @@ def table_exists(dbparams, tablename):
             return True
 
 
-def load_geonames_tables(appid, dbparams, allcountries_path, altnames_path, table_owner=None):
-    """Create and populate Geonames table.
+def render_template(name, **kwargs):
+    env = Environment(
+        loader=PackageLoader("cubicweb_frarchives_edition", "alignments/templates"),
+    )
+    return env.get_template(name).render(**kwargs)
 
-    :param Connection cnx: connection to CubicWeb database
-    :param str allcountries_path: path to allCountries.txt file
-    :param str altnames_path: path to alternateNames.txt file
+
+class FileSegment(object):
+    """read-only file object limited to the [start, end[ bytes of `path`"""
+
+    def __init__(self, path, start, end):
+        self.fp = open(path, "rb")
+        self.fp.seek(start)
+        self.remaining = end - start
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fp.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fp.readline(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def file_segments(path, chunk_size=GEODATA_CHUNK_SIZE):
+    """split `path` in segments of about `chunk_size` bytes ending with a new line
+
+    :returns: list of (start, end) offsets
     """
+    size = os.path.getsize(path)
+    segments = []
+    start = 0
+    with open(path, "rb") as fp:
+        while start < size:
+            fp.seek(min(start + chunk_size, size))
+            fp.readline()
+            end = min(fp.tell(), size)
+            segments.append((start, end))
+            start = end
+    return segments
+
 
-    env = Environment(loader=PackageLoader("cubicweb_frarchives_edition", "alignments/templates"),)
-    env.filters["sqlstr"] = lambda x: "'{}'".format(x)  # noqa
-    geonames_template = env.get_template("geonames.sql")
-    geonames_sqlcode = geonames_template.render(
-        allcountries_path=allcountries_path, altnames_path=altnames_path, owner=table_owner
+def file_signature(path):
+    """identify the version of `path` whose segments have been loaded"""
+    stat = os.stat(path)
+    return "{}:{}:{}".format(osp.abspath(path), stat.st_size, int(stat.st_mtime))
+
+
+def create_loaded_segments_table(crs):
+    crs.execute(
+        f"""CREATE UNLOGGED TABLE IF NOT EXISTS {LOADED_SEGMENTS_TABLE} (
+            tablename varchar(64), signature text, segment integer, rows bigint,
+            PRIMARY KEY (tablename, segment)
+        )"""
     )
+
+
+def reset_staging_table(crs, tablename):
+    crs.execute(f"TRUNCATE {tablename}")
+    crs.execute(f"DELETE FROM {LOADED_SEGMENTS_TABLE} WHERE tablename = %s", (tablename,))
+
+
+def loaded_segments(dbparams, tablename, signature):
+    """return segments of the file identified by `signature` already copied into
+    the `tablename` staging table
+
+    Segments of another file are forgotten and the staging table is emptied.
+    """
     with transaction(psycopg2.connect(**dbparams)) as crs:
-        crs.execute(geonames_sqlcode)
+        create_loaded_segments_table(crs)
+        crs.execute(
+            f"SELECT segment, signature FROM {LOADED_SEGMENTS_TABLE} WHERE tablename = %s",
+            (tablename,),
+        )
+        rows = crs.fetchall()
+        if all(segment_signature == signature for _, segment_signature in rows):
+            return {segment for segment, _ in rows}
+        print("\n-> {} contains another file, truncate it".format(tablename))
+        reset_staging_table(crs, tablename)
+        return set()
+
+
+def copy_segment(dbparams, tablename, copy_options, path, signature, segment, start, end):
+    """copy the [start, end[ bytes of `path` into `tablename` and record the
+    segment as loaded in the same transaction
+
+    :returns: number of copied rows and elapsed time
+    """
+    begin = time.time()
+    cnx = psycopg2.connect(**dbparams)
+    try:
+        with transaction(cnx) as crs, FileSegment(path, start, end) as fp:
+            crs.copy_expert(f"COPY {tablename} FROM STDIN {copy_options}", fp)
+            rows = crs.rowcount
+            crs.execute(
+                f"""INSERT INTO {LOADED_SEGMENTS_TABLE} (tablename, signature, segment, rows)
+                VALUES (%s, %s, %s, %s)""",
+                (tablename, signature, segment, rows),
+            )
+    finally:
+        cnx.close()
+    return rows, time.time() - begin
+
+
+def load_file(
+    dbparams,
+    tablename,
+    path,
+    copy_options="",
+    workers=GEODATA_LOAD_WORKERS,
+    chunk_size=GEODATA_CHUNK_SIZE,
+):
+    """copy `path` into the `tablename` staging table by segments, in parallel
+
+    Segments copied by a previous run on the same file are skipped.
+
+    :returns: number of copied rows
+    """
+    signature = file_signature(path)
+    segments = file_segments(path, chunk_size)
+    done = loaded_segments(dbparams, tablename, signature)
+    todo = [(idx, start, end) for idx, (start, end) in enumerate(segments) if idx not in done]
+    print(
+        "\n-> copy {0} into {1}: {2}/{3} segments to load".format(
+            path, tablename, len(todo), len(segments)
+        )
+    )
+    begin = time.time()
+    total = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                copy_segment, dbparams, tablename, copy_options, path, signature, idx, start, end
+            ): idx
+            for idx, start, end in todo
+        }
+        for future in as_completed(futures):
+            rows, elapsed = future.result()
+            total += rows
+            print(
+                "    segment {0}/{1}: {2} rows ({3:.0f} rows/s)".format(
+                    futures[future] + 1, len(segments), rows, rows / max(elapsed, 0.001)
+                )
+            )
+    elapsed = time.time() - begin
+    print(
+        "    {0} rows copied into {1} in {2:.0f}s ({3:.0f} rows/s)".format(
+            total, tablename, elapsed, total / max(elapsed, 0.001)
+        )
+    )
+    return total
+
+
+def swap_tables(crs, tablenames, owner=None):
+    """replace `tablenames` by the `<tablename>_new` tables built from the staging
+    tables, renaming their indexes accordingly"""
+    crs.execute("DROP TABLE IF EXISTS {} CASCADE".format(", ".join(tablenames)))
+    for tablename in tablenames:
+        new_tablename = f"{tablename}_new"
+        crs.execute(f"ALTER TABLE {new_tablename} RENAME TO {tablename}")
+        crs.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", (tablename,))
+        for (indexname,) in crs.fetchall():
+            if indexname.startswith(new_tablename):
+                crs.execute(
+                    "ALTER INDEX {} RENAME TO {}".format(
+                        indexname, tablename + indexname[len(new_tablename) :]
+                    )
+                )
+        if owner:
+            crs.execute(f"ALTER TABLE {tablename} OWNER TO {owner}")
+
+
+def drop_staging_tables(crs, tablenames):
+    crs.execute("DROP TABLE IF EXISTS {}".format(", ".join(tablenames)))
+    crs.execute(
+        f"DELETE FROM {LOADED_SEGMENTS_TABLE} WHERE tablename = ANY(%s)", (list(tablenames),)
+    )
+
+
+def print_rowcounts(appid, tablenames):
     with admincnx(appid) as cnx:
-        for tablename in ("geonames", "geonames_altnames"):
+        for tablename in tablenames:
             rowcount = cnx.system_sql(
                 "SELECT count(*) FROM {0} LIMIT 1".format(tablename)
             ).fetchall()[0][0]
             print("\n-> {0} rows created in {1} table".format(rowcount, tablename))
 
 
-def load_bano_tables(appid, dbparams, path, table_owner=None):
+def load_geonames_tables(
+    appid,
+    dbparams,
+    allcountries_path,
+    altnames_path,
+    table_owner=None,
+    workers=GEODATA_LOAD_WORKERS,
+):
+    """Create and populate Geonames table.
+
+    Files are first copied into unlogged staging tables, which allows to resume
+    an interrupted load. Tables and their indexes are then built from the staging
+    tables and swapped with the current ones in a single transaction.
+
+    :param Connection cnx: connection to CubicWeb database
+    :param str allcountries_path: path to allCountries.txt file
+    :param str altnames_path: path to alternateNames.txt file
+    """
+    with transaction(psycopg2.connect(**dbparams)) as crs:
+        crs.execute(render_template("geonames_staging.sql"))
+    for tablename, path in (
+        ("geonames_staging", allcountries_path),
+        ("geonames_altnames_staging", altnames_path),
+    ):
+        load_file(dbparams, tablename, path, "(NULL '')", workers=workers)
+    print("\n-> build geonames tables")
+    with transaction(psycopg2.connect(**dbparams)) as crs:
+        crs.execute(render_template("geonames.sql"))
+        swap_tables(crs, GEONAMES_TABLES, owner=table_owner)
+        # geodata is computed from the geonames tables
+        crs.execute("DROP TABLE IF EXISTS geodata")
+        drop_staging_tables(crs, ("geonames_staging", "geonames_altnames_staging"))
+    clear_geodata_cache()
+    print_rowcounts(appid, ("geonames", "geonames_altnames"))
+
+
+def load_bano_tables(appid, dbparams, path, table_owner=None, workers=GEODATA_LOAD_WORKERS):
     """Create and populate BANO table.
 
+    The file is loaded as Geonames files, see `load_geonames_tables`.
+
     :param Connection cnx: connection to CubicWeb database
     :param str path: path to data file
     """
-    env = Environment(loader=PackageLoader("cubicweb_frarchives_edition", "alignments/templates"),)
-    template = env.get_template("bano_whitelisted.sql")
     with transaction(psycopg2.connect(**dbparams)) as crs:
-        crs.execute(template.render(path=path, owner=table_owner))
-    with admincnx(appid) as cnx:
-        for tablename in ("bano_whitelisted",):
-            rowcount = cnx.system_sql(
-                "SELECT count(*) FROM {0} LIMIT 1".format(tablename)
-            ).fetchall()[0][0]
-        print("\n-> {0} rows created in {1} table".format(rowcount, tablename))
+        crs.execute(render_template("bano_staging.sql"))
+    load_file(
+        dbparams, "bano_staging", path, "WITH (FORMAT CSV, DELIMITER ',', NULL '')", workers=workers
+    )
+    print("\n-> build bano tables")
+    with transaction(psycopg2.connect(**dbparams)) as crs:
+        crs.execute(render_template("bano_whitelisted.sql"))
+        swap_tables(crs, BANO_TABLES, owner=table_owner)
+        drop_staging_tables(crs, ("bano_staging",))
+    print_rowcounts(appid, BANO_TABLES)
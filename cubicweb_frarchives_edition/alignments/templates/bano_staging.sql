@@ -0,0 +1,10 @@
+CREATE UNLOGGED TABLE IF NOT EXISTS bano_staging (      -- raw BANO dataset, kept until bano_whitelisted is built
+    banoid varchar(200),
+    numero varchar(20),
+    voie varchar(200),
+    code_post varchar(10),
+    nom_comm varchar(200),
+    source varchar(10),
+    lat double precision,
+    lon double precision
+);
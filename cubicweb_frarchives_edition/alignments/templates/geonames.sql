@@ -26,87 +26,39 @@
 --
 -- The fact that you are presently reading this means that you have had
 -- knowledge of the CeCILL-C license and that you accept its terms.
---
-
-CREATE EXTENSION IF NOT EXISTS pg_trgm;
-CREATE EXTENSION IF NOT EXISTS unaccent;
-
--- ALTER FUNCTION unaccent(text) IMMUTABLE;
-
-CREATE OR REPLACE FUNCTION f_unaccent(text)
-RETURNS text AS
-$func$
-SELECT public.unaccent('public.unaccent', $1)  -- schema-qualify function and dictionary
-$func$  LANGUAGE sql IMMUTABLE;
-
-drop table if exists geonames CASCADE;
-
-create table geonames (
-  geonameid integer PRIMARY KEY,
-  name varchar(200),
-  asciiname varchar(200),
-  alternatenames varchar(20000),
-  latitude double precision,
-  longitude double precision,
-  fclass char(1),
-  fcode varchar(10),
-  country_code varchar(2),
-  cc2 varchar(200),
-  admin1_code varchar(20),
-  admin2_code varchar(80),
-  admin3_code varchar(20),
-  admin4_code varchar(20),
-  population bigint,
-  elevation int,
-  dem int,
-  timezone varchar(40),
-  moddate date
-);
-
-
-COPY geonames from '{{ allcountries_path }}' null as '';
-
-CREATE INDEX geonames_fcode_idx ON geonames(fcode);
-CREATE INDEX geonames_name_idx ON geonames(name);
-CREATE INDEX geonames_admin2code_idx ON geonames(admin2_code);
-CREATE INDEX geonames_country_code_idx ON geonames(country_code);
-CREATE INDEX geonames_fclass_idx ON geonames(fclass);
 
+-- build the geonames tables from the staging tables, see geonames_staging.sql.
+-- Tables and indexes are suffixed with "_new" until they are swapped with the
+-- current ones
 
-DROP TABLE IF EXISTS adm4_geonames;
-DROP TABLE IF EXISTS adm3_geonames;
-DROP TABLE IF EXISTS adm2_geonames;
-DROP TABLE IF EXISTS adm1_geonames;
-DROP TABLE IF EXISTS country_geonames;
+DROP TABLE IF EXISTS geonames_altnames_new;
+DROP TABLE IF EXISTS adm4_geonames_new;
+DROP TABLE IF EXISTS adm3_geonames_new;
+DROP TABLE IF EXISTS adm2_geonames_new;
+DROP TABLE IF EXISTS adm1_geonames_new;
+DROP TABLE IF EXISTS country_geonames_new;
+DROP TABLE IF EXISTS geonames_new;
 
+CREATE TABLE geonames_new AS SELECT * FROM geonames_staging;
 
-CREATE TABLE adm4_geonames AS SELECT * FROM geonames WHERE fcode='ADM4' AND country_code='FR';
-CREATE TABLE adm3_geonames AS SELECT * FROM geonames WHERE fcode='ADM3' AND country_code='FR';
-CREATE TABLE adm2_geonames AS SELECT * FROM geonames WHERE fcode='ADM2' AND country_code='FR';
-CREATE TABLE adm1_geonames AS SELECT * FROM geonames WHERE fcode='ADM1' AND country_code='FR';
-CREATE TABLE country_geonames AS SELECT * FROM geonames WHERE fcode='PCLI';
+ALTER TABLE geonames_new ADD PRIMARY KEY (geonameid);
+CREATE INDEX geonames_new_fcode_idx ON geonames_new(fcode);
+CREATE INDEX geonames_new_name_idx ON geonames_new(name);
+CREATE INDEX geonames_new_admin2code_idx ON geonames_new(admin2_code);
+CREATE INDEX geonames_new_country_code_idx ON geonames_new(country_code);
+CREATE INDEX geonames_new_fclass_idx ON geonames_new(fclass);
 
-DROP TABLE IF EXISTS geonames_altnames;
 
-CREATE TEMPORARY TABLE tmp_geonames_altnames (
-    alternateNameId integer  PRIMARY KEY,
-    geonameid integer not null,
-    isolanguage varchar(7),
-    alternate_name varchar(400),
-    isPreferredName boolean,
-    isShortName boolean,
-    isColloquial boolean,
-    isHistoric boolean
-);
-
-COPY tmp_geonames_altnames from '{{ altnames_path }}' null as '';
-
-CREATE INDEX tmp_geonames_altnames_isolanguage_idx ON tmp_geonames_altnames(isolanguage);
+CREATE TABLE adm4_geonames_new AS SELECT * FROM geonames_new WHERE fcode='ADM4' AND country_code='FR';
+CREATE TABLE adm3_geonames_new AS SELECT * FROM geonames_new WHERE fcode='ADM3' AND country_code='FR';
+CREATE TABLE adm2_geonames_new AS SELECT * FROM geonames_new WHERE fcode='ADM2' AND country_code='FR';
+CREATE TABLE adm1_geonames_new AS SELECT * FROM geonames_new WHERE fcode='ADM1' AND country_code='FR';
+CREATE TABLE country_geonames_new AS SELECT * FROM geonames_new WHERE fcode='PCLI';
 
 
-CREATE TABLE geonames_altnames (
+CREATE TABLE geonames_altnames_new (
     alternateNameId integer PRIMARY KEY,
-    geonameid integer references geonames(geonameid),
+    geonameid integer references geonames_new(geonameid),
     isolanguage varchar(7),
     alternate_name varchar(400),
     isPreferredName boolean,
@@ -116,7 +68,7 @@ CREATE TABLE geonames_altnames (
     rank integer
 );
 
-INSERT INTO geonames_altnames
+INSERT INTO geonames_altnames_new
 SELECT tmp.alternateNameId,
        tmp.geonameid,
        tmp.isolanguage,
@@ -138,21 +90,15 @@ FROM (SELECT
         -- add the rank column to get the preferred label easely
         ROW_NUMBER() OVER (PARTITION BY geonameid, isolanguage
         ORDER BY isPreferredName DESC NULLS LAST, isShortName) rank
-      FROM tmp_geonames_altnames) as tmp
-JOIN geonames AS geo
+      FROM geonames_altnames_staging
+      -- ranks are computed by language, only keep french names
+      WHERE isolanguage = 'fr') as tmp
+JOIN geonames_new AS geo
 ON geo.geonameid = tmp.geonameid
-AND geo.fclass IN ('A', 'P')
-AND tmp.isolanguage = 'fr';
-
-CREATE INDEX geonames_altnames_geonameid_idx ON geonames_altnames USING btree(geonameid);
-CREATE INDEX geonames_altnames_isolanguage_idx ON geonames_altnames(isolanguage);
-CREATE INDEX geonames_altnames_rank_idx ON geonames_altnames(rank);
-CREATE INDEX geonames_altnames_name_gin_idx ON geonames_altnames USING gin (alternate_name gin_trgm_ops);
-CREATE INDEX geonames_altnames_name_lower_unaccent_gin_idx ON geonames_altnames USING gin (lower(f_unaccent((alternate_name)::text)) gin_trgm_ops);
-
-drop table geodata;
+AND geo.fclass IN ('A', 'P');
 
-{% if owner %}
-ALTER TABLE geonames OWNER TO {{ owner }};
-ALTER TABLE geonames_altnames OWNER TO {{ owner }};
-{% endif %}
+CREATE INDEX geonames_altnames_new_geonameid_idx ON geonames_altnames_new USING btree(geonameid);
+CREATE INDEX geonames_altnames_new_isolanguage_idx ON geonames_altnames_new(isolanguage);
+CREATE INDEX geonames_altnames_new_rank_idx ON geonames_altnames_new(rank);
+CREATE INDEX geonames_altnames_new_name_gin_idx ON geonames_altnames_new USING gin (alternate_name gin_trgm_ops);
+CREATE INDEX geonames_altnames_new_name_lower_unaccent_gin_idx ON geonames_altnames_new USING gin (lower(f_unaccent((alternate_name)::text)) gin_trgm_ops);
@@ -0,0 +1,75 @@
+--
+-- Copyright LOGILAB S.A. (Paris, FRANCE) 2016-2019
+-- Contact http://www.logilab.fr -- mailto:contact@logilab.fr
+--
+-- This software is governed by the CeCILL-C license under French law and
+-- abiding by the rules of distribution of free software. You can use,
+-- modify and/ or redistribute the software under the terms of the CeCILL-C
+-- license as circulated by CEA, CNRS and INRIA at the following URL
+-- "http://www.cecill.info".
+--
+-- As a counterpart to the access to the source code and rights to copy,
+-- modify and redistribute granted by the license, users are provided only
+-- with a limited warranty and the software's author, the holder of the
+-- economic rights, and the successive licensors have only limited liability.
+--
+-- In this respect, the user's attention is drawn to the risks associated
+-- with loading, using, modifying and/or developing or reproducing the
+-- software by the user in light of its specific status of free software,
+-- that may mean that it is complicated to manipulate, and that also
+-- therefore means that it is reserved for developers and experienced
+-- professionals having in-depth computer knowledge. Users are therefore
+-- encouraged to load and test the software's suitability as regards their
+-- requirements in conditions enabling the security of their systemsand/or
+-- data to be ensured and, more generally, to use and operate it in the
+-- same conditions as regards security.
+--
+-- The fact that you are presently reading this means that you have had
+-- knowledge of the CeCILL-C license and that you accept its terms.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- ALTER FUNCTION unaccent(text) IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION f_unaccent(text)
+RETURNS text AS
+$func$
+SELECT public.unaccent('public.unaccent', $1)  -- schema-qualify function and dictionary
+$func$  LANGUAGE sql IMMUTABLE;
+
+-- raw content of allCountries.txt and alternateNames.txt, kept until the
+-- geonames tables are built to resume an interrupted load
+
+CREATE UNLOGGED TABLE IF NOT EXISTS geonames_staging (
+  geonameid integer,
+  name varchar(200),
+  asciiname varchar(200),
+  alternatenames varchar(20000),
+  latitude double precision,
+  longitude double precision,
+  fclass char(1),
+  fcode varchar(10),
+  country_code varchar(2),
+  cc2 varchar(200),
+  admin1_code varchar(20),
+  admin2_code varchar(80),
+  admin3_code varchar(20),
+  admin4_code varchar(20),
+  population bigint,
+  elevation int,
+  dem int,
+  timezone varchar(40),
+  moddate date
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS geonames_altnames_staging (
+    alternateNameId integer,
+    geonameid integer,
+    isolanguage varchar(7),
+    alternate_name varchar(400),
+    isPreferredName boolean,
+    isShortName boolean,
+    isColloquial boolean,
+    isHistoric boolean
+);
@@ -31,12 +31,16 @@
 """cubicweb-frarchives-edition specific wikidata utils"""
 
 import json
+import re
+
 from cubicweb_francearchives import get_user_agent
 from cubicweb_frarchives_edition.alignments import SPARQLDatabase
 from cubicweb_frarchives_edition.alignments.utils import strptime
 
 WIKIDATA_PRECISION = {"9": "y", "10": "m", "11": "d"}
 
+WIKIDATA_ID_RE = re.compile(r"^Q\d+$")
+
 
 def compute_dates(datestr, precision):
     precision = WIKIDATA_PRECISION.get(precision)
@@ -92,12 +96,38 @@ class WikidataDatabase(SPARQLDatabase):
         }
         return self.execute(query)
 
-    def agent_infos(self, extid):
-        rset = self.agent_query(extid)
+    def agents_query(self, extids):
+        """query all `extids` at once, the first selected variable being the person URI.
+
+        Rows are sorted by person so that the first row of each person has the
+        lowest possible dates precision."""
+        query = """
+  PREFIX wikidata: <http://www.wikidata.org/entity/>
+
+  SELECT DISTINCT ?person ?personLabel ?birthdate ?deathdate ?birthprecision ?deathprecision ?personDesc WHERE {
+  VALUES ?person { %(values)s }
+  ?person rdfs:label ?personLabel.
+  FILTER langMatches( lang(?personLabel), "FR" ).
+
+  OPTIONAL{ ?person schema:description ?personDesc.
+            FILTER langMatches( lang(?personDesc), "FR" ).}
+  OPTIONAL { ?person p:P569/psv:P569 ?birth_date_node.  # birth date
+            ?birth_date_node wikibase:timePrecision ?birthprecision ; # birth date has specific day
+            wikibase:timeValue ?birthdate .
+  }
+  OPTIONAL { ?person p:P570/psv:P570 ?death_date_node.  # death date
+            ?death_date_node wikibase:timePrecision ?deathprecision ; # death date has specific day
+            wikibase:timeValue ?deathdate.
+  }
+
+} ORDER BY ?person ?birthprecision ?deathprecision""" % {  # noqa
+            "values": " ".join("wikidata:{}".format(extid) for extid in extids)
+        }
+        return self.execute(query)
+
+    def agent_infos_from_rows(self, rows):
         data_infos = {}
-        if not rset:
-            return data_infos
-        for label, birthdate, deathdate, birthprecision, deathprecision, description in rset:
+        for label, birthdate, deathdate, birthprecision, deathprecision, description in rows:
             data_infos["label"] = label
             dates = {}
             birthdate = compute_dates(birthdate, birthprecision)
@@ -110,3 +140,23 @@ class WikidataDatabase(SPARQLDatabase):
                 data_infos["description"] = description
             data_infos["dates"] = json.dumps(dates)
         return data_infos
+
+    def agent_infos(self, extid):
+        rset = self.agent_query(extid)
+        if not rset:
+            return {}
+        return self.agent_infos_from_rows(rset)
+
+    def agent_infos_batch(self, extids):
+        infos = {extid: {} for extid in extids}
+        extids = [extid for extid in extids if WIKIDATA_ID_RE.match(extid)]
+        if not extids:
+            return infos
+        rows = {}
+        for row in self.agents_query(extids):
+            # keep the first row of each person, as agent_query does
+            rows.setdefault(row[0].rsplit("/", 1)[-1], [row[1:]])
+        for extid, agent_rows in rows.items():
+            if extid in infos:
+                infos[extid] = self.agent_infos_from_rows(agent_rows)
+        return infos
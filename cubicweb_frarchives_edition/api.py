@@ -28,13 +28,17 @@
 # The fact that you are presently reading this means that you have had
 # knowledge of the CeCILL-C license and that you accept its terms.
 #
+from collections import OrderedDict
 from functools import wraps
+import hashlib
 import logging
 import json
+import threading
 
 from urllib3.exceptions import ProtocolError
 
 from cubicweb import NoResultError, ValidationError, Unauthorized
+from cubicweb.cwvreg import CW_EVENT_MANAGER
 
 from pyramid import httpexceptions
 from pyramid.view import view_config
@@ -61,6 +65,26 @@ from cubicweb_frarchives_edition.resources import WorkflowTransitionResource
 
 LOG = logging.getLogger(__name__)
 
+# max number of schemas kept in the schema cache
+SCHEMA_CACHE_SIZE = 1024
+
+# schemas of these entity types depend on database content (e.g. the list of
+# services of RqTask creation forms, the list of groups of CWUser forms) and
+# are never cached
+UNCACHED_SCHEMA_ETYPES = ("RqTask", "CWUser")
+
+_SCHEMA_CACHE_LOCK = threading.Lock()
+
+
+def _reset_schema_cache(vreg):
+    """drop cached schemas when the registry is reset, i.e. when the schema is
+    (re)loaded or modified by a migration"""
+    with _SCHEMA_CACHE_LOCK:
+        vreg._frarchives_schema_cache = OrderedDict()
+
+
+CW_EVENT_MANAGER.bind("before-registry-reset", _reset_schema_cache)
+
 
 def json_config(**settings):
     """Wraps view_config for JSON rendering."""
@@ -100,6 +124,58 @@ def entity_from_context(func):
     return wrapper
 
 
+def cached_schema(context_key):
+    """View decorator caching the (UI or JSON) schema returned by the view.
+
+    Schemas only depend on the view context (as returned by `context_key`), the
+    request parameters, the language and the user groups. Responses have an ETag
+    so that clients may revalidate their copy instead of downloading it again.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(context, request):
+            key = context_key(context)
+            if key[0] in UNCACHED_SCHEMA_ETYPES:
+                return func(context, request)
+            req = request.cw_request
+            key = (
+                func.__name__,
+                key,
+                tuple(sorted(request.params.items())),
+                req.lang,
+                frozenset(req.user.groups),
+            )
+            vreg = req.vreg
+            with _SCHEMA_CACHE_LOCK:
+                cache = vreg.__dict__.setdefault("_frarchives_schema_cache", OrderedDict())
+                cached = cache.get(key)
+                if cached is not None:
+                    cache.move_to_end(key)
+            if cached is None:
+                value = func(context, request)
+                etag = hashlib.sha1(
+                    json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+                ).hexdigest()
+                cached = (etag, value)
+                with _SCHEMA_CACHE_LOCK:
+                    cache[key] = cached
+                    while len(cache) > SCHEMA_CACHE_SIZE:
+                        cache.popitem(last=False)
+            etag, value = cached
+            if etag in request.if_none_match:
+                return httpexceptions.HTTPNotModified(
+                    headers={"ETag": '"{}"'.format(etag), "Cache-Control": "private, no-cache"}
+                )
+            request.response.etag = etag
+            request.response.cache_control = "private, no-cache"
+            return value
+
+        return wrapper
+
+    return decorator
+
+
 def jsonschema_adapter(cnx, **context):
     return cnx.vreg["adapters"].select("IJSONSchema", cnx, **context)
 
@@ -110,6 +186,7 @@ def jsonschema_adapter(cnx, **context):
     request_method="GET",
     context=ETypeResource,
 )
+@cached_schema(lambda context: (context.etype,))
 def etype_json_uischema(context, request):
     """Return the uischema for the entity type bound to `context`."""
     vreg = request.registry["cubicweb.registry"]
@@ -153,6 +230,7 @@ def deletion_failed(exc, request):
 
 
 @jsonschema_config(context=ETypeSchema, request_param="role")
+@cached_schema(lambda context: (context.etype,))
 def etype_role_schema(context, request):
     """Schema view for an entity type with specified role."""
     req = request.cw_request
@@ -212,6 +290,7 @@ def create_entity(context, request):
     request_method="GET",
     context=RelationshipResource,
 )
+@cached_schema(lambda context: (context.target_type, context.rtype, context.role))
 def relationship_uischema(context, request):
     vreg = request.registry["cubicweb.registry"]
     entity = vreg["etypes"].etype_class(context.target_type)(request.cw_request)
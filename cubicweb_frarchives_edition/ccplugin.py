@@ -53,6 +53,7 @@ import requests
 import rq
 
 import time
+import timeit
 
 import shutil
 import urllib.parse
@@ -206,6 +207,62 @@ class PeriodicOaiImport(Command):
             self.logger.info(f"[fa-rq-import-oai]: {rset.rowcount} tasks created")
 
 
+@CWCTL.register
+class PeriodicKibanaAuthoritiesIndex(Command):
+    """run ``cubicweb_frarchives_edition.tasks.index_kibana_authority_queue`` in RqTask"""
+
+    arguments = "<instance>"
+    name = "fa-rq-index-kibana-authorities"
+    max_args = None
+    min_args = 1
+
+    def run(self, args):
+        from cubicweb_frarchives_edition.tasks import index_kibana_authority_queue
+
+        appid = args.pop()
+        connection = get_rq_redis_connection(appid)
+        with admincnx(appid) as cnx, rq.Connection(connection):
+            if not cnx.vreg.config["enable-kibana-indexes"]:
+                return
+            if not cnx.system_sql("SELECT 1 FROM kibana_authority_queue LIMIT 1").fetchone():
+                return
+            task_title = "index kibana authorities ({date})".format(
+                date=datetime.utcnow().strftime("%Y-%m-%d %H:%M")
+            )
+            rqtask = cnx.create_entity(
+                "RqTask", name="index_kibana_authority_queue", title=task_title
+            )
+            rqtask.cw_adapt_to("IRqJob").enqueue(index_kibana_authority_queue)
+            cnx.commit()
+
+
+@CWCTL.register
+class PeriodicAgentInfosRefresh(Command):
+    """run ``cubicweb_frarchives_edition.tasks.refresh_agent_infos`` in RqTask"""
+
+    arguments = "<instance>"
+    name = "fa-rq-refresh-agent-infos"
+    max_args = None
+    min_args = 1
+
+    def run(self, args):
+        from cubicweb_frarchives_edition.tasks import refresh_agent_infos
+
+        appid = args.pop()
+        connection = get_rq_redis_connection(appid)
+        with admincnx(appid) as cnx, rq.Connection(connection):
+            if not cnx.system_sql(
+                "SELECT 1 FROM agent_info_queue WHERE next_attempt <= LOCALTIMESTAMP LIMIT 1"
+            ).fetchone():
+                return
+            task_title = "refresh agent infos ({date})".format(
+                date=datetime.utcnow().strftime("%Y-%m-%d %H:%M")
+            )
+            rqtask = cnx.create_entity("RqTask", name="refresh_agent_infos", title=task_title)
+            rqtask.cw_adapt_to("IRqJob").enqueue(refresh_agent_infos)
+            cnx.commit()
+
+
 @CWCTL.register
 class RqWorker(Command):
     """run a python-rq worker for instance"""
@@ -586,6 +643,14 @@ class SetupDatabase(Command):
                 "help": "Set to True if you want to skip table update",
             },
         ),
+        (
+            "load-workers",
+            {
+                "type": "int",
+                "default": setup.GEODATA_LOAD_WORKERS,
+                "help": "number of database connections used to load data files",
+            },
+        ),
         (
             "db-dbname",
             {
@@ -769,7 +834,12 @@ class SetupGeonamesDatabase(SetupDatabase):
     ):
         self.logger.info("\n-> Create and populate geonames tables")
         setup.load_geonames_tables(
-            appid, dbparams, allcountries_path, altnames_path, table_owner=table_owner
+            appid,
+            dbparams,
+            allcountries_path,
+            altnames_path,
+            table_owner=table_owner,
+            workers=self.config.load_workers,
         )
 
 
@@ -790,7 +860,13 @@ class SetupBanoDatabase(SetupDatabase):
             if not osp.isdir(datadir):
                 os.mkdir(datadir)
             self.logger.info("\n-> Create and populate BANO tables")
-            setup.load_bano_tables(appid, dbparams, full_path, table_owner=table_owner)
+            setup.load_bano_tables(
+                appid,
+                dbparams,
+                full_path,
+                table_owner=table_owner,
+                workers=self.config.load_workers,
+            )
 
 
 @CWCTL.register
@@ -832,6 +908,136 @@ class ReloadJsonMap(Command):
             load_leaflet_json(cnx)
 
 
+@CWCTL.register
+class BenchmarkSummary(Command):
+    """time TOC generation on the longest CMS contents
+
+    <instance id>
+      identifier of the instance
+    """
+
+    name = "fa-benchmark-summary"
+    arguments = "<instance>"
+    max_args = min_args = 1
+    options = [
+        (
+            "limit",
+            {"type": "int", "default": 20, "help": "number of contents to benchmark"},
+        ),
+        (
+            "repeat",
+            {"type": "int", "default": 5, "help": "number of runs for each content"},
+        ),
+    ]
+
+    def run(self, args):
+        from cubicweb_frarchives_edition.hooks.summarycontent import (
+            TOC_ETYPES,
+            TOC_TRANSLATION_ETYPES,
+        )
+        from cubicweb_frarchives_edition.xmlutils import (
+            generate_summary,
+            headings_key,
+            InvalidHTMLError,
+        )
+
+        appid = args.pop()
+        repeat = self.config.repeat
+        with admincnx(appid) as cnx:
+            rset = cnx.execute(
+                """Any X, C ORDERBY LENGTH(C) DESC LIMIT {limit:d}
+                WHERE X is IN ({etypes}), X content C""".format(
+                    limit=self.config.limit, etypes=", ".join(TOC_ETYPES + TOC_TRANSLATION_ETYPES)
+                )
+            )
+            print("eid\tlength\tsummary (ms)\theadings key (ms)")
+            for eid, content in rset:
+                if not content:
+                    continue
+                try:
+                    summary_time = min(
+                        timeit.repeat(lambda: generate_summary(content, 6), number=1, repeat=repeat)
+                    )
+                except InvalidHTMLError:
+                    print("{}\t{}\tinvalid HTML".format(eid, len(content)))
+                    continue
+                key_time = min(
+                    timeit.repeat(lambda: headings_key(content), number=1, repeat=repeat)
+                )
+                print(
+                    "{}\t{}\t{:.2f}\t{:.2f}".format(
+                        eid, len(content), summary_time * 1000, key_time * 1000
+                    )
+                )
+
+
+@CWCTL.register
+class BenchmarkGeodataLoad(Command):
+    """time the parallel load of a synthetic allCountries.txt file into a staging table
+
+    <instance id>
+      identifier of the instance
+    """
+
+    name = "fa-benchmark-geodata-load"
+    arguments = "<instance>"
+    max_args = min_args = 1
+    options = [
+        (
+            "rows",
+            {"type": "int", "default": 5000000, "help": "number of rows of the synthetic file"},
+        ),
+        (
+            "workers",
+            {"type": "csv", "default": "1,4", "help": "numbers of connections to benchmark"},
+        ),
+    ]
+
+    def run(self, args):
+        import tempfile
+
+        import psycopg2
+
+        appid = args.pop()
+        sconf = instance_configuration(appid).system_source_config
+        dbparams = {
+            "database": sconf["db-name"],
+            "host": sconf.get("db-host", ""),
+            "user": sconf["db-user"],
+            "password": sconf.get("db-password", ""),
+            "port": sconf.get("db-port", ""),
+        }
+        tablename = "geonames_benchmark"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = osp.join(tmpdir, "allCountries.txt")
+            with open(path, "w") as fp:
+                for idx in range(self.config.rows):
+                    fp.write(
+                        f"{idx}\tPlace {idx}\tPlace {idx}\tPlace,Lieu {idx}\t48.85341\t2.3488"
+                        f"\tP\tPPL\tFR\t\t11\t75\t751\t75056\t{idx}\t\t42"
+                        "\tEurope/Paris\t2023-01-01\n"
+                    )
+            print(f"{self.config.rows} rows, {os.path.getsize(path)} bytes")
+            with setup.transaction(psycopg2.connect(**dbparams)) as crs:
+                crs.execute(setup.render_template("geonames_staging.sql"))
+                crs.execute(f"CREATE UNLOGGED TABLE {tablename} (LIKE geonames_staging)")
+                setup.create_loaded_segments_table(crs)
+            try:
+                for workers in self.config.workers:
+                    with setup.transaction(psycopg2.connect(**dbparams)) as crs:
+                        setup.reset_staging_table(crs, tablename)
+                    begin = time.time()
+                    rows = setup.load_file(dbparams, tablename, path, "(NULL '')", int(workers))
+                    elapsed = time.time() - begin
+                    print(
+                        f"workers={workers}: {rows} rows in {elapsed:.1f}s "
+                        f"({rows / elapsed:.0f} rows/s)"
+                    )
+            finally:
+                with setup.transaction(psycopg2.connect(**dbparams)) as crs:
+                    setup.drop_staging_tables(crs, (tablename,))
+
+
 @CWCTL.register
 class GroupSimilarSubjects(Command):
     """group similar subjects
@@ -28,26 +28,102 @@
 # The fact that you are presently reading this means that you have had
 # knowledge of the CeCILL-C license and that you accept its terms.
 #
+import codecs
 import csv
+import hashlib
 from io import StringIO
 
 import re
 import os.path as osp
 import os
+import shutil
+from uuid import uuid4
 
 import zipfile
 
+from cubicweb_francearchives import S3_ACTIVE
 from cubicweb_francearchives.dataimport import RELFILES_DIR
 from cubicweb_francearchives.dataimport.csv_nomina import check_document_fieldnames
 
 from cubicweb_frarchives_edition.api import jsonapi_error, JSONBadRequest
 from cubicweb_frarchives_edition.tasks.qualify_authorities import FIELDNAMES, KIBANA_FIELDNAMES
+from cubicweb_frarchives_edition.tasks.utils import csv_zip_description
+
+
+# size of the chunks read from uploaded files
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# size of the chunks read from uploaded files while looking for csv headers
+UPLOAD_HEADER_CHUNK_SIZE = 1024
+# max size of csv headers
+UPLOAD_HEADER_MAX_SIZE = 64 * 1024
+# sub-directory where uploaded archives wait for being extracted by import tasks
+UPLOADED_ZIP_DIR = ".uploads"
 
 
 def bad_request(error):
     return JSONBadRequest(*[jsonapi_error(status=422, details=error, pointer="file")])
 
 
+def upload_stream(fileobj):
+    """return the stream of an uploaded file, rewound to its beginning
+
+    The web server already spooled the upload, so reading the stream by chunks does
+    not load the whole file in memory as `fileobj.value` does.
+    """
+    stream = fileobj.file
+    stream.seek(0)
+    return stream
+
+
+def read_csv_fieldnames(cnx, fileobj, delimiter):
+    """return the fieldnames of an uploaded utf-8 csv file, only reading and
+    decoding its first bytes"""
+    stream = upload_stream(fileobj)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    text = ""
+    try:
+        while "\n" not in text:
+            if len(text) > UPLOAD_HEADER_MAX_SIZE:
+                raise bad_request(
+                    cnx._(f'Unable to process "{fileobj.filename}": headers are too long')
+                )
+            chunk = stream.read(UPLOAD_HEADER_CHUNK_SIZE)
+            text += decoder.decode(chunk, final=not chunk)
+            if not chunk:
+                break
+    except UnicodeDecodeError as exception:
+        raise bad_request(cnx._(f'Unable to read "{fileobj.filename}": {exception}'))
+    finally:
+        stream.seek(0)
+    headers = text.splitlines()[0] if text else ""
+    try:
+        return csv.DictReader(StringIO(headers), delimiter=delimiter).fieldnames
+    except Exception as exception:
+        raise bad_request(cnx._(f'Unable to process "{fileobj.filename}": {exception}'))
+
+
+def check_upload(cnx, fileobj):
+    """check that the uploaded file is valid utf-8 and return its sha1 checksum
+
+    The file is read by chunks, so that memory usage does not depend on its size.
+    """
+    stream = upload_stream(fileobj)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    checksum = hashlib.sha1()
+    try:
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            decoder.decode(chunk, final=not chunk)
+            if not chunk:
+                break
+            checksum.update(chunk)
+    except UnicodeDecodeError as exception:
+        raise bad_request(cnx._(f'Unable to read "{fileobj.filename}": {exception}'))
+    finally:
+        stream.seek(0)
+    return checksum.hexdigest()
+
+
 def xml_re_match(startswith, filename):
     return re.match(r"%s_.*.xml" % startswith, filename)
 
@@ -106,6 +182,30 @@ def check_zipfiles(zipf, service):
     return res
 
 
+def persist_upload_zip(cnx, fileobj, directory, exts):
+    """copy the uploaded archive by chunks next to `directory`, for the import task
+    to extract members with `exts` extensions into `directory`"""
+    path = osp.join(
+        directory, UPLOADED_ZIP_DIR, "{}_{}".format(uuid4().hex, osp.basename(fileobj.filename))
+    )
+    os.makedirs(osp.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        shutil.copyfileobj(upload_stream(fileobj), f, UPLOAD_CHUNK_SIZE)
+    return {"path": path, "directory": directory, "exts": exts}
+
+
+def store_zip(cnx, fileobj, zf, directory, exts, write_zip_func):
+    """store the uploaded archive and return a list of extracted file paths and the
+    archive to be extracted by the import task
+
+    With S3, members are extracted right away with `write_zip_func`. Otherwise the
+    archive is only copied and the import task extracts it.
+    """
+    if S3_ACTIVE:
+        return write_zip_func(zf, directory, exts=exts), None
+    return [], persist_upload_zip(cnx, fileobj, directory, exts)
+
+
 def get_dir_or_raise_bad_request(cnx, config_dir_name):
     doc_dir = cnx.vreg.config.get(config_dir_name)
     if doc_dir is None:
@@ -131,6 +231,8 @@ def process_faimport_zip(cnx, fileobj, write_zip_func):
         |__ ...
         |__fileN.xxx
 
+    return extracted file paths and the archive to be extracted by the import task
+    (see `store_zip`)
     """
     _ = cnx._
     if fileobj is None:
@@ -176,7 +278,7 @@ def process_faimport_zip(cnx, fileobj, write_zip_func):
         raise JSONBadRequest(*errors)
     # catch errors ?
     ead_dir = get_dir_or_raise_bad_request(cnx, "ead-services-dir")
-    return write_zip_func(zf, ead_dir, exts=(".pdf", ".xml", ".csv"))
+    return store_zip(cnx, fileobj, zf, ead_dir, (".pdf", ".xml", ".csv"), write_zip_func)
 
 
 def check_csv_zipfiles(zf):
@@ -199,6 +301,9 @@ def process_csvimport_zip(cnx, fileobj, write_zip_func):
     |__....csv
     |__dataX.csv
     |__ metadata.csv (optional)
+
+    return the csv files description and the archive to be extracted by the import
+    task (see `store_zip`)
     """
     _ = cnx._
     if fileobj is None:
@@ -232,14 +337,8 @@ def process_csvimport_zip(cnx, fileobj, write_zip_func):
             errors.append(jsonapi_error(status=422, details=error, pointer="file"))
         raise JSONBadRequest(*errors)
     ead_dir = get_dir_or_raise_bad_request(cnx, "ead-services-dir")
-    csv_files = write_zip_func(zf, ead_dir, exts=(".csv",))
-    res = {"filepaths": [], "metadata": None}
-    for filepath in csv_files:
-        if filepath.endswith("metadata.csv"):
-            res["metadata"] = filepath
-        else:
-            res["filepaths"].append(filepath)
-    return res
+    csv_files, archive = store_zip(cnx, fileobj, zf, ead_dir, (".csv",), write_zip_func)
+    return csv_zip_description(csv_files), archive
 
 
 def process_faimport_xml(cnx, fileobj, servicecode, write_func):
@@ -257,7 +356,11 @@ def get_eac_dir(cnx):
 
 
 def process_authorityrecords_zip(cnx, fileobj, write_zip_func):
-    """store zip files directly in the eac_dir"""
+    """store zip files directly in the eac_dir
+
+    return extracted file paths and the archive to be extracted by the import task
+    (see `store_zip`)
+    """
     eac_dir = get_eac_dir(cnx)
     _ = cnx._
     if fileobj is None:
@@ -265,7 +368,7 @@ def process_authorityrecords_zip(cnx, fileobj, write_zip_func):
     if not zipfile.is_zipfile(fileobj.file):
         raise bad_request(_("This file in not a zip file"))
     zf = zipfile.ZipFile(fileobj.file, mode="r")
-    return write_zip_func(zf, eac_dir, exts=(".xml",))
+    return store_zip(cnx, fileobj, zf, eac_dir, (".xml",), write_zip_func)
 
 
 def process_authorityrecord_xml(cnx, fileobj, servicecode, write_func):
@@ -275,14 +378,7 @@ def process_authorityrecord_xml(cnx, fileobj, servicecode, write_func):
 
 
 def check_quality_csv(cnx, fileobj, st):
-    try:
-        stream = StringIO(fileobj.value.decode())
-    except Exception as exception:
-        raise bad_request(cnx._(f'Unable to read "{fileobj.filename}": {exception}'))
-    try:
-        headers = csv.DictReader(stream, delimiter="\t").fieldnames
-    except Exception as exception:
-        raise bad_request(cnx._(f'Unable to process "{fileobj.filename}": {exception}'))
+    headers = read_csv_fieldnames(cnx, fileobj, "\t")
     if headers is None:
         raise bad_request(cnx._(f'Unable to process "{fileobj.filename}": no headers found'))
     for variantes in (FIELDNAMES, KIBANA_FIELDNAMES):
@@ -294,21 +390,20 @@ def check_quality_csv(cnx, fileobj, st):
 
 
 def process_nomina_csv(cnx, fileobj, servicecode, write_func):
-    """store the file in the nomina_dir sub-directory (servicecode)"""
+    """store the file in the nomina_dir sub-directory (servicecode) and return its
+    path and sha1 checksum"""
     nomina_dir = get_dir_or_raise_bad_request(cnx, "nomina-services-dir")
-    return write_func(fileobj.filename, fileobj.value, subdirectories=[nomina_dir, servicecode])
+    checksum = check_upload(cnx, fileobj)
+    filepath = write_func(
+        fileobj.filename, upload_stream(fileobj).read(), subdirectories=[nomina_dir, servicecode]
+    )
+    return filepath, checksum
 
 
 def validate_import_nomina_csv(cnx, fileobj, service_code, doctype, delimiter, write_func):
-    """store the file in the nomina_dir sub-directory (servicecode)"""
-    try:
-        stream = StringIO(fileobj.value.decode())
-    except Exception as exception:
-        raise bad_request(cnx._(f'Unable to read "{fileobj.filename}": {exception}'))
-    try:
-        fieldnames = csv.DictReader(stream, delimiter=delimiter).fieldnames
-    except Exception as exception:
-        raise bad_request(cnx._(f'Unable to process "{fileobj.filename}": {exception}'))
+    """store the file in the nomina_dir sub-directory (servicecode) and return its
+    path and sha1 checksum"""
+    fieldnames = read_csv_fieldnames(cnx, fileobj, delimiter)
     if fieldnames is None:
         raise bad_request(cnx._(f'Unable to process "{fileobj.filename}": no fieldnames found'))
     try:
@@ -63,6 +63,7 @@ from cubicweb_francearchives.utils import (
 from cubicweb_frarchives_edition import AUTH_URL_PATTERN
 from cubicweb_frarchives_edition.entities import section as section_edition
 from cubicweb_frarchives_edition.api import json_config
+from cubicweb_frarchives_edition.rqlogs import LEVEL_FILTERS, LOG_PAGE_SIZE
 
 
 LOG = logging.getLogger(__name__)
@@ -328,6 +329,34 @@ def rqtasks(request):
     return {"data": entities}
 
 
+@json_config(route_name="rqtask-logs", effective_principals=security.Authenticated)
+def rqtask_logs(request):
+    """Return a page of the parsed logs of a RqTask.
+
+    Accepted parameters are `offset`, `limit` (between 1 and LOG_PAGE_SIZE) and
+    `level` (minimal severity, either "WARNING" or "ERROR").
+    """
+    req = request.cw_request
+    rset = req.execute("Any X WHERE X is RqTask, X eid %(e)s", {"e": int(request.matchdict["eid"])})
+    if not rset:
+        raise httpexceptions.HTTPNotFound()
+    level = request.params.get("level") or None
+    if level not in LEVEL_FILTERS:
+        raise httpexceptions.HTTPBadRequest("invalid level: {0}".format(level))
+    try:
+        offset = max(int(request.params.get("offset", 0)), 0)
+        limit = min(max(int(request.params.get("limit", LOG_PAGE_SIZE)), 1), LOG_PAGE_SIZE)
+    except ValueError:
+        raise httpexceptions.HTTPBadRequest("invalid offset or limit")
+    total, records = rset.one().cw_adapt_to("IRqJob").log_page(offset, limit, level)
+    headers = ["severity", "date", "time", "message"]
+    return {
+        "total": total,
+        "offset": offset,
+        "data": [dict(list(zip(headers, record))) for record in records],
+    }
+
+
 def rq_tween_factory(handler, registry):
     def rq_tween(request):
         with rq.Connection(registry.settings["rq.redis"]):
@@ -556,6 +585,7 @@ def includeme(config):
     config.add_route("service", "/annuaire/{code}", strict_accept="application/json")
     config.add_route("cwusers", "/cwusers", strict_accept="application/json")
     config.add_route("rqtasks", "/rqtasks", strict_accept="application/json")
+    config.add_route("rqtask-logs", r"/rqtask-logs/{eid:\d+}", strict_accept="application/json")
     config.add_route("faservices", "/faservices", strict_accept="application/json")
     config.add_route("faforservice", "/faforservice", strict_accept="application/json")
     config.add_route("get-blacklisted", "/get-blacklisted", strict_accept="application/json")
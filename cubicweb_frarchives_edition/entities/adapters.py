@@ -39,6 +39,7 @@ import redis
 import rq.exceptions
 
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from elasticsearch.exceptions import NotFoundError
 from elasticsearch_dsl.search import Search
@@ -61,6 +62,13 @@ from cubicweb_francearchives.storage import S3BfssStorageMixIn
 from cubicweb_francearchives.views.index import AbstractAuthorityAdapter
 
 from cubicweb_frarchives_edition import UnpublishFilesOp
+from cubicweb_frarchives_edition.rqlogs import (
+    LOG_PAGE_SIZE,
+    LOG_TAIL_SIZE,
+    page_records,
+    store_task_log,
+    task_log_page,
+)
 
 AbstractAuthorityAdapter.editable = True
 
@@ -449,14 +457,33 @@ class IRqJob(EntityAdapter):
         meta = self.get_job().meta
         return meta.get("progress", 0.0)
 
+    @property
+    def log_key(self):
+        return "rq:job:{0}:log".format(self.id)
+
     @property
     def log(self):
-        key = "rq:job:{0}:log".format(self.id)
         connection = self.get_job().connection
-        content = connection.get(key) or b""
+        content = connection.get(self.log_key) or b""
         content = content.decode("utf-8")
         return content
 
+    def log_tail(self, size=LOG_TAIL_SIZE):
+        """Return the last `size` bytes of the log, starting at a line boundary."""
+        connection = self.get_job().connection
+        start = max(connection.strlen(self.log_key) - size, 0)
+        content = connection.getrange(self.log_key, start, -1) or b""
+        if start:
+            content = content.partition(b"\n")[-1]
+        return content.decode("utf-8", "replace")
+
+    def log_page(self, offset=0, limit=LOG_PAGE_SIZE, level=None):
+        """Return a (total, records) tuple of parsed log records.
+
+        Only the tail of the log of a running job is considered.
+        """
+        return page_records(self.log_tail().splitlines(), offset, limit, level)
+
     def handle_finished(self):
         pass
 
@@ -467,9 +494,15 @@ class IRqJob(EntityAdapter):
 class RqTaskJob(IRqJob):
     __select__ = IRqJob.__select__ & is_instance("RqTask")
 
+    def store_log(self, log):
+        cnx = getattr(self._cw, "cnx", self._cw)
+        store_task_log(cnx, self.entity.eid, log.splitlines())
+
     def handle_failure(self, *exc_info):
+        log = self.log
+        self.store_log(log)
         update = dict(
-            log=Binary(self.log.encode("utf-8")),
+            log=Binary(log.encode("utf-8")),
             status=rq.job.JobStatus.FAILED,
         )
         for attr in ("enqueued_at", "started_at"):
@@ -480,7 +513,9 @@ class RqTaskJob(IRqJob):
 
     def handle_finished(self):
         # save relevant metadata in persistent storage
-        update = {"log": Binary(self.log.encode("utf-8"))}
+        log = self.log
+        self.store_log(log)
+        update = {"log": Binary(log.encode("utf-8"))}
         for attr in ("enqueued_at", "started_at"):
             update[attr] = getattr(self, attr)
         # XXX for some reason ended_at is never available put an approximate end date
@@ -508,10 +543,22 @@ class RqTaskJob(IRqJob):
             return self.entity.log.read().decode("utf-8")
         return super(RqTaskJob, self).log
 
+    def log_page(self, offset=0, limit=LOG_PAGE_SIZE, level=None):
+        if self.is_finished():
+            cnx = getattr(self._cw, "cnx", self._cw)
+            page = task_log_page(cnx, self.entity.eid, offset, limit, level)
+            if page is not None:
+                return page
+            # task finished before logs were stored by chunks
+            return page_records(self.log.splitlines(), offset, limit, level)
+        return super(RqTaskJob, self).log_page(offset, limit, level)
+
 
 def copy(src, dest, logger=None):
     """
     filesystem copy from src to destination
+
+    :returns: True if the file has been copied
     """
     try:
         shutil.copy(src, dest)
@@ -520,6 +567,26 @@ def copy(src, dest, logger=None):
             logger = logging.getLogger("cubicweb_francearchives.sync")
         logger.exception("failed to sync %r -> %r", src, dest)
         traceback.print_exc()
+        return False
+    return True
+
+
+def is_up_to_date(src, dest):
+    """return True if `dest` is a copy of `src` at least as recent"""
+    try:
+        src_stat, dest_stat = os.stat(src), os.stat(dest)
+    except OSError:
+        return False
+    return src_stat.st_size == dest_stat.st_size and dest_stat.st_mtime >= src_stat.st_mtime
+
+
+# number of threads used to publish files
+FILE_SYNC_WORKERS = 8
+# files are published sequentially below this number of files
+FILE_SYNC_MIN_BATCH = 20
+# a S3 listing may cost at most one page request for this number of keys,
+# otherwise keys are checked one by one
+S3_LIST_KEYS_PER_PAGE = 10
 
 
 class IFileSync(EntityAdapter):
@@ -591,34 +658,113 @@ class IFileSync(EntityAdapter):
             self.s3_delete_fpath(fpath, feid)
 
     def copy(self):
-        """publish file"""
+        """publish file
+
+        :returns: outcome ("copied", "skipped" or "failed") of each published file
+        :rtype: dict
+        """
         if S3_ACTIVE:
-            self.s3_copy()
+            outcomes = self.s3_copy()
         else:
-            self.bfss_copy()
+            outcomes = self.bfss_copy()
+        outcomes = outcomes or {}
+        if outcomes:
+            counts = {}
+            for outcome in outcomes.values():
+                counts[outcome] = counts.get(outcome, 0) + 1
+            self.info(
+                "[copy] %s #%s: %s",
+                self.entity.cw_etype,
+                self.entity.eid,
+                ", ".join("{} {}".format(count, outcome) for outcome, count in counts.items()),
+            )
+        return outcomes
+
+    def sync_files(self, func, items):
+        """apply `func` on each tuple of `items`, through a thread pool for large batches
+
+        :returns: outcome of each item, indexed by its first element
+        :rtype: dict
+        """
+
+        def sync(item):
+            try:
+                return func(*item)
+            except Exception:
+                self.exception("failed to sync %r", item[0])
+                return "failed"
+
+        if len(items) < FILE_SYNC_MIN_BATCH:
+            results = [sync(item) for item in items]
+        else:
+            with ThreadPoolExecutor(max_workers=FILE_SYNC_WORKERS) as executor:
+                results = list(executor.map(sync, items))
+        return {item[0]: result for item, result in zip(items, results)}
+
+    def bfss_copy_fpath(self, fpath, destpath):
+        """copy fpath to destpath unless destpath is already up to date"""
+        if is_up_to_date(fpath, destpath):
+            return "skipped"
+        return "copied" if copy(fpath, destpath) else "failed"
 
     def bfss_copy(self):
         """publish file"""
         if not self.pub_appfiles_dir:
-            return
-        for fpath, feid in self.files_to_sync():
-            copy(fpath, self.get_fullpath(fpath))
-
-    def s3_copy_fpath(self, fpath):
-        """copy a prefixed ".hidden/" fpath into fpath"""
+            return {}
+        items = [(fpath, self.get_fullpath(fpath)) for fpath, feid in self.files_to_sync()]
+        return self.sync_files(self.bfss_copy_fpath, items)
+
+    def s3_existing_keys(self, keys):
+        """return the subset of `keys` existing in the S3 bucket, listed under their
+        common prefix, or None if the listing would cost more than checking each key"""
+        max_pages = len(keys) // S3_LIST_KEYS_PER_PAGE
+        if not max_pages:
+            return None
+        storage = self.file_data_storage
+        paginator = storage.s3cnx.get_paginator("list_objects_v2")
+        existing = set()
+        pages = paginator.paginate(Bucket=storage.bucket, Prefix=osp.commonprefix(keys))
+        for idx, page in enumerate(pages):
+            if idx >= max_pages:
+                return None
+            existing.update(obj["Key"] for obj in page.get("Contents", ()))
+        return existing.intersection(keys)
+
+    def s3_copy_fpath(self, fpath, exists=None):
+        """copy a prefixed ".hidden/" fpath into fpath
+
+        :param bool exists: whether the ".hidden/" fpath exists, checked if None
+        """
         if isinstance(fpath, bytes):
             fpath = fpath.decode("utf-8")
         unpublished_path = ".hidden/" + fpath
-        if self.file_data_storage.file_exists(unpublished_path):
+        if exists is None:
+            exists = self.file_data_storage.file_exists(unpublished_path)
+        if exists:
             published_path = fpath.replace(".hidden/", "")
             self.file_data_storage.rename_object(unpublished_path, published_path)
+            return "copied"
+        self.info(f"[s3_copy] {fpath} is allready published / visible")
+        return "skipped"
+
+    def s3_copy_fpaths(self, fpaths):
+        """publish fpaths, listing existing unpublished keys at once when possible"""
+        keys = [
+            ".hidden/" + (fpath.decode("utf-8") if isinstance(fpath, bytes) else fpath)
+            for fpath in fpaths
+        ]
+        existing = self.s3_existing_keys(keys)
+        if existing is None:
+            items = [(fpath,) for fpath in fpaths]
         else:
-            self.info(f"[s3_copy] {fpath} is allready published / visible")
+            items = [(fpath, key in existing) for fpath, key in zip(fpaths, keys)]
+        return self.sync_files(self.s3_copy_fpath, items)
 
     def s3_copy(self):
         """publish file"""
-        for fpath, feid in self.files_to_sync():
-            self.s3_copy_fpath(self.get_fullpath(fpath))
+        return self.s3_copy_fpaths(
+            [self.get_fullpath(fpath) for fpath, feid in self.files_to_sync()]
+        )
 
 
 class FindingAidIFileSync(IFileSync):
@@ -652,8 +798,7 @@ class FindingAidIFileSync(IFileSync):
             ape_ead_service_dir = osp.join(
                 self.pub_appfiles_dir, "ape-ead", self.entity.service_code
             )
-            if not osp.exists(ape_ead_service_dir):
-                os.makedirs(ape_ead_service_dir)
+            os.makedirs(ape_ead_service_dir, exist_ok=True)
             return osp.join(ape_ead_service_dir, basepath).encode("utf-8")
         return ""
 
@@ -721,16 +866,18 @@ class SectionFileSync(RichContentFileSyncMixin, ImageFileSync):
         return files
 
     def s3_copy(self):
-        for fpath in self.heroimages_to_sync():
-            self.s3_copy_fpath(fpath)
-        super(SectionFileSync, self).s3_copy()
+        outcomes = self.s3_copy_fpaths(self.heroimages_to_sync())
+        outcomes.update(super(SectionFileSync, self).s3_copy())
+        return outcomes
 
     def bfss_copy(self):
+        outcomes = {}
         if self.published_static_css_dir and osp.exists(self.published_static_css_dir):
             for srcpath in self.heroimages_to_sync():
                 destpath = osp.join(self.published_static_css_dir, osp.basename(srcpath))
-                copy(srcpath, destpath)
-        super(SectionFileSync, self).bfss_copy()
+                outcomes[srcpath] = "copied" if copy(srcpath, destpath) else "failed"
+        outcomes.update(super(SectionFileSync, self).bfss_copy())
+        return outcomes
 
 
 class SectionTranslationFileSync(RichContentFileSyncMixin, IFileSync):
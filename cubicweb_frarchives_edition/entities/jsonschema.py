@@ -222,8 +222,9 @@ class RqTaskImportEadIJSONSchemaAdapter(RqTaskIJSONSchemaAdapter):
         fileobj = instance["fileobj"]
         code, ext = osp.splitext(fileobj.filename)
         st = S3BfssStorageMixIn()
+        archive = None
         if ext == ".zip":
-            filepaths = process_faimport_zip(req, fileobj, st.storage_write_zipfile)
+            filepaths, archive = process_faimport_zip(req, fileobj, st.storage_write_zipfile)
         elif ext == ".xml":
             filepaths = [
                 process_faimport_xml(req, fileobj, instance["service"], st.storage_write_file)
@@ -242,9 +243,9 @@ class RqTaskImportEadIJSONSchemaAdapter(RqTaskIJSONSchemaAdapter):
         context_service = True
         entity = super(RqTaskImportEadIJSONSchemaAdapter, self).create_entity(instance)
         func = self.TASK_MAP[instance["name"]]
-        kwargs = {}
+        kwargs = {"archive": archive}
         if instance.get("service") == "FRAN":
-            kwargs = {"job_timeout": "18h"}
+            kwargs["job_timeout"] = "18h"
         entity.cw_adapt_to("IRqJob").enqueue(
             func, filepaths, auto_dedupe, context_service, force_delete, auto_import, **kwargs
         )
@@ -279,8 +280,11 @@ class RqTaskImportEacIJSONSchemaAdapter(RqTaskIJSONSchemaAdapter):
         fileobj = instance["fileobj"]
         f, ext = osp.splitext(fileobj.filename)
         st = S3BfssStorageMixIn()
+        archive = None
         if ext == ".zip":
-            filepaths = process_authorityrecords_zip(req, fileobj, st.storage_write_zipfile)
+            filepaths, archive = process_authorityrecords_zip(
+                req, fileobj, st.storage_write_zipfile
+            )
         elif ext == ".xml":
             filepaths = [
                 process_authorityrecord_xml(
@@ -300,6 +304,7 @@ class RqTaskImportEacIJSONSchemaAdapter(RqTaskIJSONSchemaAdapter):
         entity.cw_adapt_to("IRqJob").enqueue(
             func,
             filepaths,
+            archive=archive,
         )
         return entity
 
@@ -725,7 +730,9 @@ class RqTaskImportCSVIJSONSchemaAdapter(
         entity = super(RqTaskImportCSVIJSONSchemaAdapter, self).create_entity(instance)
         func = self.TASK_MAP[instance["name"]]
         st = S3BfssStorageMixIn()
-        filepaths = process_csvimport_zip(req, instance["fileobj"], st.storage_write_zipfile)
+        filepaths, archive = process_csvimport_zip(
+            req, instance["fileobj"], st.storage_write_zipfile
+        )
         auto_dedupe = True
         context_service = True
         entity.cw_adapt_to("IRqJob").enqueue(
@@ -735,6 +742,7 @@ class RqTaskImportCSVIJSONSchemaAdapter(
             context_service,
             force_delete,
             auto_import,
+            archive=archive,
         )
         return entity
 
@@ -835,7 +843,7 @@ class RqTaskImportCSVNominaIJSONSchemaAdapter(
         doctype = instance["doctype"]
         delimiter = instance["delimiter"]
         if ext == ".csv":
-            filepaths = validate_import_nomina_csv(
+            filepath, checksum = validate_import_nomina_csv(
                 req, fileobj, service, doctype, delimiter, st.storage_write_file
             )
         else:
@@ -848,8 +856,8 @@ class RqTaskImportCSVNominaIJSONSchemaAdapter(
             )
         entity = super(RqTaskImportCSVNominaIJSONSchemaAdapter, self).create_entity(instance)
         func = self.TASK_MAP[instance["name"]]
-        kwargs = {"job_timeout": "24h"}
-        entity.cw_adapt_to("IRqJob").enqueue(func, filepaths, service, doctype, delimiter, **kwargs)
+        kwargs = {"job_timeout": "24h", "checksum": checksum}
+        entity.cw_adapt_to("IRqJob").enqueue(func, filepath, service, doctype, delimiter, **kwargs)
         return entity
 
 
@@ -28,9 +28,12 @@
 # The fact that you are presently reading this means that you have had
 # knowledge of the CeCILL-C license and that you accept its terms.
 #
+from copy import deepcopy
+from datetime import datetime
 from functools import partial
 
 import logging
+import sys
 
 import tqdm
 import time
@@ -115,6 +118,142 @@ class AbstractKibanaIndexer(Indexer):
         )
         return settings
 
+    # settings used while a new version of the index is bulk loaded
+    bulk_index_settings = {"number_of_replicas": 0, "refresh_interval": "-1"}
+    # settings restored once the new version of the index is loaded
+    number_of_replicas = 1
+    bulk_thread_count = 4
+    bulk_chunk_size = 1000
+    # keep a partially loaded version of the index on failure so that it can be resumed
+    resumable = False
+
+    def versioned_index_name(self, index_name=None):
+        """return a new timestamped name for a version of the `index_name` index"""
+        return "{}_{}".format(
+            index_name or self.index_name, datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+        )
+
+    def create_bulk_index(self, es, index_name=None):
+        """create a new version of the `index_name` index set up for bulk loading
+        (no replica, no refresh) and return its name
+        """
+        new_index = self.versioned_index_name(index_name)
+        settings = deepcopy(self.settings)
+        settings["settings"].update(self.bulk_index_settings)
+        es.indices.create(index=new_index, body=settings)
+        return new_index
+
+    def publish_index(self, es, new_index, index_name=None):
+        """restore `new_index` settings, atomically make the `index_name` alias point
+        to it and delete the previous and unpublished versions of the index
+        """
+        alias = index_name or self.index_name
+        es.indices.put_settings(
+            index=new_index,
+            body={
+                "index": {
+                    "number_of_replicas": self.number_of_replicas,
+                    "refresh_interval": None,
+                }
+            },
+        )
+        es.indices.refresh(index=new_index)
+        actions, old_indexes = [], []
+        if es.indices.exists_alias(name=alias):
+            old_indexes = [name for name in es.indices.get_alias(name=alias) if name != new_index]
+            actions.extend({"remove": {"index": name, "alias": alias}} for name in old_indexes)
+        elif es.indices.exists(index=alias):
+            # `alias` is still a concrete index (created before versioned indexes were
+            # introduced): replace it in the same atomic operation
+            actions.append({"remove_index": {"index": alias}})
+        actions.append({"add": {"index": new_index, "alias": alias}})
+        es.indices.update_aliases(body={"actions": actions})
+        for name in old_indexes:
+            es.indices.delete(index=name, ignore=[404])
+        self.delete_unpublished_indexes(es, index_name, keep=new_index)
+
+    def unpublished_indexes(self, es, index_name=None):
+        """return the sorted versions of the `index_name` index which have not
+        been published, the most recent one being the last
+        """
+        alias = index_name or self.index_name
+        versions = es.indices.get(index="{}_*".format(alias), ignore=[404])
+        return sorted(
+            name
+            for name, infos in versions.items()
+            if name.startswith(alias + "_")
+            and name[len(alias) + 1 :].isdigit()
+            and alias not in infos.get("aliases", {})
+        )
+
+    def pending_index(self, es, index_name=None):
+        """return the most recent version of the `index_name` index which has not
+        been published yet, if any
+        """
+        pending = self.unpublished_indexes(es, index_name)
+        return pending[-1] if pending else None
+
+    def delete_unpublished_indexes(self, es, index_name=None, keep=None):
+        """delete the versions of the `index_name` index left by failed rebuilds,
+        except `keep`
+        """
+        for name in self.unpublished_indexes(es, index_name):
+            if name != keep:
+                self.info("delete unpublished index %s", name)
+                es.indices.delete(index=name, ignore=[404])
+
+    def rebuild_index(self, es, populate, index_name=None, resume=False):
+        """build a new version of the `index_name` index and publish it
+
+        `populate` is called with the name of the new index and must load it. It may
+        return the number of documents which could not be indexed: the new index is
+        then not published and None is returned. The current index is left untouched
+        until the new one is fully loaded. If `resume` is True, the last unpublished
+        version of the index is loaded again instead of a new one. Other unpublished
+        versions, left by previous failed rebuilds, are deleted.
+        """
+        new_index = None
+        if resume:
+            new_index = self.pending_index(es, index_name)
+        self.delete_unpublished_indexes(es, index_name, keep=new_index)
+        if new_index is None:
+            new_index = self.create_bulk_index(es, index_name)
+        try:
+            errors = populate(new_index)
+        except Exception:
+            if not self.resumable:
+                es.indices.delete(index=new_index, ignore=[404])
+            raise
+        if errors:
+            self.error(
+                "%s documents could not be indexed in %s: %s is not published",
+                errors,
+                new_index,
+                index_name or self.index_name,
+            )
+            if not self.resumable:
+                es.indices.delete(index=new_index, ignore=[404])
+            return None
+        self.publish_index(es, new_index, index_name)
+        return new_index
+
+    def bulk_index(self, es, actions, log=None):
+        """index `actions` with parallel bulk requests and return the number of errors"""
+        errors = 0
+        for ok, item in parallel_bulk(
+            es,
+            actions,
+            thread_count=self.bulk_thread_count,
+            chunk_size=self.bulk_chunk_size,
+            raise_on_error=False,
+            raise_on_exception=False,
+        ):
+            if not ok:
+                errors += 1
+                if log is not None:
+                    log.warning("failed to index %s", item)
+        return errors
+
 
 class IndexESIRKibana(Command):
     """Create indexes and index FindingAids and FAComponents for data monitoring in Kibana.
@@ -128,6 +267,14 @@ class IndexESIRKibana(Command):
     min_args = max_args = 1
     arguments = "<instance id>"
     options = [
+        (
+            "resume",
+            {
+                "type": "yn",
+                "default": False,
+                "help": "resume the last unfinished reindexation instead of starting a new one",
+            },
+        ),
         (
             "kibana-ir-index-name",
             {
@@ -153,8 +300,23 @@ class IndexESIRKibana(Command):
             if not es and self.config.debug:
                 print("no elasticsearch configuration found, skipping")
                 return
-            kibana_ir_indexer.create_index()
-            kibana_ir_indexer.populate_index()
+
+            def progress(value):
+                print("{:.1%} reindexed".format(value))
+
+            new_index = kibana_ir_indexer.rebuild_index(
+                es,
+                partial(kibana_ir_indexer.populate_index, progress=progress),
+                resume=self.config.resume,
+            )
+            if new_index is None:
+                print(
+                    """"{}" is left unchanged because of indexing errors""".format(
+                        kibana_ir_indexer.index_name
+                    )
+                )
+                sys.exit(1)
+            print('''"{}" now points to "{}"'''.format(kibana_ir_indexer.index_name, new_index))
 
 
 class IndexESKibana(Command):
@@ -227,22 +389,27 @@ class IndexESKibana(Command):
             if not es and self.config.debug:
                 self.log.error("f[{index_name}]: no elasticsearch configuration found. Abort.")
                 return
-            indexer.create_index(index_name)
             self.update_sql_data(cnx, etypes)
             if self.config.no_index:
                 # do not reindex
                 self.log.error(f"{time.ctime()}: [{index_name}]: do not index es. Abort")
                 return
-            for _ in parallel_bulk(
-                es,
-                self.bulk_actions(cnx, es, indexer),
-                raise_on_error=False,
-                raise_on_exception=False,
-            ):
-                pass
+            if set(indexer.etypes).difference(etypes):
+                # partial reindexation: update the current index in place
+                indexer.create_index(index_name)
+                indexer.bulk_index(es, self.bulk_actions(cnx, indexer, index_name), self.log)
+                return
+
+            def populate(new_index):
+                return indexer.bulk_index(es, self.bulk_actions(cnx, indexer, new_index), self.log)
+
+            new_index = indexer.rebuild_index(es, populate, index_name)
+            if new_index is None:
+                self.log.error(f"{time.ctime()}: [{index_name}] indexing errors, left unchanged")
+                sys.exit(1)
+            self.log.info(f"{time.ctime()}: [{index_name}] now points to {new_index}")
 
-    def bulk_actions(self, cnx, es, indexer):
-        index_name = self.config.index_name or indexer.index_name
+    def bulk_actions(self, cnx, indexer, index_name):
         etypes = self.config.etypes or indexer.etypes
         for etype in etypes:
             nb_entities = cnx.execute("Any COUNT(X) WHERE X is %s" % etype)[0][0]
@@ -256,7 +423,7 @@ class IndexESKibana(Command):
                 if json:
                     data = {
                         "_op_type": "index",
-                        "_index": indexer.index_name,
+                        "_index": index_name,
                         "_id": serializer.es_id,
                         "_source": json,
                     }
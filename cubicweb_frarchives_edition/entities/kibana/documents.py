@@ -31,7 +31,8 @@
 
 """indexes for kibana"""
 
-from elasticsearch import helpers as es_helpers
+import logging
+import time
 
 
 from logilab.common.decorators import cachedproperty
@@ -127,6 +128,11 @@ class PniaDocumentsKibanaIndexer(AbstractKibanaIndexer):
         }
     }
 
+    resumable = True
+    reindex_slices = 8
+    reindex_retries = 2
+    reindex_poll_interval = 10
+
     @property
     def index_name(self):
         return self._cw.vreg.config["kibana-ir-index-name"]
@@ -145,15 +151,89 @@ class PniaDocumentsKibanaIndexer(AbstractKibanaIndexer):
     def source_index_name(self):
         return self.source_es_params["index-name"] + "_all"
 
-    def populate_index(self):
+    def reindex_state(self, es, index_name):
+        """return the reindexation state stored in the `index_name` mapping metadata
+
+        The state is reset if it was recorded for another source index or another
+        number of slices.
+        """
+        mapping = es.indices.get_mapping(index=index_name)[index_name]["mappings"]
+        state = mapping.get("_meta", {}).get("reindex", {})
+        if (
+            state.get("source") != self.source_index_name
+            or state.get("slices") != self.reindex_slices
+        ):
+            state = {"source": self.source_index_name, "slices": self.reindex_slices}
+        state.setdefault("completed", [])
+        return state
+
+    def save_reindex_state(self, es, index_name, state):
+        es.indices.put_mapping(index=index_name, body={"_meta": {"reindex": state}})
+
+    def start_reindex_slice(self, es, index_name, slice_id):
+        """start a server-side `_reindex` task copying the `slice_id` slice of the
+        source index into `index_name` and return the task id
+        """
+        body = {
+            "source": {
+                "index": self.source_index_name,
+                "query": {"terms": {"cw_etype": ["FindingAid", "FAComponent"]}},
+                "size": self.bulk_chunk_size,
+                "slice": {"id": slice_id, "max": self.reindex_slices},
+            },
+            "dest": {"index": index_name},
+        }
+        return es.reindex(body=body, wait_for_completion=False)["task"]
+
+    def populate_index(self, index_name=None, progress=None):
+        """copy published FindingAid and FAComponent documents into `index_name`
+
+        The copy is split in `reindex_slices` slices, each one being run by a
+        server-side `_reindex` task. Slices are retried `reindex_retries` times on
+        failure and completed slices are recorded in the `index_name` mapping
+        metadata so that calling `populate_index` again on a partially loaded index
+        only processes the remaining slices.
+        """
+        log = logging.getLogger("es.index-kibana")
+        index_name = index_name or self.index_name
         es = get_connection(self.source_es_params)
-        for etype in ("FindingAid", "FAComponent"):
-            es_helpers.reindex(
-                es,
-                source_index=self.source_index_name,
-                target_index=self.index_name,
-                query={"query": {"match": {"cw_etype": etype}}},
-            )
+        state = self.reindex_state(es, index_name)
+        pending = [
+            slice_id
+            for slice_id in range(self.reindex_slices)
+            if slice_id not in state["completed"]
+        ]
+        if len(pending) < self.reindex_slices:
+            log.info("[%s] resuming reindexation of slices %s", index_name, pending)
+        retries = dict.fromkeys(pending, self.reindex_retries)
+        tasks = {
+            slice_id: self.start_reindex_slice(es, index_name, slice_id) for slice_id in pending
+        }
+        while tasks:
+            time.sleep(self.reindex_poll_interval)
+            running = 0.0
+            for slice_id, task_id in list(tasks.items()):
+                result = es.tasks.get(task_id=task_id)
+                status = result["task"]["status"]
+                if not result["completed"]:
+                    if status["total"]:
+                        running += (status["created"] + status["updated"]) / status["total"]
+                    continue
+                del tasks[slice_id]
+                error = result.get("error") or result.get("response", {}).get("failures")
+                if not error:
+                    state["completed"].append(slice_id)
+                    self.save_reindex_state(es, index_name, state)
+                    continue
+                if not retries[slice_id]:
+                    raise Exception(
+                        "[{}] failed to reindex slice {}: {}".format(index_name, slice_id, error)
+                    )
+                log.warning("[%s] retrying slice %s after error: %s", index_name, slice_id, error)
+                retries[slice_id] -= 1
+                tasks[slice_id] = self.start_reindex_slice(es, index_name, slice_id)
+            if progress is not None:
+                progress((len(state["completed"]) + running) / self.reindex_slices)
 
 
 class IrKibanaSerializable(AbstractKibanaSerializable):
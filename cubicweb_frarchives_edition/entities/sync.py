@@ -50,6 +50,9 @@ from cubicweb_frarchives_edition import VarnishPurgeMixin
 
 INDEXABLE_DOC_TYPES = INDEXABLE_TYPES + list(ETYPES_MAP.keys())
 
+# max number of documents sent to elasticsearch in one bulk request
+SUGGEST_BULK_SIZE = 500
+
 
 def set_selectable_if_published(adapter):
     """object should be syncable only if publishable _and_ published"""
@@ -99,6 +102,8 @@ class SyncService(VarnishPurgeMixin, Service):
 
     def sync(self, sync_operations):
         urls_to_purge = []
+        # documents of deleted FindingAids are deleted from elasticsearch at once
+        deleted_stable_ids = []
         for op_type, entity in sync_operations:
             try:
                 ivarnish = entity.cw_adapt_to("IVarnish")
@@ -109,12 +114,22 @@ class SyncService(VarnishPurgeMixin, Service):
                     self.es_sync_index(entity)
                 elif op_type == "delete":
                     self.fs_sync_delete(entity)
-                    self.es_sync_delete(entity)
+                    if entity.cw_etype == "FindingAid":
+                        deleted_stable_ids.append(entity.stable_id)
+                    else:
+                        self.es_sync_delete(entity)
                 elif op_type == "index-children":
                     self.es_sync_children(entity)
             except Exception:
                 import traceback
 
+                traceback.print_exc()
+        if deleted_stable_ids:
+            try:
+                self.es_sync_delete_findingaids(deleted_stable_ids)
+            except Exception:
+                import traceback
+
                 traceback.print_exc()
         self.purge_varnish(urls_to_purge, self._cw.vreg.config)
 
@@ -186,13 +201,13 @@ class SyncService(VarnishPurgeMixin, Service):
             ifilesync.copy()
 
     @staticmethod
-    def _delete_fa_documents(es, index_name, stable_id):
-        """return all documents of type ``etype`` stored in ES"""
+    def _delete_fa_documents(es, index_name, stable_ids):
+        """return delete actions of all documents of FindingAids ``stable_ids`` stored in ES"""
         for doc in es_helpers.scan(
             es,
             index=index_name,
             docvalue_fields=(),
-            query={"query": {"match": {"fa_stable_id": stable_id}}},
+            query={"query": {"terms": {"fa_stable_id": stable_ids}}},
         ):
             yield {
                 "_op_type": "delete",
@@ -222,10 +237,7 @@ class SyncService(VarnishPurgeMixin, Service):
         es = get_connection(self.cms_es_params)
         serializable = entity.cw_adapt_to("IFullTextIndexSerializable")
         if entity.cw_etype == "FindingAid":
-            for index_name in (self.public_index_name,):
-                if index_name:
-                    es_docs = self._delete_fa_documents(es, index_name, entity.stable_id)
-                    es_bulk_index(es, es_docs, raise_on_error=False)
+            self._es_delete_findingaids(es, [entity.stable_id])
         elif entity.cw_etype in ("AuthorityRecord",):
             es.delete_by_query(
                 self.public_index_name,
@@ -240,6 +252,19 @@ class SyncService(VarnishPurgeMixin, Service):
                     self.public_index_name, doc_type=serializable.es_doc_type, id=serializable.es_id
                 )
 
+    def es_sync_delete_findingaids(self, stable_ids):
+        if not self.cms_es_params.get("elasticsearch-locations"):
+            self.error('no "elasticsearch-locations" config found')
+            return
+        es = get_connection(self.cms_es_params)
+        self._es_delete_findingaids(es, stable_ids)
+
+    def _es_delete_findingaids(self, es, stable_ids):
+        for index_name in (self.public_index_name,):
+            if index_name:
+                es_docs = self._delete_fa_documents(es, index_name, stable_ids)
+                es_bulk_index(es, es_docs, raise_on_error=False)
+
     def fs_sync_delete(self, entity):
         ifilesync = entity.cw_adapt_to("IFileSync")
         if ifilesync is not None:
@@ -266,22 +291,32 @@ class SuggestSyncService(Service):
     def public_index_name(self):
         return "{}_suggest".format(self._cw.vreg.config["published-index-name"])
 
-    def index_authorities(self, authorities):
+    def iter_authorities(self, eids, chunksize=SUGGEST_BULK_SIZE):
+        """yield authorities from `eids`, fetching them with one query per `chunksize` eids
+
+        eids of entities which do not exist anymore are silently skipped
+        """
+        eids = sorted({int(eid) for eid in eids})
+        for idx in range(0, len(eids), chunksize):
+            rset = self._cw.execute(
+                "Any X WHERE X eid IN (%s)"
+                % ", ".join(str(eid) for eid in eids[idx : idx + chunksize])
+            )
+            yield from rset.entities()
+
+    def index_authorities(self, authorities, chunksize=SUGGEST_BULK_SIZE):
         if not self.cms_es_params.get("elasticsearch-locations"):
             self.error('no "elasticsearch-locations" config found')
             return
         es = get_connection(self.cms_es_params)
-        cms_docs, public_docs = [], []
+        docs = []
         for entity in authorities:
             serializable = entity.cw_adapt_to("ISuggestIndexSerializable")
-            for _docs, index_name in (
-                (cms_docs, self.cms_index_name),
-                (public_docs, self.public_index_name),
-            ):
+            for index_name in (self.cms_index_name, self.public_index_name):
                 json = serializable.serialize(published=index_name == self.public_index_name)
                 if not json:
                     continue
-                _docs.append(
+                docs.append(
                     {
                         "_op_type": "index",
                         "_id": entity.eid,
@@ -290,9 +325,40 @@ class SuggestSyncService(Service):
                         "_source": json,
                     }
                 )
-        for docs in (cms_docs, public_docs):
-            if docs:
+            if len(docs) >= chunksize:
                 es_bulk_index(es, docs, raise_on_error=False)
+                docs = []
+        if docs:
+            es_bulk_index(es, docs, raise_on_error=False)
+
+    def index_authority_eids(self, eids, chunksize=SUGGEST_BULK_SIZE):
+        self.index_authorities(self.iter_authorities(eids, chunksize), chunksize)
+
+
+class SuggestIndexBuffer(object):
+    """Collect eids of authorities to be reindexed in the suggest indexes.
+
+    Each authority is indexed once on `flush` whatever the number of times it
+    has been added, documents being sent by bulk requests of `chunksize`.
+    """
+
+    def __init__(self, cnx, chunksize=SUGGEST_BULK_SIZE):
+        self.cnx = cnx
+        self.chunksize = chunksize
+        self.eids = set()
+
+    def __len__(self):
+        return len(self.eids)
+
+    def add(self, eids):
+        self.eids.update(int(eid) for eid in eids)
+
+    def flush(self):
+        if not self.eids:
+            return
+        eids, self.eids = self.eids, set()
+        service = self.cnx.vreg["services"].select("reindex-suggest", self.cnx)
+        service.index_authority_eids(eids, self.chunksize)
 
 
 for obj in list(vars(fa_sync).values()):
@@ -37,19 +37,17 @@ from itertools import chain
 import urllib.parse
 
 from lxml import etree
-from PIL import Image
 
 import requests
 from rql import RQLSyntaxError
 
-from cubicweb import Unauthorized, ValidationError, Binary
+from cubicweb import Unauthorized, ValidationError
 from cubicweb.predicates import is_instance, relation_possible, score_entity
 from cubicweb.server import hook
 
-from cubicweb_francearchives import CMS_I18N_OBJECTS, S3_ACTIVE
+from cubicweb_francearchives import CMS_I18N_OBJECTS
 from cubicweb_francearchives.entities.cms import MapCSVReader
 from cubicweb_francearchives.schema.cms import CMS_OBJECTS
-from cubicweb_francearchives.storage import S3BfssStorageMixIn
 
 from cubicweb_frarchives_edition import (
     ForbiddenPublishedTransition,
@@ -746,93 +744,92 @@ class OnFrontPageHook(hook.Hook):
 
 
 class SubjectImageCropHook(hook.Hook):
-    """resize Subject Image"""
+    """resize Subject Image when its file content changes
+
+    Images are cropped in the editor, so a new crop is a new file content.
+    """
 
     __regid__ = "frarchives_edition.subject_image_resize"
-    __select__ = hook.Hook.__select__ & is_instance("Image")
+    __select__ = hook.Hook.__select__ & is_instance("File")
     events = ("before_update_entity",)
 
     def __call__(self):
-        if self.entity.reverse_subject_image:
-            SubjectImageCropOp.get_instance(self._cw).add_data(self.entity.eid)
+        edited = self.entity.cw_edited
+        if edited.get("data") is None:
+            return
+        rset = self._cw.execute(
+            "Any I WHERE I image_file F, F eid %(e)s, EXISTS(X subject_image I)",
+            {"e": self.entity.eid},
+        )
+        if not rset:
+            return
+        if "data_hash" not in edited:
+            # data_hash is the derivative cache key
+            edited["data_hash"] = self.entity.compute_hash(edited["data"].getvalue())
+        for (eid,) in rset:
+            SubjectImageCropOp.get_instance(self._cw).add_data(eid)
 
 
 class SubjectImageRelationResizeHook(hook.Hook):
     __regid__ = "frarchives_edition.subject_image_resize.relation"
     events = ("after_add_relation",)
-    __select__ = hook.Hook.__select__ & hook.match_rtype("subject_image")
+    __select__ = hook.Hook.__select__ & hook.match_rtype("subject_image", "image_file")
 
     def __call__(self):
-        SubjectImageCropOp.get_instance(self._cw).add_data(self.eidto)
-
-
-def normalise_crop_size(current, target):
-    if current == target:
-        return current
-    current_width, current_height = current
-    target_width, target_height = target
-
-    width_ratio = current_width / float(target_width)
-    height_ratio = current_height / float(target_height)
-
-    if width_ratio > height_ratio:
-        # width is too big
-        ratio = (target_width * current_height) / float(target_height * current_width)
-        return (int(round(current_width * ratio)), current_height)
-    elif height_ratio > width_ratio:
-        # height is too big
-        ratio = (target_height * current_width) / float(target_width * current_height)
-        return (current_width, int(round(current_height * ratio)))
-    else:
-        # ratios are equals
-        return (current_width, current_height)
-
-
-def crop_image(image, final_shape, crop_shape):
-    image_width, image_height = image.size
-    crop_width, crop_height = crop_shape
-    top = int(round(float(image_height) / 2 - (float(crop_height) / 2)))
-    left = int(round(float(image_width) / 2 - (float(crop_width) / 2)))
-    box = (left, top, left + crop_width, top + crop_height)
-    cropped_image = image.crop(box)
-    if cropped_image.size == final_shape:
-        return cropped_image
-    return cropped_image.resize(final_shape, Image.Resampling.LANCZOS)
+        if self.rtype == "subject_image":
+            SubjectImageCropOp.get_instance(self._cw).add_data(self.eidto)
+        elif self._cw.execute(
+            "Any I WHERE I eid %(e)s, EXISTS(X subject_image I)", {"e": self.eidfrom}
+        ):
+            SubjectImageCropOp.get_instance(self._cw).add_data(self.eidfrom)
 
 
 class SubjectImageCropOp(hook.DataOperationMixIn, hook.Operation):
-    """SubjectImages must all have the same SUBJECT_IMAGE_SIZE size."""
+    """SubjectImages must all have the same SUBJECT_IMAGE_SIZE size.
+
+    Images are resized by the `resize_subject_images` task once the transaction
+    is committed; images which already are a cached derivative are skipped.
+    """
 
     def precommit_event(self):
+        from cubicweb_frarchives_edition.tasks.subject_images import (
+            get_derivative_hash,
+            resize_subject_images,
+        )
+
         cnx = self.cnx
-        st = S3BfssStorageMixIn()
+        eids = []
         for eid in self.get_data():
             if cnx.deleted_in_transaction(eid):
                 continue
-            image_path = cnx.execute(
-                "Any FSPATH(D) WHERE X eid %(e)s, X image_file F, F data D", {"e": eid}
-            )
-            image_entity = cnx.entity_from_eid(eid)
-            if not image_path:
+            rset = cnx.execute("Any H WHERE X eid %(e)s, X image_file F, F data_hash H", {"e": eid})
+            if not rset:
                 continue
-            image_path = image_path[0][0].getvalue()
-            if not image_path:
+            data_hash = rset[0][0]
+            if data_hash and get_derivative_hash(cnx, data_hash, SUBJECT_IMAGE_SIZE) == data_hash:
                 continue
-            stream = io.BytesIO(st.storage_get_file_content(image_path))
-            image = Image.open(stream)
-            size = image.size
-            format_ = image.format
-            if size != SUBJECT_IMAGE_SIZE:
-                # avoid an odd difference between the desired size, and old size
-                crop_size = normalise_crop_size(size, SUBJECT_IMAGE_SIZE)
-                image = crop_image(image, SUBJECT_IMAGE_SIZE, crop_size)
-            if S3_ACTIVE:
-                byte_io = io.BytesIO()
-                image.save(byte_io, format_, optimize=True, quality=100)
-                content = byte_io.getvalue()
-                image_entity.image_file[0].cw_set(data=Binary(content))
-            else:
-                raise Exception("S3 is not active.")
+            eids.append(eid)
+        if not eids:
+            return
+        rqtask = cnx.create_entity(
+            "RqTask",
+            name="resize_subject_images",
+            title="resize {} subject images".format(len(eids)),
+        )
+        rqtask.cw_adapt_to("IRqJob").enqueue(resize_subject_images, eids)
+
+
+class DeleteRqTaskLogsHook(hook.Hook):
+    """remove stored log chunks along with their RqTask"""
+
+    __regid__ = "frarchives_edition.rqtask.delete-logs"
+    __select__ = hook.Hook.__select__ & is_instance("RqTask")
+    events = ("before_delete_entity",)
+
+    def __call__(self):
+        self._cw.system_sql(
+            "DELETE FROM rqtask_log_chunks WHERE task_eid=%(e)s", {"e": self.entity.eid}
+        )
 
 
 def registration_callback(vreg):
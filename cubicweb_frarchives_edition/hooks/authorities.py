@@ -31,27 +31,26 @@
 
 """cubicweb-frarchives-edition specific hooks and operations"""
 from collections import defaultdict
+from itertools import chain
+
+from psycopg2.extras import execute_values
 
 from cubicweb.server import hook
 from cubicweb.predicates import score_entity, is_instance
 
-from cubicweb import ValidationError
-
-
-from cubicweb_frarchives_edition import get_leaflet_cache_entities
+from cubicweb_frarchives_edition import AUTHORITIES, get_leaflet_cache_entities
 from cubicweb_francearchives.entities.es import SUGGEST_ETYPES
 
 from cubicweb_frarchives_edition import update_samesas_history, GEONAMES_RE
 
 from cubicweb_frarchives_edition.alignments import (
-    compute_label_from_url,
+    compute_geonames_labels,
     get_externaluri_data,
     DATABNF_SOURCE,
     WIKIDATA_SOURCE,
 )
 
-from cubicweb_frarchives_edition.alignments.databnf import DataBnfDatabase
-from cubicweb_frarchives_edition.alignments.wikidata import WikidataDatabase
+from cubicweb_frarchives_edition.entities.sync import SuggestIndexBuffer
 
 
 def type_sameas_uri(cnx, eidto, eidfrom):
@@ -72,6 +71,10 @@ def suggest_indexable(entity):
     return entity.cw_etype in SUGGEST_ETYPES
 
 
+# attributes serialized in the kibana authority index
+KIBANA_AUTHORITY_ATTRIBUTES = {"label", "quality", "latitude", "longitude"}
+
+
 class UpdateSuggestIndexES(hook.Hook):
 
     """detects content change and updates Suggest ES indexing"""
@@ -85,17 +88,30 @@ class UpdateSuggestIndexES(hook.Hook):
         SuggestIndexEsOperation.get_instance(self._cw).add_data(self.entity.eid)
 
 
-class SuggestIndexEsOperation(hook.DataOperationMixIn, hook.LateOperation):
+def suggest_index_buffer(cnx):
+    """return the transaction-wide buffer of authorities to be reindexed in the
+    suggest indexes, scheduling its flush after commit"""
+    if "suggest-index-buffer" not in cnx.transaction_data:
+        cnx.transaction_data["suggest-index-buffer"] = SuggestIndexBuffer(cnx)
+        FlushSuggestIndexBufferOp.get_instance(cnx)
+    return cnx.transaction_data["suggest-index-buffer"]
+
+
+class FlushSuggestIndexBufferOp(hook.SingleLastOperation):
     def postcommit_event(self):
+        buffer = self.cnx.transaction_data.get("suggest-index-buffer")
+        if buffer is not None:
+            buffer.flush()
+
+
+class SuggestIndexEsOperation(hook.DataOperationMixIn, hook.LateOperation):
+    def precommit_event(self):
         cnx = self.cnx
-        data = []
-        for eid in self.get_data():
-            data.append(cnx.entity_from_eid(eid))
-        if data:
-            if cnx.vreg.config.mode == "test":
-                return
-            service = cnx.vreg["services"].select("reindex-suggest", cnx)
-            service.index_authorities(data)
+        if cnx.vreg.config.mode == "test":
+            return
+        eids = [eid for eid in self.get_data() if not cnx.deleted_in_transaction(eid)]
+        if eids:
+            suggest_index_buffer(cnx).add(eids)
 
 
 class AddSameAsHistory(hook.Hook):
@@ -152,59 +168,87 @@ class DeleteSameAsLocalisation(hook.Hook):
         RegisterSameAsLocalisationOp.get_instance(self._cw).add_data((self.eidto, self.eidfrom, 0))
 
 
-def get_auth_coordinates(uri):
-    igeo = uri.cw_adapt_to("IGeoDB")
-    if igeo:
-        return (igeo.latitude, igeo.longitude)
+class RegisterSameAsLocalisationOp(hook.DataOperationMixIn, hook.Operation):
+    """Update LocationAuthority coordinates when geolocated same_as (GeoNames
+    ExternalUri, BANO ExternalId) are added or removed.
 
+    All GeoNames and BANO ids touched by the transaction are resolved at once
+    and coordinates are written with a single UPDATE.
+    """
 
-class RegisterSameAsLocalisationOp(hook.DataOperationMixIn, hook.Operation):
-    def get_geo_coordinates(self, candidates):
-        records = []
+    def get_geo_coordinates(self, geonameids, banoids):
+        """Return a {(etype, extid): (latitude, longitude)} dict where etype is
+        either "externaluri" (GeoNames) or "externalid" (BANO)."""
         cnx = self.cnx
-        extids = candidates["externalid"]
-        if extids:
-            q = """
-            SELECT lat, lon
-            FROM bano_whitelisted WHERE banoid IN (%(banoids)s)
-            """
-            extid_ids = ", ".join(str(extid) for extid in extids)
-            res = cnx.system_sql(q, {"banoids": extid_ids}).fetchall()
-            if res:
-                records.extend(res)
-        gids = candidates["externaluri"]
-        if gids:
-            q = """
-            SELECT latitude, longitude
-            FROM geonames WHERE geonameid IN (%(geonameids)s)
-            """
-            geonameids = ", ".join(str(gid) for gid in gids)
-            res = cnx.system_sql(q % {"geonameids": geonameids}).fetchall()
-            if res:
-                records.extend(res)
-        return records
-
-    def change_autority_coordinates(self, auth):
-        """this method is called if a same_as relation has been deleted"""
-        kwargs = {"latitude": None, "longitude": None}
-        uris = auth.same_as
-        if uris:
-            uris = list(uris)
-            # search for other coordonnates: first consider Bano alignments
-            uris.sort(key=lambda x: x.cw_etype != "ExternalId")
-            for uri in uris:
-                igeo = uri.cw_adapt_to("IGeoDB")
-                if igeo:
-                    latitude, longitude = igeo.latitude, igeo.longitude
-                    if latitude:
-                        kwargs = {"latitude": latitude, "longitude": longitude}
-                        break
-        auth.cw_set(**kwargs)
+        coordinates = {}
+        if banoids:
+            rows = cnx.system_sql(
+                "SELECT banoid, lat, lon FROM bano_whitelisted WHERE banoid = ANY(%(ids)s)",
+                {"ids": sorted(banoids)},
+            ).fetchall()
+            for banoid, latitude, longitude in rows:
+                coordinates[("externalid", banoid)] = (latitude, longitude)
+        geonameids = sorted(int(gid) for gid in geonameids if str(gid).isdigit())
+        if geonameids:
+            rows = cnx.system_sql(
+                """SELECT geonameid, latitude, longitude
+                   FROM geonames WHERE geonameid = ANY(%(ids)s)""",
+                {"ids": geonameids},
+            ).fetchall()
+            for geonameid, latitude, longitude in rows:
+                coordinates[("externaluri", str(geonameid))] = (latitude, longitude)
+        return coordinates
+
+    def get_geolocated_sameas(self, auth_eids):
+        """Return a {authority eid: [(etype, extid)]} dict of the geolocated
+        same_as of `auth_eids`, BANO alignments first."""
+        rset = self.cnx.execute(
+            "Any A, ETN, S, X WHERE A eid IN (%s), A same_as U, U is ET, ET name ETN, "
+            'ET name IN ("ExternalUri", "ExternalId"), U source S, U extid X'
+            % ", ".join(str(eid) for eid in auth_eids)
+        )
+        sameas = defaultdict(list)
+        for auth_eid, etype, source, extid in rset:
+            if (etype, source) in (("ExternalUri", "geoname"), ("ExternalId", "bano")):
+                sameas[auth_eid].append((etype.lower(), extid))
+        for keys in sameas.values():
+            keys.sort(key=lambda key: key[0] != "externalid")
+        return sameas
+
+    def update_coordinates(self, auths, coordinates):
+        """Set `coordinates` ({authority eid: (latitude, longitude)}) with a
+        single UPDATE and schedule the operations `cw_set` hooks would have
+        triggered."""
+        cnx = self.cnx
+        execute_values(
+            cnx.cnxset.cu,
+            """UPDATE cw_locationauthority AS loc
+               SET cw_latitude=coords.latitude, cw_longitude=coords.longitude,
+                   cw_modification_date=NOW()
+               FROM (VALUES %s) AS coords(eid, latitude, longitude)
+               WHERE loc.cw_eid=coords.eid""",
+            [(eid, latitude, longitude) for eid, (latitude, longitude) in coordinates.items()],
+            template="(%s, %s::double precision, %s::double precision)",
+        )
+        leaflet_op = LocationAuthorityLeafletMapOp.get_instance(cnx)
+        suggest_op = SuggestIndexEsOperation.get_instance(cnx)
+        for eid, (latitude, longitude) in coordinates.items():
+            auth = auths[eid]
+            # keep entities cached in the transaction up to date
+            auth.cw_attr_cache["latitude"] = latitude
+            auth.cw_attr_cache["longitude"] = longitude
+            leaflet_op.add_data((eid, bool(latitude or longitude)))
+            suggest_op.add_data(eid)
+        if cnx.vreg.config["enable-kibana-indexes"]:
+            kibana_op = KibanaAuthorityQueueOp.get_instance(cnx)
+            for eid in coordinates:
+                kibana_op.add_data(eid)
 
     def precommit_event(self):
         cnx = self.cnx
-        to_delete_candidates = defaultdict(lambda: defaultdict(list))
-        to_add_candidates = defaultdict(lambda: defaultdict(list))
+        auths = {}
+        to_delete_candidates = defaultdict(set)
+        to_add_candidates = defaultdict(dict)
         for eidfrom, eidto, action in self.get_data():
             if cnx.deleted_in_transaction(eidfrom) or cnx.deleted_in_transaction(eidto):
                 continue
@@ -227,21 +271,50 @@ class RegisterSameAsLocalisationOp(hook.DataOperationMixIn, hook.Operation):
             elif exturi.cw_etype == "ExternalId":
                 geoid = exturi.extid
             if geoid:
+                auths[auth.eid] = auth
                 if action == 0:
-                    to_delete_candidates[auth][exturi.cw_etype.lower()].append(geoid)
+                    to_delete_candidates[auth.eid].add((exturi.cw_etype.lower(), geoid))
                 else:
                     # we take a random coordinates to set on authority
-                    to_add_candidates[auth][exturi.cw_etype.lower()] = [geoid]
-        for auth, exturis in list(to_delete_candidates.items()):
-            coords = self.get_geo_coordinates(exturis)
+                    to_add_candidates[auth.eid][exturi.cw_etype.lower()] = geoid
+        if not auths:
+            return
+        sameas = self.get_geolocated_sameas(auths)
+        geoids = defaultdict(set)
+        for keys in chain(to_delete_candidates.values(), sameas.values()):
+            for etype, geoid in keys:
+                geoids[etype].add(geoid)
+        for candidates in to_add_candidates.values():
+            for etype, geoid in candidates.items():
+                geoids[etype].add(geoid)
+        coordinates = self.get_geo_coordinates(geoids["externaluri"], geoids["externalid"])
+        new_coordinates = {}
+        for auth_eid, keys in to_delete_candidates.items():
+            auth = auths[auth_eid]
+            coords = [coordinates[key] for key in keys if key in coordinates]
             if (auth.latitude, auth.longitude) in coords:
-                self.change_autority_coordinates(auth)
-        for auth, exturi in list(to_add_candidates.items()):
+                # search for other coordinates: first consider BANO alignments
+                new_coordinates[auth_eid] = (None, None)
+                for key in sameas.get(auth_eid, ()):
+                    if coordinates.get(key, (None,))[0]:
+                        new_coordinates[auth_eid] = coordinates[key]
+                        break
+        for auth_eid, candidates in to_add_candidates.items():
             # only ExternalUri can be added by users
-            if not any((u for u in auth.same_as if u.cw_etype == "ExternalId")):
-                coords = self.get_geo_coordinates(exturi)
-                if coords:
-                    auth.cw_set(latitude=coords[0][0], longitude=coords[0][1])
+            if any(etype == "externalid" for etype, _ in sameas.get(auth_eid, ())):
+                continue
+            for etype in ("externalid", "externaluri"):
+                key = (etype, candidates.get(etype))
+                if key in coordinates:
+                    new_coordinates[auth_eid] = coordinates[key]
+                    break
+        new_coordinates = {
+            eid: coords
+            for eid, coords in new_coordinates.items()
+            if coords != (auths[eid].latitude, auths[eid].longitude)
+        }
+        if new_coordinates:
+            self.update_coordinates(auths, new_coordinates)
 
 
 class UpdateExternalUriSourceHook(hook.Hook):
@@ -264,10 +337,8 @@ class UpdateExternalUriSourceHook(hook.Hook):
         old_extid, new_extid = self.entity.cw_edited.oldnewvalue("extid")
         update = (new_uri != old_uri) or (old_extid != new_extid)
         if self.entity.reverse_agent_info_of and update:
-            if entity.source == DATABNF_SOURCE:
-                AuthorityBnFDataOperation.get_instance(self._cw).add_data(self.entity.eid)
-            if entity.source == WIKIDATA_SOURCE:
-                AuthorityWikiDataOperation.get_instance(self._cw).add_data(self.entity.eid)
+            if entity.source in (DATABNF_SOURCE, WIKIDATA_SOURCE):
+                AgentInfoQueueOp.get_instance(self._cw).add_data(self.entity.eid)
 
 
 class SameAsRelHook(hook.Hook):
@@ -281,51 +352,31 @@ class SameAsRelHook(hook.Hook):
 
     def __call__(self):
         exturi, auth = type_sameas_uri(self._cw, self.eidto, self.eidfrom)
-        if exturi:
-            if exturi.source == DATABNF_SOURCE:
-                AuthorityBnFDataOperation.get_instance(self._cw).add_data(self.eidto)
-            if exturi.source == WIKIDATA_SOURCE:
-                AuthorityWikiDataOperation.get_instance(self._cw).add_data(self.eidto)
+        if exturi and exturi.source in (DATABNF_SOURCE, WIKIDATA_SOURCE):
+            AgentInfoQueueOp.get_instance(self._cw).add_data(self.eidto)
+
 
+class AgentInfoQueueOp(hook.DataOperationMixIn, hook.LateOperation):
+    """insert ExternalUri into the `agent_info_queue` table, from where their
+    AgentInfo are retrieved from data.bnf.fr or Wikidata by the
+    `refresh_agent_infos` task"""
 
-class AgentAuthorityDataOperation(hook.DataOperationMixIn, hook.LateOperation):
     def precommit_event(self):
         cnx = self.cnx
-        aligner = self.aligner()
-        for eid in self.get_data():
-            if cnx.deleted_in_transaction(eid) or eid is None:
-                continue
-            try:
-                exturi = cnx.entity_from_eid(eid)
-            except Exception:
-                continue
-            try:
-                data = aligner.agent_infos(exturi.extid)
-            except Exception as ex:
-                msg = cnx._("Could not retrieve data from {}: {}").format(exturi.uri, ex)
-                raise ValidationError(eid, {"uri": msg})
-            if data:
-                label = data.pop("label", None)
-                # add ExternalUri label
-                if label and label != exturi.label:
-                    exturi.cw_set(label=label)
-                # create a new AgentInfo
-                cnx.execute(
-                    """DELETE AgentInfo X WHERE X agent_info_of U,
-                       U eid {eid}""".format(
-                        eid=exturi.eid
-                    )
-                )
-                data["agent_info_of"] = eid
-                cnx.create_entity("AgentInfo", **data)
-
-
-class AuthorityBnFDataOperation(AgentAuthorityDataOperation):
-    aligner = DataBnfDatabase
-
-
-class AuthorityWikiDataOperation(AgentAuthorityDataOperation):
-    aligner = WikidataDatabase
+        eids = sorted(
+            eid
+            for eid in self.get_data()
+            if eid is not None and not cnx.deleted_in_transaction(eid)
+        )
+        if not eids:
+            return
+        cnx.system_sql(
+            """INSERT INTO agent_info_queue (eid) VALUES {}
+               ON CONFLICT (eid) DO UPDATE SET queued_at=CURRENT_TIMESTAMP,
+               attempts=0, next_attempt=CURRENT_TIMESTAMP, last_error=NULL""".format(
+                ", ".join("({})".format(eid) for eid in eids)
+            )
+        )
 
 
 # leaflet map related hooks
@@ -407,18 +458,22 @@ class GeonamesLabelCreationHook(hook.Hook):
         label = entity.cw_edited.get("label")
         if not label:
             uri = entity.cw_edited.get("uri")
-            new_label = compute_label_from_url(self._cw, uri)
-            if new_label:
+            if uri and GEONAMES_RE.search(uri):
                 GeonamesLabelCreationOperation.get_instance(self._cw).add_data(
-                    (self.entity.eid, new_label)
+                    (self.entity.eid, uri)
                 )
 
 
 class GeonamesLabelCreationOperation(hook.DataOperationMixIn, hook.Operation):
+    """compute labels of all GeoNames ExternalUri created in the transaction at once"""
+
     def precommit_event(self):
         cnx = self.cnx
-        for eid, label in self.get_data():
-            if cnx.deleted_in_transaction(eid):
+        data = [(eid, uri) for eid, uri in self.get_data() if not cnx.deleted_in_transaction(eid)]
+        labels = compute_geonames_labels(cnx, [uri for _, uri in data])
+        for eid, uri in data:
+            label = labels.get(uri)
+            if not label:
                 continue
             entity = cnx.entity_from_eid(eid)
             with cnx.allow_all_hooks_but("sameas-label"):
@@ -435,14 +490,59 @@ class ESRelatedAuthorityHook(hook.Hook):
 
 
 class ESRelatedAuthorityOperation(hook.DataOperationMixIn, hook.Operation):
-    def postcommit_event(self):
+    def precommit_event(self):
         # es index authorities
         cnx = self.cnx
-        authorities = [str(eid) for eid in self.get_data() if not cnx.deleted_in_transaction(eid)]
+        authorities = [eid for eid in self.get_data() if not cnx.deleted_in_transaction(eid)]
         if authorities:
-            authorities = cnx.execute(
-                "DISTINCT Any X WHERE X eid IN  (%(eids)s)" % {"eids": ", ".join(authorities)}
-            ).entities()
-            self.cnx.vreg["services"].select("reindex-suggest", self.cnx).index_authorities(
-                authorities
+            suggest_index_buffer(cnx).add(authorities)
+
+
+class KibanaAuthorityChangesHook(hook.Hook):
+    """record created, deleted and updated authorities in the kibana authority queue"""
+
+    __regid__ = "frarchives_edition.kibana.authority-changes"
+    __select__ = hook.Hook.__select__ & is_instance(*AUTHORITIES)
+    events = ("after_add_entity", "after_update_entity", "after_delete_entity")
+    category = "kibana-authority-queue"
+
+    def __call__(self):
+        if not self._cw.vreg.config["enable-kibana-indexes"]:
+            return
+        if self.event == "after_update_entity" and not KIBANA_AUTHORITY_ATTRIBUTES.intersection(
+            self.entity.cw_edited
+        ):
+            return
+        KibanaAuthorityQueueOp.get_instance(self._cw).add_data(self.entity.eid)
+
+
+class KibanaAuthorityRelationsHook(hook.Hook):
+    """record authorities whose index entries, grouping or alignments changed in the
+    kibana authority queue"""
+
+    __regid__ = "frarchives_edition.kibana.authority-relations"
+    __select__ = hook.Hook.__select__ & hook.match_rtype("authority", "grouped_with", "same_as")
+    events = ("after_add_relation", "after_delete_relation")
+    category = "kibana-authority-queue"
+
+    def __call__(self):
+        cnx = self._cw
+        if not cnx.vreg.config["enable-kibana-indexes"]:
+            return
+        op = KibanaAuthorityQueueOp.get_instance(cnx)
+        for eid in (self.eidfrom, self.eidto):
+            if cnx.entity_type(eid) in AUTHORITIES:
+                op.add_data(eid)
+
+
+class KibanaAuthorityQueueOp(hook.DataOperationMixIn, hook.LateOperation):
+    """insert authorities into the `kibana_authority_queue` table, from where they
+    are reindexed by the `index_kibana_authority_queue` task"""
+
+    def precommit_event(self):
+        self.cnx.system_sql(
+            """INSERT INTO kibana_authority_queue (eid) VALUES {}
+               ON CONFLICT (eid) DO UPDATE SET queued_at=CURRENT_TIMESTAMP""".format(
+                ", ".join("({})".format(eid) for eid in sorted(self.get_data()))
             )
+        )
@@ -35,11 +35,16 @@ from cubicweb import ValidationError
 from cubicweb.predicates import is_instance
 from cubicweb.server import hook
 
-from cubicweb_frarchives_edition.xmlutils import generate_summary, InvalidHTMLError
+from cubicweb_frarchives_edition.xmlutils import (
+    generate_summary,
+    headings_changed,
+    InvalidHTMLError,
+    parse_html_fragments,
+)
 
 
 class BaseContentSummaryHook(hook.Hook):
-    """ summary"""
+    """summary"""
 
     __regid__ = "frarchives_edition.base_content.toc"
     __select__ = hook.Hook.__select__ & is_instance("BaseContent")
@@ -54,7 +59,8 @@ class BaseContentSummaryHook(hook.Hook):
         old_content, new_content = entity.cw_edited.oldnewvalue("content")
         old_policy, new_policy = entity.cw_edited.oldnewvalue("summary_policy")
         changed_policy = new_policy != old_policy
-        if new_content != old_content or changed_policy:
+        # the summary only depends on headings: skip changes of other texts
+        if headings_changed(old_content, new_content) or changed_policy:
             in_summary = self._cw.transaction_data.setdefault("bc-summary", set())
             if entity.eid not in in_summary:
                 in_summary.add(entity.eid)
@@ -63,10 +69,14 @@ class BaseContentSummaryHook(hook.Hook):
                     # regenerate summaries for all translations
                     for tr in entity.reverse_translation_of:
                         BaseContentSummaryOp.get_instance(self._cw).add_data((tr.eid))
+        elif old_content != new_content:
+            # headings are unchanged: only check the new content is valid HTML
+            self._cw.transaction_data.setdefault("bc-content-check", set()).add(entity.eid)
+            BaseContentSummaryOp.get_instance(self._cw).add_data((entity.eid))
 
 
 class BaseContentTranslationSummaryHook(hook.Hook):
-    """ summary"""
+    """summary"""
 
     __regid__ = "frarchives_edition.bt_translation.toc"
     __select__ = hook.Hook.__select__ & is_instance("BaseContentTranslation")
@@ -78,11 +88,15 @@ class BaseContentTranslationSummaryHook(hook.Hook):
         # We should thus compare here old and new values here to decide if an attribute
         # value had been changed.
         old_content, new_content = self.entity.cw_edited.oldnewvalue("content")
-        if new_content != old_content:
+        if headings_changed(old_content, new_content):
             in_summary = self._cw.transaction_data.setdefault("bc-summary", set())
             if self.entity.eid not in in_summary:
                 in_summary.add(self.entity.eid)
                 BaseContentSummaryOp.get_instance(self._cw).add_data((self.entity.eid))
+        elif old_content != new_content:
+            # headings are unchanged: only check the new content is valid HTML
+            self._cw.transaction_data.setdefault("bc-content-check", set()).add(self.entity.eid)
+            BaseContentSummaryOp.get_instance(self._cw).add_data((self.entity.eid))
 
 
 class BaseContentTranslationSummaryRelHook(hook.Hook):
@@ -99,25 +113,31 @@ class BaseContentSummaryOp(hook.DataOperationMixIn, hook.Operation):
     """generate summary (toc) for BaseContent and BaseContentTranslation"""
 
     def precommit_event(self):
+        txdata = self.cnx.transaction_data
+        # contents whose headings are unchanged: the summary is kept as is
+        check_only = txdata.get("bc-content-check", set()) - txdata.get("bc-summary", set())
         for eid in self.get_data():
             entity = self.cnx.entity_from_eid(eid)
             summary_policy = entity.summary_policy
             if summary_policy == "no_summary":
-                if entity.summary:
+                if entity.summary and eid not in check_only:
                     entity.cw_set(summary=None)
                 continue
             # at this point summary_policy value must be "summary_headers_X"
             _, last_heading = summary_policy.rsplit("_", 1)
             assert _, "summary_headers"
             try:
+                if eid in check_only:
+                    parse_html_fragments(entity.content)
+                    continue
                 summary, modified_content = generate_summary(entity.content, int(last_heading))
             except InvalidHTMLError:
-                msg = self._cw._(
+                msg = self.cnx._(
                     """The "content" field HTML is not valid. Please,
                 correct the HTML or choose "no_summary" value for "summary_policy"
                 field"""
                 )
-                raise ValidationError(self.entity.eid, {"summary_policy": msg})
+                raise ValidationError(eid, {"summary_policy": msg})
             kwargs = {"summary": summary}
             if modified_content:
                 # anchors have been added to the content
@@ -35,6 +35,8 @@
 from cubicweb.predicates import is_instance
 from cubicweb.server import hook
 
+from cubicweb_frarchives_edition.hooks.authorities import suggest_index_buffer
+
 
 class CircularAttributesHook(hook.Hook):
     __regid__ = "francearchives.circular-attrs"
@@ -101,11 +103,10 @@ class CircularUpdateIndexSuggest(hook.Hook):
 
 
 class CircularUpdateIndexSuggestOperation(hook.DataOperationMixIn, hook.Operation):
-    def postcommit_event(self):
-        for eidto in self.get_data():
-            subject_authorities = self.cnx.execute(
-                "DISTINCT Any X WHERE X same_as C, C eid %(eid)s", {"eid": eidto}
-            ).entities()
-            self.cnx.vreg["services"].select("reindex-suggest", self.cnx).index_authorities(
-                subject_authorities
-            )
+    def precommit_event(self):
+        cnx = self.cnx
+        eids = [str(eid) for eid in self.get_data() if not cnx.deleted_in_transaction(eid)]
+        if not eids:
+            return
+        rset = cnx.execute("DISTINCT Any X WHERE X same_as C, C eid IN (%s)" % ", ".join(eids))
+        suggest_index_buffer(cnx).add(eid for eid, in rset)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © LOGILAB S.A. (Paris, FRANCE) 2016-2019
+# Contact http://www.logilab.fr -- mailto:contact@logilab.fr
+#
+# This software is governed by the CeCILL-C license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL-C
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systemsand/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL-C license and that you accept its terms.
+"""Dead links detection.
+
+External urls are read from the database (rich content of CMS entities,
+ExternRef, ExternalUri and Service websites) and checked concurrently, with a
+bounded number of requests per host. Check results are stored in the
+``dead_links_cache`` table so that only new or stale urls are checked again.
+"""
+import asyncio
+import datetime
+import logging
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from lxml import etree
+from psycopg2.extras import execute_values
+
+# number of urls checked at the same time
+LINKS_CONCURRENCY = 20
+
+# number of urls checked at the same time on a given host
+LINKS_HOST_CONCURRENCY = 2
+
+# minimal delay (in seconds) between two requests to the same host
+LINKS_HOST_DELAY = 0.5
+
+LINKS_TIMEOUT = 30
+
+# number of days a check result is kept
+LINKS_CACHE_TTL = 7
+
+# some servers do not implement HEAD requests
+HEAD_NOT_ALLOWED = (403, 405, 501)
+
+USER_AGENT = "FranceArchives link checker"
+
+DEAD_LINKS_HEADERS = ["url", "statut", "erreur", "eid", "type", "url de l'entité"]
+
+
+def urls_from_content(content):
+    """return urls of <a> and <img> tags of the `content` html"""
+    try:
+        tree = etree.HTML(content)
+    except Exception:
+        return []
+    if tree is None:
+        return []
+    urls = []
+    for el in tree.iter("a", "img"):
+        url = el.get("href") or el.get("src")
+        if url:
+            urls.append(url.strip())
+    return urls
+
+
+def is_external_url(url):
+    return urllib.parse.urlparse(url).scheme in ("http", "https")
+
+
+def rich_content_attributes(eschema):
+    return [
+        rschema.type
+        for rschema, _ in eschema.attribute_definitions()
+        if eschema.has_metadata(rschema.type, "format")
+    ]
+
+
+def iter_external_urls(cnx):
+    """yield (url, eid, etype) for each external url found in the database"""
+    # entity types having rich contents are the ones which may reference files
+    for eschema in cnx.vreg.schema["referenced_files"].subjects():
+        etype = eschema.type
+        for attr in rich_content_attributes(eschema):
+            rset = cnx.execute(f"Any X, C WHERE X is {etype}, X {attr} C, NOT X {attr} NULL")
+            for eid, content in rset:
+                for url in urls_from_content(content):
+                    yield url, eid, etype
+    for etype, attr in (
+        ("ExternRef", "url"),
+        ("ExternalUri", "uri"),
+        ("Service", "website_url"),
+    ):
+        rset = cnx.execute(f"Any X, U WHERE X is {etype}, X {attr} U, NOT X {attr} NULL")
+        for eid, url in rset:
+            yield url.strip(), eid, etype
+
+
+def collect_urls(cnx):
+    """return a {url: [(eid, etype)]} dict of external urls"""
+    urls = defaultdict(list)
+    for url, eid, etype in iter_external_urls(cnx):
+        if is_external_url(url):
+            urls[url].append((eid, etype))
+    return urls
+
+
+def cached_link_statuses(cnx, urls, ttl=LINKS_CACHE_TTL):
+    """return a {url: (status, error)} dict of `urls` checked less than `ttl` days ago"""
+    since = datetime.datetime.now() - datetime.timedelta(days=ttl)
+    cursor = cnx.system_sql(
+        """
+        SELECT url, status, error FROM dead_links_cache
+        WHERE url = ANY(%(urls)s) AND checked_at >= %(since)s
+        """,
+        {"urls": list(urls), "since": since},
+    )
+    return {url: (status, error) for url, status, error in cursor.fetchall()}
+
+
+def store_link_statuses(cnx, statuses):
+    """store `statuses`, a {url: (status, error)} dict, in the dead links cache"""
+    if not statuses:
+        return
+    now = datetime.datetime.now()
+    execute_values(
+        cnx.cnxset.cu,
+        """
+        INSERT INTO dead_links_cache (url, status, error, checked_at) VALUES %s
+        ON CONFLICT (url) DO UPDATE
+        SET status = EXCLUDED.status, error = EXCLUDED.error, checked_at = EXCLUDED.checked_at
+        """,
+        [(url, status, error, now) for url, (status, error) in statuses.items()],
+    )
+
+
+def is_dead(status, error):
+    return bool(error) or status is None or status >= 400
+
+
+class LinkChecker(object):
+    """Check urls concurrently.
+
+    At most `concurrency` requests are running at the same time, at most
+    `host_concurrency` of them on the same host, and two requests to the same
+    host are separated by at least `host_delay` seconds.
+    """
+
+    def __init__(
+        self,
+        concurrency=LINKS_CONCURRENCY,
+        host_concurrency=LINKS_HOST_CONCURRENCY,
+        host_delay=LINKS_HOST_DELAY,
+        timeout=LINKS_TIMEOUT,
+        log=None,
+    ):
+        self.concurrency = concurrency
+        self.host_concurrency = host_concurrency
+        self.host_delay = host_delay
+        self.timeout = timeout
+        self.log = log or logging.getLogger("rq.task")
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        # requests sessions are not meant to be shared between threads
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers["User-Agent"] = USER_AGENT
+        return session
+
+    def fetch_status(self, url):
+        """return the (status, error) of `url`"""
+        try:
+            response = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+            if response.status_code in HEAD_NOT_ALLOWED:
+                response = self.session.get(
+                    url, allow_redirects=True, timeout=self.timeout, stream=True
+                )
+                response.close()
+            return response.status_code, None
+        except requests.RequestException as exception:
+            return None, str(exception)
+
+    async def _check_url(self, url, executor, semaphore, hosts):
+        host = urllib.parse.urlparse(url).netloc
+        host_semaphore, host_lock, last_request = hosts[host]
+        # wait for a slot on the host before taking a global one, so that urls
+        # of a busy host do not hold global slots
+        async with host_semaphore, semaphore:
+            async with host_lock:
+                wait = last_request[0] + self.host_delay - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                last_request[0] = time.monotonic()
+            loop = asyncio.get_running_loop()
+            status, error = await loop.run_in_executor(executor, self.fetch_status, url)
+        if is_dead(status, error):
+            self.log.warning("dead link %s: %s", url, error or status)
+        return url, (status, error)
+
+    async def _check_urls(self, urls, progress):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        hosts = defaultdict(
+            lambda: (asyncio.Semaphore(self.host_concurrency), asyncio.Lock(), [0.0])
+        )
+        statuses = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            tasks = [self._check_url(url, executor, semaphore, hosts) for url in urls]
+            for idx, task in enumerate(asyncio.as_completed(tasks), 1):
+                url, status = await task
+                statuses[url] = status
+                if progress is not None:
+                    progress(idx, len(tasks))
+        return statuses
+
+    def check(self, urls, progress=None):
+        """return a {url: (status, error)} dict
+
+        :param list urls: urls to check
+        :param callable progress: called with (number of checked urls, number of urls)
+        """
+        urls = list(urls)
+        if not urls:
+            return {}
+        return asyncio.run(self._check_urls(urls, progress))
@@ -0,0 +1,131 @@
+# flake8: noqa
+# -*- coding: utf-8 -*-
+#
+# Copyright © LOGILAB S.A. (Paris, FRANCE) 2016-2019
+# Contact http://www.logilab.fr -- mailto:contact@logilab.fr
+#
+# This software is governed by the CeCILL-C license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL-C
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systemsand/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL-C license and that you accept its terms.
+#
+
+import logging
+
+logger = logging.getLogger("francearchives.migration")
+logger.setLevel(logging.INFO)
+
+logger.info("-> create rqtask_log_chunks table")
+
+sql(
+    """
+CREATE TABLE IF NOT EXISTS rqtask_log_chunks (
+    task_eid integer NOT NULL,
+    chunk integer NOT NULL,
+    nb_records integer NOT NULL,
+    nb_warnings integer NOT NULL,
+    nb_errors integer NOT NULL,
+    data bytea NOT NULL,
+    PRIMARY KEY (task_eid, chunk)
+)
+"""
+)
+
+logger.info("-> create dead_links_cache table")
+
+sql(
+    """
+CREATE TABLE IF NOT EXISTS dead_links_cache (
+    url text PRIMARY KEY,
+    status integer,
+    error text,
+    checked_at timestamp NOT NULL
+)
+"""
+)
+
+logger.info("-> create kibana_authority_queue table")
+
+sql(
+    """
+CREATE TABLE IF NOT EXISTS kibana_authority_queue (
+    eid integer PRIMARY KEY,
+    queued_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+)
+
+logger.info("-> create subject_image_derivatives table")
+
+sql(
+    """
+CREATE TABLE IF NOT EXISTS subject_image_derivatives (
+    source_hash varchar(256) NOT NULL,
+    width integer NOT NULL,
+    height integer NOT NULL,
+    data_hash varchar(256) NOT NULL,
+    path varchar(256),
+    PRIMARY KEY (source_hash, width, height)
+)
+"""
+)
+
+logger.info("-> create agent_info_queue table")
+
+sql(
+    """
+CREATE TABLE IF NOT EXISTS agent_info_queue (
+    eid integer PRIMARY KEY,
+    queued_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    attempts integer NOT NULL DEFAULT 0,
+    next_attempt timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error text
+)
+"""
+)
+
+logger.info("-> create authority removal checkpoint tables")
+
+sql(
+    """
+CREATE TABLE IF NOT EXISTS removed_authorities (
+    task integer NOT NULL,
+    authority integer NOT NULL,
+    etype varchar(64) NOT NULL,
+    PRIMARY KEY (task, authority)
+)
+"""
+)
+
+sql(
+    """
+CREATE TABLE IF NOT EXISTS removed_authorities_documents (
+    task integer NOT NULL,
+    document integer NOT NULL,
+    authority integer NOT NULL,
+    PRIMARY KEY (task, document, authority)
+)
+"""
+)
+
+cnx.commit()
@@ -77,6 +77,87 @@ CREATE INDEX sameas_history_action_idx ON sameas_history(action);
 """
 cnx.system_sql(indexes)
 
+cnx.system_sql(
+    """
+CREATE TABLE rqtask_log_chunks (
+    task_eid integer NOT NULL,
+    chunk integer NOT NULL,
+    nb_records integer NOT NULL,
+    nb_warnings integer NOT NULL,
+    nb_errors integer NOT NULL,
+    data bytea NOT NULL,
+    PRIMARY KEY (task_eid, chunk)
+)
+"""
+)
+
+cnx.system_sql(
+    """
+CREATE TABLE dead_links_cache (
+    url text PRIMARY KEY,
+    status integer,
+    error text,
+    checked_at timestamp NOT NULL
+)
+"""
+)
+
+cnx.system_sql(
+    """
+CREATE TABLE kibana_authority_queue (
+    eid integer PRIMARY KEY,
+    queued_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+)
+
+cnx.system_sql(
+    """
+CREATE TABLE subject_image_derivatives (
+    source_hash varchar(256) NOT NULL,
+    width integer NOT NULL,
+    height integer NOT NULL,
+    data_hash varchar(256) NOT NULL,
+    path varchar(256),
+    PRIMARY KEY (source_hash, width, height)
+)
+"""
+)
+
+cnx.system_sql(
+    """
+CREATE TABLE agent_info_queue (
+    eid integer PRIMARY KEY,
+    queued_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    attempts integer NOT NULL DEFAULT 0,
+    next_attempt timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error text
+)
+"""
+)
+
+cnx.system_sql(
+    """
+CREATE TABLE removed_authorities (
+    task integer NOT NULL,
+    authority integer NOT NULL,
+    etype varchar(64) NOT NULL,
+    PRIMARY KEY (task, authority)
+)
+"""
+)
+
+cnx.system_sql(
+    """
+CREATE TABLE removed_authorities_documents (
+    task integer NOT NULL,
+    document integer NOT NULL,
+    authority integer NOT NULL,
+    PRIMARY KEY (task, document, authority)
+)
+"""
+)
+
 # this table is created here only for test purposes
 # otherwise it is done by cubicweb-ctl setup-geonames <instance> commande
 cnx.system_sql(
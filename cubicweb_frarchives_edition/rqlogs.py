@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © LOGILAB S.A. (Paris, FRANCE) 2016-2019
+# Contact http://www.logilab.fr -- mailto:contact@logilab.fr
+#
+# This software is governed by the CeCILL-C license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL-C
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systemsand/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL-C license and that you accept its terms.
+"""Paged storage of RqTask logs.
+
+Logs are split into records (a record starts with a severity and spans all
+following continuation lines, e.g. tracebacks). Records are grouped by chunks
+of ``LOG_CHUNK_SIZE``, compressed and stored in the ``rqtask_log_chunks``
+table along with per-severity counters so that a page of records, optionally
+restricted to warnings or errors, can be fetched without reading the whole
+log.
+"""
+import json
+import logging
+import zlib
+
+
+LOG_CHUNK_SIZE = 2000
+
+LOG_PAGE_SIZE = 1000
+
+# size of the tail of a running task log fetched from redis
+LOG_TAIL_SIZE = 1024 * 1024
+
+SEVERITY_LVL = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "FATAL": logging.FATAL,
+    "CRITICAL": logging.CRITICAL,
+}
+
+# minimal level filter -> rqtask_log_chunks counter column
+LEVEL_FILTERS = {
+    None: "nb_records",
+    "WARNING": "nb_warnings",
+    "ERROR": "nb_errors",
+}
+
+
+def parse_log_line(line):
+    """Return a [severity, date, time, message] list if `line` starts a log
+    record, None if it is a continuation line."""
+    try:
+        severity, date, time, info = line.split(None, 3)
+    except ValueError:
+        return None
+    if severity not in SEVERITY_LVL:
+        return None
+    try:
+        hour, time = time.split(",")
+        date = "{} {}".format(date, hour)
+    except Exception:
+        pass
+    return [severity, date, time, info]
+
+
+def iter_log_records(lines):
+    """Yield [severity, date, time, message] lists from log `lines`.
+
+    Continuation lines are appended to the message of the previous record.
+    """
+    current = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = parse_log_line(line)
+        if record is None:
+            if current is not None:
+                current[-1] += "\n" + line
+            else:
+                current = [logging.INFO, "", "", line]
+            continue
+        if current is not None:
+            yield current
+        current = record
+    if current is not None:
+        yield current
+
+
+def record_level(record):
+    return SEVERITY_LVL.get(record[0], logging.INFO)
+
+
+def filter_records(records, level=None):
+    if level is None:
+        return records
+    minlevel = SEVERITY_LVL[level]
+    return [record for record in records if record_level(record) >= minlevel]
+
+
+def iter_log_chunks(records, chunk_size=LOG_CHUNK_SIZE):
+    """Group `records` by `chunk_size` and yield rqtask_log_chunks rows (without
+    the task eid nor the chunk index)."""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield _chunk_row(chunk)
+            chunk = []
+    if chunk:
+        yield _chunk_row(chunk)
+
+
+def _chunk_row(records):
+    levels = [record_level(record) for record in records]
+    return {
+        "nb_records": len(records),
+        "nb_warnings": len([lvl for lvl in levels if lvl >= logging.WARNING]),
+        "nb_errors": len([lvl for lvl in levels if lvl >= logging.ERROR]),
+        "data": zlib.compress(json.dumps(records).encode("utf-8")),
+    }
+
+
+def store_task_log(cnx, task_eid, lines, chunk_size=LOG_CHUNK_SIZE):
+    """Replace the stored log chunks of RqTask `task_eid` by the ones built
+    from `lines`. Return the number of stored chunks."""
+    cnx.system_sql("DELETE FROM rqtask_log_chunks WHERE task_eid=%(e)s", {"e": task_eid})
+    nb_chunks = 0
+    for idx, row in enumerate(iter_log_chunks(iter_log_records(lines), chunk_size)):
+        row.update({"e": task_eid, "chunk": idx})
+        cnx.system_sql(
+            """INSERT INTO rqtask_log_chunks
+               (task_eid, chunk, nb_records, nb_warnings, nb_errors, data)
+               VALUES (%(e)s, %(chunk)s, %(nb_records)s, %(nb_warnings)s,
+                       %(nb_errors)s, %(data)s)""",
+            row,
+        )
+        nb_chunks += 1
+    return nb_chunks
+
+
+def task_log_page(cnx, task_eid, offset=0, limit=LOG_PAGE_SIZE, level=None):
+    """Return a (total, records) tuple where `records` are the log records of
+    RqTask `task_eid` in [offset, offset + limit[ once filtered on `level`
+    and `total` is the number of records matching `level`.
+
+    Return None if no log chunk has been stored for this task.
+    """
+    column = LEVEL_FILTERS[level]
+    total, nb_chunks = cnx.system_sql(
+        f"SELECT SUM({column}), COUNT(*) FROM rqtask_log_chunks WHERE task_eid=%(e)s",
+        {"e": task_eid},
+    ).fetchone()
+    if not nb_chunks:
+        return None
+    # only fetch (and uncompress) the chunks overlapping the requested page
+    rows = cnx.system_sql(
+        f"""SELECT bounds.chunk_start, c.data FROM (
+              SELECT chunk, {column} AS nb,
+                     SUM({column}) OVER (ORDER BY chunk) - {column} AS chunk_start
+              FROM rqtask_log_chunks WHERE task_eid=%(e)s
+            ) AS bounds
+            JOIN rqtask_log_chunks AS c ON c.task_eid=%(e)s AND c.chunk=bounds.chunk
+            WHERE bounds.nb > 0
+              AND bounds.chunk_start + bounds.nb > %(start)s
+              AND bounds.chunk_start < %(stop)s
+            ORDER BY bounds.chunk""",
+        {"e": task_eid, "start": offset, "stop": offset + limit},
+    ).fetchall()
+    records = []
+    for chunk_start, data in rows:
+        chunk_records = filter_records(json.loads(zlib.decompress(data)), level)
+        # SUM() returns numeric values with postgresql
+        start = max(offset - int(chunk_start), 0)
+        records.extend(chunk_records[start : start + limit - len(records)])
+    return int(total), records
+
+
+def page_records(lines, offset=0, limit=LOG_PAGE_SIZE, level=None):
+    """Build a (total, records) page from raw log `lines`; used for logs
+    which are not stored as chunks (running tasks, legacy tasks)."""
+    records = filter_records(list(iter_log_records(lines)), level)
+    return len(records), records[offset : offset + limit]
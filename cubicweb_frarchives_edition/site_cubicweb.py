@@ -85,42 +85,63 @@ options = (
         },
     ),
     (
-        "linkchecker-output",
+        "linkchecker-cache-ttl",
         {
-            "type": "string",
-            "default": "/tmp/linkchecker.out",
-            "help": "linkchecker output file name",
+            "type": "int",
+            "default": 7,
+            "help": "number of days before a checked link is checked again",
             "group": "linkchecker",
             "level": 2,
         },
     ),
     (
-        "linkchecker-config",
+        "linkchecker-concurrency",
         {
-            "type": "string",
-            "default": "",
-            "help": "linkchecker configuration file",
+            "type": "int",
+            "default": 20,
+            "help": "maximum number of links checked at the same time",
+            "group": "linkchecker",
+            "level": 2,
+        },
+    ),
+    (
+        "linkchecker-host-concurrency",
+        {
+            "type": "int",
+            "default": 2,
+            "help": "maximum number of links checked at the same time on a given host",
             "group": "linkchecker",
             "level": 2,
         },
     ),
     (
-        "dead-links-output",
+        "sparql-cache-dir",
         {
             "type": "string",
             "default": "",
-            "help": "dead links output directory",
-            "group": "linkchecker",
+            "help": "directory where data.bnf.fr and Wikidata responses are cached "
+            "(no cache if empty)",
+            "group": "alignment",
             "level": 2,
         },
     ),
     (
-        "linkchecker-maxmem",
+        "sparql-cache-ttl",
         {
             "type": "int",
-            "default": (1024**3) * 4,
-            "help": "linkchecker memory consumption limit (in bytes)",
-            "group": "linkchecker",
+            "default": 30,
+            "help": "number of days before a cached SPARQL response is fetched again",
+            "group": "alignment",
+            "level": 2,
+        },
+    ),
+    (
+        "sparql-cache-negative-ttl",
+        {
+            "type": "int",
+            "default": 1,
+            "help": "number of days before an empty cached SPARQL response is fetched again",
+            "group": "alignment",
             "level": 2,
         },
     ),
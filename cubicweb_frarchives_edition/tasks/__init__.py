@@ -44,7 +44,9 @@ from .group_authorities import group_location_authorities  # noqa
 from .import_authorities import import_authorities  # noqa
 from .delete_findingaids import delete_findingaids  # noqa
 from .run_dead_links import run_dead_links  # noqa
-from .index_kibana import index_kibana  # noqa
+from .index_kibana import index_kibana, index_kibana_authority_queue  # noqa
 from .qualify_authorities import import_qualified_authorities  # noqa
 from .remove_authorities import remove_authorities  # noqa
 from .delete_nomina import delete_nomina_by_service  # noqa
+from .subject_images import resize_subject_images  # noqa
+from .agent_infos import refresh_agent_infos  # noqa
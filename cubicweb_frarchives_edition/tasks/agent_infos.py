@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © LOGILAB S.A. (Paris, FRANCE) 2016-2019
+# Contact http://www.logilab.fr -- mailto:contact@logilab.fr
+#
+# This software is governed by the CeCILL-C license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL-C
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systemsand/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL-C license and that you accept its terms.
+
+
+# standard library imports
+import logging
+from collections import defaultdict
+
+# library specific imports
+from cubicweb_frarchives_edition.alignments import (
+    sparql_cache_options,
+    DATABNF_SOURCE,
+    WIKIDATA_SOURCE,
+)
+from cubicweb_frarchives_edition.alignments.databnf import DataBnfDatabase
+from cubicweb_frarchives_edition.alignments.wikidata import WikidataDatabase
+from cubicweb_frarchives_edition.rq import rqjob
+
+AGENT_INFO_ALIGNERS = {DATABNF_SOURCE: DataBnfDatabase, WIKIDATA_SOURCE: WikidataDatabase}
+
+AGENT_INFO_QUEUE_CHUNKSIZE = 200
+# a failed ExternalUri is retried after 5 min, 10 min, 20 min, etc.
+AGENT_INFO_RETRY_DELAY = 300
+AGENT_INFO_MAX_ATTEMPTS = 6
+
+
+def update_agent_infos(cnx, exturis, infos):
+    """replace AgentInfo of `exturis`, a list of (eid, extid, label) tuples, by
+    `infos`, a {extid: agent infos} dict
+
+    ExternalUri without agent infos are left untouched.
+    """
+    exturis = [(eid, extid, label) for eid, extid, label in exturis if infos.get(extid)]
+    if not exturis:
+        return
+    cnx.execute(
+        "DELETE AgentInfo X WHERE X agent_info_of U, U eid IN ({})".format(
+            ", ".join(str(eid) for eid, _, _ in exturis)
+        )
+    )
+    for eid, extid, old_label in exturis:
+        data = dict(infos[extid])
+        label = data.pop("label", None)
+        # add ExternalUri label
+        if label and label != old_label:
+            cnx.execute("SET X label %(label)s WHERE X eid %(eid)s", {"label": label, "eid": eid})
+        data["agent_info_of"] = eid
+        cnx.create_entity("AgentInfo", **data)
+
+
+def refresh_agent_info_queue(
+    cnx,
+    log,
+    chunksize=AGENT_INFO_QUEUE_CHUNKSIZE,
+    retry_delay=AGENT_INFO_RETRY_DELAY,
+    max_attempts=AGENT_INFO_MAX_ATTEMPTS,
+):
+    """retrieve AgentInfo of ExternalUri recorded in the `agent_info_queue` table
+    and return the number of refreshed and failed ExternalUri
+
+    ExternalUri of each source are queried by batches. When a batch fails, its
+    ExternalUri are retried later with an exponential backoff and dropped from the
+    queue after `max_attempts` attempts. An ExternalUri queued again while being
+    processed is kept in the queue.
+    """
+    (start,) = cnx.system_sql("SELECT LOCALTIMESTAMP").fetchone()
+    aligner_options = sparql_cache_options(cnx.vreg.config)
+    refreshed = failed = 0
+    while True:
+        rows = cnx.system_sql(
+            """SELECT eid, queued_at FROM agent_info_queue WHERE next_attempt <= %(start)s
+               ORDER BY next_attempt, eid LIMIT %(limit)s""",
+            {"start": start, "limit": chunksize},
+        ).fetchall()
+        if not rows:
+            break
+        eids = [eid for eid, _ in rows]
+        queued_at = max(queued_at for _, queued_at in rows)
+        exturis = defaultdict(list)
+        rset = cnx.execute(
+            """Any X, S, E, L WHERE X is ExternalUri, X eid IN ({}),
+               X source S, X extid E, X label L""".format(
+                ", ".join(str(eid) for eid in eids)
+            )
+        )
+        for eid, source, extid, label in rset:
+            if source in AGENT_INFO_ALIGNERS and extid:
+                exturis[source].append((eid, extid, label))
+        errors = {}
+        for source, source_exturis in exturis.items():
+            aligner = AGENT_INFO_ALIGNERS[source](raise_errors=True, **aligner_options)
+            try:
+                infos = aligner.agent_infos_many([extid for _, extid, _ in source_exturis])
+            except Exception as exc:
+                log.warning("could not retrieve data from %s: %s", source, exc)
+                errors[source] = ([eid for eid, _, _ in source_exturis], str(exc))
+                continue
+            update_agent_infos(cnx, source_exturis, infos)
+        failed_eids = [eid for source_eids, _ in errors.values() for eid in source_eids]
+        for source_eids, error in errors.values():
+            cnx.system_sql(
+                """UPDATE agent_info_queue
+                   SET attempts=attempts + 1, last_error=%(error)s,
+                       next_attempt=LOCALTIMESTAMP
+                           + make_interval(secs => %(delay)s * power(2, attempts))
+                   WHERE eid = ANY(%(eids)s) AND queued_at <= %(queued_at)s""",
+                {"eids": source_eids, "error": error, "delay": retry_delay, "queued_at": queued_at},
+            )
+        dropped = cnx.system_sql(
+            """DELETE FROM agent_info_queue WHERE eid = ANY(%(eids)s) AND attempts >= %(max)s
+               RETURNING eid""",
+            {"eids": failed_eids, "max": max_attempts},
+        ).fetchall()
+        if dropped:
+            log.error(
+                "giving up retrieving data of ExternalUri %s",
+                ", ".join(str(eid) for eid, in dropped),
+            )
+        cnx.system_sql(
+            """DELETE FROM agent_info_queue
+               WHERE eid = ANY(%(eids)s) AND queued_at <= %(queued_at)s""",
+            {"eids": list(set(eids).difference(failed_eids)), "queued_at": queued_at},
+        )
+        cnx.commit()
+        failed += len(failed_eids)
+        refreshed += len(eids) - len(failed_eids)
+    return refreshed, failed
+
+
+@rqjob
+def refresh_agent_infos(cnx):
+    """retrieve AgentInfo of ExternalUri recorded in the `agent_info_queue` table"""
+    log = logging.getLogger("rq.task")
+    refreshed, failed = refresh_agent_info_queue(cnx, log)
+    log.info("refreshed {} queued ExternalUri, {} failed".format(refreshed, failed))
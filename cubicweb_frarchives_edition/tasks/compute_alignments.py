@@ -30,10 +30,9 @@
 
 # standard library imports
 from datetime import datetime
+from itertools import chain
 import logging
 
-from uuid import uuid4
-
 # third party imports
 import rq
 
@@ -41,9 +40,9 @@ import rq
 # library specific imports
 from cubicweb_frarchives_edition.rq import rqjob, update_progress
 from cubicweb_frarchives_edition.tasks.utils import (
+    OutputFile,
     serve_csv,
     serve_zip,
-    write_binary_csv,
     write_csv,
     zip_files,
 )
@@ -79,28 +78,23 @@ def _get_findingaids(cnx, findingaids):
     return eids
 
 
-def _get_temp_csv_output_file(cnx, rows, title):
+def _get_temp_csv_output_file(cnx, rows, title, headers=()):
     """Create temporary CSV output file.
 
     :param Connection cnx: CubicWeb database connection
     :param rows: rows
     :param str title: title
+    :param tuple headers: column headers
 
     :returns: output_file and filename
     :rtype: tuple
     """
     # create temporary file
-    filename = write_csv(rows, delimiter="\t")
+    filename = write_csv(rows, headers=headers, delimiter="\t")
     # create output file (needed for automatically importing alignments)
-    output_file = cnx.create_entity(
-        "File",
-        data=write_binary_csv(rows, delimiter="\t"),
-        data_format="text/csv",
-        data_name=title,
-        title=title,
-        uuid=str(uuid4().hex),
-    )
-    return output_file, filename
+    with OutputFile(cnx, title, "text/csv") as output:
+        output.copyfile(filename)
+    return output.entity, filename
 
 
 def update_rqtask(cnx, rows, target, auto_import=False, simplified=False, file_size=0):
@@ -134,9 +128,8 @@ def update_rqtask(cnx, rows, target, auto_import=False, simplified=False, file_s
     # output file is CSV file
     date = datetime.now().strftime("%Y%m%d")
     if not file_size or len(rows) < file_size:
-        rows.insert(0, headers)
         output_file = serve_csv(
-            cnx, eid, f"alignment-{target}-{date}-{eid}.csv", rows, delimiter="\t"
+            cnx, eid, f"alignment-{target}-{date}-{eid}.csv", chain([headers], rows), delimiter="\t"
         )
         if auto_import:
             rqtask.cw_set(subtasks=auto_run_import(cnx, rqtask, aligner_cls, output_file))
@@ -146,8 +139,7 @@ def update_rqtask(cnx, rows, target, auto_import=False, simplified=False, file_s
         temp_files = []
         for i, chunk in enumerate(split_up(rows, file_size - 1), 1):
             title = f"alignment-{target}-{date}-{str(i).zfill(2)}.csv"
-            chunk.insert(0, headers)
-            temp_csv, file_name = _get_temp_csv_output_file(cnx, chunk, title)
+            temp_csv, file_name = _get_temp_csv_output_file(cnx, chunk, title, headers=headers)
             temp_files.append((temp_csv, file_name, title))
         serve_zip(
             cnx,
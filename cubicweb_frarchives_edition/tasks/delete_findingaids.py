@@ -33,15 +33,19 @@ import csv
 import logging
 
 # third party imports
+import rq
 from elasticsearch.exceptions import ConnectionError, NotFoundError
 from urllib3.exceptions import ProtocolError
 
 # CubicWeb specific imports
 # library specific imports
-from cubicweb_francearchives.dataimport.sqlutil import delete_from_filename
+from cubicweb_francearchives.dataimport.sqlutil import delete_from_filenames
 from cubicweb_francearchives.storage import S3BfssStorageMixIn
 
-from cubicweb_frarchives_edition.rq import rqjob
+from cubicweb_frarchives_edition.rq import rqjob, update_progress
+
+# number of FindingAids deleted in one transaction
+DELETE_FINDINGAIDS_BATCHSIZE = 100
 
 
 def log_results(log, deleted, ids, not_found, forbidden):
@@ -61,12 +65,65 @@ def log_results(log, deleted, ids, not_found, forbidden):
         )
 
 
+def describe(irid, stable_id, filename):
+    return "csv_id: {}, stable id: {}, filename: {})".format(irid, stable_id, filename or "")
+
+
+def resolve_findingaids(cnx, ids):
+    """find FindingAids of `ids` stable ids or eadids with one query
+
+    :returns: a list of (csv id, FindingAid, stable_id, filename) and the list of ids not found
+    """
+    if not ids:
+        return [], []
+    args = {f"i{idx}": irid for idx, irid in enumerate(ids)}
+    values = ", ".join(f"%({key})s" for key in args)
+    rset = cnx.execute(
+        f"""Any X, S, E, N ORDERBY S WHERE X is FindingAid, X stable_id S, X eadid E,
+            X findingaid_support FS?, FS data_name N,
+            X stable_id IN ({values}) OR X eadid IN ({values})""",
+        args,
+    )
+    known = set(ids)
+    found = set()
+    findingaids = []
+    for entity, stable_id, eadid, filename in rset.iter_rows_with_entities():
+        irid = stable_id if stable_id in known else eadid
+        found.add(irid)
+        findingaids.append((irid, entity, stable_id, filename))
+    return findingaids, [irid for irid in ids if irid not in found]
+
+
+def delete_batch(cnx, batch):
+    """delete FindingAids of `batch` in one transaction"""
+    delete_from_filenames(
+        cnx,
+        [stable_id for _, _, stable_id, _ in batch],
+        is_filename=False,
+        interactive=False,
+        esonly=False,
+    )
+    # no commit here because it is already done in sqlutil.delete_from_filenames
+
+
+def sync_batch(cnx, batch):
+    """sync the deletion of FindingAids of `batch` at once"""
+    cnx.vreg["services"].select("sync", cnx).sync([("delete", entity) for _, entity, _, _ in batch])
+
+
 @rqjob
-def delete_findingaids(cnx, filepath):
+def delete_findingaids(cnx, filepath, batchsize=DELETE_FINDINGAIDS_BATCHSIZE):
     """Delete FindingAids.
 
+    FindingAids are deleted by batches of `batchsize`, each batch in its own
+    transaction. A failed batch does not prevent next ones to be processed, but
+    the job fails once all batches have been processed. The deleted batches are
+    recorded in the meta data of the job, so that requeuing the failed job
+    (e.g. with `rq requeue`) resumes the deletion.
+
     :param Connection cnx: CubicWeb database connection
     :param filepath: filename of a temporary csv file with 1 column: stable_id_or_eadid
+    :param int batchsize: number of FindingAids deleted in one transaction
     """
     log = logging.getLogger("rq.task")
     st = S3BfssStorageMixIn(log=log)
@@ -82,44 +139,64 @@ def delete_findingaids(cnx, filepath):
     # drop header
     ids = ids[1:]
     log.info(f'found {len(ids)} identifiers to delete from "{filepath}"')
-    not_found = []
-    deleted = []
+    job = rq.get_current_job()
+    # FindingAids deleted by a previous run of the job
+    deleted = job.meta.setdefault("deleted_findingaids", [])
+    if deleted:
+        log.info(f"resume deletion: {len(deleted)} FindingAids have already been deleted")
+    done = {irid for irid, _ in deleted}
+    findingaids, not_found = resolve_findingaids(cnx, [irid for irid in ids if irid not in done])
+    deleted = [description for _, description in deleted]
     forbidden = []
-    for irid in ids:
-        rset = cnx.execute(
-            """Any X, S, N WHERE X is FindingAid, X stable_id S,
-               X findingaid_support FS?, FS data_name N,
-               X stable_id %(id)s OR X eadid %(id)s""",
-            {"id": irid},
-        )
-        if not rset:
-            not_found.append(irid)
+    eschema = cnx.vreg.schema.eschema("FindingAid")
+    # permissions only depend on groups unless rql expressions or owners are involved
+    granted = eschema.has_perm(cnx, "delete")
+    removable = []
+    for irid, entity, stable_id, filename in findingaids:
+        if granted or entity.cw_has_perm("delete"):
+            removable.append((irid, entity, stable_id, filename))
+        else:
+            forbidden.append(describe(irid, stable_id, filename))
+    failed = 0
+    unsynced = []
+    update_progress(job, 0.0)
+    for idx in range(0, len(removable), batchsize):
+        batch = removable[idx : idx + batchsize]
+        urls = ", ".join(entity.absolute_url() for _, entity, _, _ in batch)
+        try:
+            delete_batch(cnx, batch)
+        except (ConnectionError, ProtocolError, NotFoundError) as err:
+            log.error("elasticsearch indexation failed for FindingAids %s: %s", urls, err)
+        except Exception as err:
+            cnx.rollback()
+            failed += len(batch)
+            log.error("unable to delete FindingAids %s: %s", urls, err)
             continue
-        for entity, stable_id, filename in rset.iter_rows_with_entities():
-            if not entity.cw_has_perm("delete"):
-                forbidden.append(
-                    "csv_id: {}, stable id: {}, filename: {})".format(
-                        irid, stable_id, filename or ""
-                    )
-                )
-            try:
-                delete_from_filename(
-                    cnx, stable_id, is_filename=False, interactive=False, esonly=False
-                )
-                # no commit here because it is already done in sqlutil.delete_from_filename
-                cnx.vreg["services"].select("sync", cnx).sync([("delete", entity)])
-            except (ConnectionError, ProtocolError, NotFoundError):
-                log.error(
-                    "elasticsearch indexation failed for FindingAid %s", entity.absolute_url()
-                )
-            except Exception:
-                log.error("unable to delete FindingAid %s ", entity.absolute_url())
-                log.error("abort deletion")
-                log_results(log, deleted, ids, not_found, forbidden)
-                return
-            deleted.append(
-                "csv_id: {}, stable id: {}, filename: {})".format(irid, stable_id, filename or "")
-            )
+        # the deletion is committed: the batch must not be processed again
+        descriptions = [
+            (irid, describe(irid, stable_id, filename)) for irid, _, stable_id, filename in batch
+        ]
+        job.meta["deleted_findingaids"].extend(descriptions)
+        deleted.extend(description for _, description in descriptions)
+        update_progress(job, (idx + len(batch)) / len(removable))
+        try:
+            sync_batch(cnx, batch)
+        except (ConnectionError, ProtocolError, NotFoundError) as err:
+            log.error("elasticsearch indexation failed for FindingAids %s: %s", urls, err)
+        except Exception as err:
+            cnx.rollback()
+            unsynced.extend(description for _, description in descriptions)
+            log.error("unable to sync the deletion of FindingAids %s: %s", urls, err)
     log_results(log, deleted, ids, not_found, forbidden)
+    if unsynced:
+        log.error(
+            "%d FindingAids have been deleted but their deletion could not be synced: %s",
+            len(unsynced),
+            "; ".join(unsynced),
+        )
+    if failed:
+        log.error("failed to delete %d FindingAids, requeue the job to retry", failed)
+        # keep the job meta data and the temporary file to resume the deletion
+        raise Exception(f"failed to delete {failed} FindingAids")
     # delete the temporary file
     st.storage_delete_file(filepath)
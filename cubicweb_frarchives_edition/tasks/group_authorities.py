@@ -43,10 +43,11 @@ from cubicweb_francearchives.storage import S3BfssStorageMixIn
 
 from cubicweb_frarchives_edition import CANDIDATE_SEP
 
-from cubicweb_frarchives_edition import update_suggest_es
 from cubicweb_frarchives_edition.rq import update_progress, rqjob
 from cubicweb_frarchives_edition.alignments.group_locations import (
     compute_location_authorities_to_group as compute_candidates,
+    group_authorities,
+    reindex_grouped_authorities,
 )
 
 LOGGER = logging.getLogger(__name__)
@@ -103,7 +104,7 @@ def write_and_save_candidates(cnx, candidates, rqtask):
     return add_file_to_rtqsk(cnx, rqtask, b, filename, uuid)
 
 
-def get_locationautorithy(cnx, column):
+def get_locationautorithy_eid(column):
     """each column may contain :
     - authority's label and url separated by '###' (CANDIDATE_SEP)
     - the authority's url
@@ -115,10 +116,19 @@ def get_locationautorithy(cnx, column):
     else:
         uri = column
     eid = uri.split("/")[-1].strip()
-    try:
-        return cnx.entity_from_eid(eid)
-    except Exception:
-        return None
+    return int(eid) if eid.isdigit() else None
+
+
+def existing_eids(cnx, eids):
+    """return the subset of `eids` which exist in the database, with one query"""
+    if not eids:
+        return set()
+    return {
+        eid
+        for eid, in cnx.system_sql(
+            "SELECT eid FROM entities WHERE eid = ANY(%(eids)s)", {"eids": list(eids)}
+        ).fetchall()
+    }
 
 
 def get_log_info(cnx, column):
@@ -128,67 +138,88 @@ def get_log_info(cnx, column):
     return column
 
 
+def read_groups(cnx, csvpath, log):
+    """read groups to process from `csvpath`
+
+    :returns: list of (target eid, source eids, row) and list of invalid rows
+    """
+    st = S3BfssStorageMixIn(log=log)
+    failed = []
+    rows = []
+    with st.storage_read_file(csvpath) as f:
+        for idx, row in enumerate(csv.reader(f, delimiter="\t"), 1):
+            if not row:
+                log.info("skip an empty row %s", idx)
+                continue
+            # remove empty columns
+            row = [col for col in row if col.strip()]
+            if len(row) < 2:
+                log.warning(
+                    "skip the row %s: this row only contains one column"
+                    " (make sure colums are separated by a tabulation)",
+                    idx,
+                )
+                failed.append(row)
+                # there is no authority sources to group this the target
+                continue
+            rows.append((idx, row, [get_locationautorithy_eid(col) for col in row]))
+    existing = existing_eids(cnx, {eid for _, _, eids in rows for eid in eids if eid is not None})
+    groups = []
+    for idx, row, eids in rows:
+        if not all(eid in existing for eid in eids):
+            log.warning(
+                "skip the row %s: one of columns contains an invalid authority url or eid",
+                idx,
+            )
+            failed.append(row)
+            continue
+        log_info = [get_log_info(cnx, r) for r in row]
+        log.info("target: {}, sources: {}".format(log_info[0], "; ".join(log_info[1:])))
+        groups.append((eids[0], eids[1:], row))
+    return groups, failed
+
+
+def log_already_grouped(cnx, groups, log):
+    """log sources already grouped with their target"""
+    targets = {}
+    for target, sources, row in groups:
+        for source, column in zip(sources, row[1:]):
+            targets[source] = (target, column, row[0])
+    if not targets:
+        return
+    for source, target in cnx.system_sql(
+        "SELECT eid_from, eid_to FROM grouped_with_relation WHERE eid_from = ANY(%(eids)s)",
+        {"eids": list(targets)},
+    ).fetchall():
+        if targets[source][0] == target:
+            log.info("%s is already grouped with %s", *targets[source][1:])
+
+
 def group_location_authorities_candidates(cnx, csvpath, log=None):
     if log is None:
         log = LOGGER
     job = rq.get_current_job()
     rqtask = cnx.entity_from_eid(int(job.id))
-    failed = []
-    current_progress = update_progress(job, 0.0)
-    st = S3BfssStorageMixIn(log=log)
+    update_progress(job, 0.0)
+    groups, failed = read_groups(cnx, csvpath, log)
+    log_already_grouped(cnx, groups, log)
     with cnx.allow_all_hooks_but(
         "reindex-suggest-es",
     ):
-        with st.storage_read_file(csvpath) as f:
-            reader = list(csv.reader(f, delimiter="\t"))
-            progress_step = 1.0 / (len(reader) + 1)
-            for idx, row in enumerate(reader, 1):
-                log.info("processing row %s", idx)
-                if not row:
-                    log.info("skip an empty row %s", idx)
-                    continue
-                # remove empty columns
-                row = [col for col in row if col.strip()]
-                if len(row) < 2:
-                    log.warning(
-                        "skip the row %s: this row only contains one column"
-                        " (make sure colums are separated by a tabulation)",
-                        idx,
-                    )
-                    failed.append(row)
-                    # there is no authority sources to group this the target
-                    continue
-                entities = [get_locationautorithy(cnx, col) for col in row]
-                if not all(entities):
-                    log.warning(
-                        "skip the row %s: one of columns "
-                        "contains an invalid authority url or eid",
-                        idx,
-                    )
-                    failed.append(row)
-                    continue
-                log_info = [get_log_info(cnx, r) for r in row]
-                log.info("target: {}, sources: {}".format(log_info[0], "; ".join(log_info[1:])))
-                target = entities[0]
-                sources = entities[1:]
-                for eidx, e in enumerate(sources, 1):
-                    grouped = e.grouped_with
-                    if grouped and grouped[0].eid == target.eid:
-                        log.info("%s is already grouped with %s", row[eidx], row[0])
-                try:
-                    target.group([s.eid for s in sources])
-                    cnx.commit()
-                except Exception as ex:
-                    log.exception("could not group authorities of row %s: %s", idx, ex)
-                    failed.append(row)
-                    continue
-                update_suggest_es(cnx, entities)
-                current_progress = update_progress(job, current_progress + progress_step)
+        grouped, failed_groups = group_authorities(
+            cnx,
+            groups,
+            log,
+            progress=lambda count: update_progress(job, count / (len(groups) + 1)),
+        )
+    failed.extend(row for _, _, row in failed_groups)
+    reindex_grouped_authorities(cnx, grouped, log)
+    update_progress(job, 1.0)
     if failed:
         log.warning("%s records could not be grouped", len(failed))
         write_and_save_failed_candidates(cnx, failed, rqtask)
     # delete the temporary file
-    st.storage_delete_file(csvpath)
+    S3BfssStorageMixIn(log=log).storage_delete_file(csvpath)
 
 
 def write_and_save_failed_candidates(cnx, failed, rqtask):
@@ -32,6 +32,7 @@ from cubicweb_francearchives.dataimport import dc
 
 from cubicweb_frarchives_edition.rq import rqjob
 from cubicweb_frarchives_edition.tasks.import_ead import launch_task
+from cubicweb_frarchives_edition.tasks.utils import csv_zip_description, extract_uploaded_zip
 
 
 def process_import_csv(reader, filepath, services_map, log, metadata_filepath=None):
@@ -49,7 +50,10 @@ def import_csv(
     force_delete=True,
     auto_align=False,
     taskeid=None,
+    archive=None,
 ):
+    if archive is not None:
+        zip_description = csv_zip_description(extract_uploaded_zip(archive))
     launch_task(
         cnx,
         dc.CSVReader,
@@ -29,15 +29,147 @@
 # knowledge of the CeCILL-C license and that you accept its terms.
 #
 
+import csv
+import hashlib
+import io
 import logging
+import os.path as osp
+import queue
+import threading
+import time
+from collections import Counter
+
+import rq
 
 from cubicweb_francearchives.dataimport import sqlutil, es_bulk_index
 
 from cubicweb_francearchives.dataimport.stores import create_massive_store
 from cubicweb_francearchives.dataimport.csv_nomina import CSVNominaReader, readerconfig
+from cubicweb_francearchives.storage import S3BfssStorageMixIn
 
 from cubicweb_frarchives_edition.rq import rqjob
 
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+# number of csv rows imported by the reader at once
+NOMINA_CHUNK_SIZE = 20000
+# maximum number of chunks of es documents waiting for indexation
+ES_QUEUE_SIZE = 2
+
+
+def file_checksum(filepath):
+    """return the sha1 checksum of `filepath`, read by chunks"""
+    checksum = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def iter_csv_chunks(fp, delimiter, chunksize):
+    """yield the content of the csv file object `fp` as utf-8 encoded csv
+    documents of at most `chunksize` rows, each of them starting with the
+    headers of `fp`. Blank rows are skipped.
+    """
+    reader = csv.reader(fp, delimiter=delimiter)
+    headers = next(reader, None)
+    if headers is None:
+        return
+    rows = []
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        rows.append(row)
+        if len(rows) == chunksize:
+            yield encode_csv_chunk(headers, rows, delimiter), len(rows)
+            rows = []
+    if rows:
+        yield encode_csv_chunk(headers, rows, delimiter), len(rows)
+
+
+def encode_csv_chunk(headers, rows, delimiter):
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=delimiter, lineterminator="\n")
+    writer.writerow(headers)
+    writer.writerows(rows)
+    return output.getvalue().encode("utf-8")
+
+
+class ESIndexingWorker(threading.Thread):
+    """index chunks of es documents in a background thread
+
+    Chunks are put in a bounded queue so that the reader blocks instead of
+    accumulating documents in memory when ES is slower than Postgres.
+    """
+
+    def __init__(self, es, log, maxsize=ES_QUEUE_SIZE):
+        super(ESIndexingWorker, self).__init__(name="nomina-es-indexing", daemon=True)
+        self.es = es
+        self.log = log
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.indexed = 0
+
+    def put(self, es_docs):
+        self.queue.put(es_docs)
+
+    def close(self):
+        """wait for all queued documents to be indexed"""
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            es_docs = self.queue.get()
+            if es_docs is None:
+                return
+            try:
+                es_bulk_index(self.es, es_docs)
+                self.indexed += len(es_docs)
+            except Exception as error:
+                self.log.error("[es] error: %s" % error)
+
+
+def import_chunks(
+    cnx, config, service_code, st, filepath, doctype, delimiter, es_worker, log, prefix, stats
+):
+    """import `filepath` chunk by chunk: each chunk is stored in a temporary
+    file read by its own reader and massive store, which commits it, then its
+    es documents are sent to `es_worker`.
+
+    A massive store cannot be reused once finished, hence one store per chunk.
+    The numbers of read rows, created and updated records are counted in
+    `stats` as chunks are committed, so that they are kept if a chunk fails.
+    """
+    start = time.time()
+    with st.storage_read_file(filepath) as fp:
+        for idx, (content, size) in enumerate(iter_csv_chunks(fp, delimiter, NOMINA_CHUNK_SIZE)):
+            chunkpath = st.storage_write_tmpfile(
+                "{}_{:05d}_{}".format(prefix, idx, osp.basename(filepath)), content
+            )
+            store = create_massive_store(cnx, nodrop=True)
+            reader = CSVNominaReader(config, store, service_code, log=log)
+            try:
+                es_docs = reader.import_records(chunkpath, doctype, delimiter)
+                store.flush()
+                # the records of the chunk are only in the final tables and
+                # visible to ES readers once `finish` has committed them
+                store.finish()
+            except Exception:
+                cnx.rollback()
+                raise
+            finally:
+                st.storage_delete_file(chunkpath)
+            stats["created"] += reader.created_records
+            stats["updated"] += reader.updated_records
+            if es_docs and es_worker is not None:
+                es_worker.put(es_docs)
+            stats["rows"] += size
+            elapsed = time.time() - start
+            log.info(
+                "Read %s nomina rows (%.0f rows/s)",
+                stats["rows"],
+                stats["rows"] / elapsed if elapsed else 0,
+            )
+
 
 @rqjob
 def import_csv_nomina(
@@ -47,40 +179,70 @@ def import_csv_nomina(
     doctype,
     delimiter=";",
     taskeid=None,
+    checksum=None,
 ):
+    """import the nomina records of `filepath` by chunks of NOMINA_CHUNK_SIZE
+    rows. Records are indexed in ES by a background thread while the next
+    chunks are inserted in Postgres.
+    """
     log = logging.getLogger("rq.task")
-    store = create_massive_store(cnx, nodrop=True)
+    # the checksum of the uploaded file can only be checked against local files
+    if checksum and osp.isfile(filepath) and file_checksum(filepath) != checksum:
+        log.error('"%s" does not match the uploaded file. Abort.', filepath)
+        return
+    job = rq.get_current_job()
     config = readerconfig(cnx.vreg.config)
-    reader = CSVNominaReader(config, store, service_code, log=log)
+    st = S3BfssStorageMixIn(log=log)
     log.debug('Start importing filepath="%s"', filepath)
+    indexer = cnx.vreg["es"].select("nomina-indexer", cnx)
+    es = indexer.get_connection()
+    es_worker = None
+    if es:
+        es_worker = ESIndexingWorker(es, log)
+        es_worker.start()
+    else:
+        log.error("no elasticsearch configuration found, skipping ES indexing")
     notrigger_tables = sqlutil.nomina_foreign_key_tables(cnx.vreg.schema)
+    stats = Counter()
+    start = time.time()
     with sqlutil.no_trigger(cnx, notrigger_tables, interactive=False):
         try:
-            es_docs = reader.import_records(filepath, doctype, delimiter)
-        except Exception as error:
-            es_docs = []
-            log.exception(
-                """
-                failed to import {fpath} in import_csv_nomina task.
-                <div class="alert alert-danger">{error}</div>""".format(
-                    fpath=filepath, error=error
+            try:
+                import_chunks(
+                    cnx,
+                    config,
+                    service_code,
+                    st,
+                    filepath,
+                    doctype,
+                    delimiter,
+                    es_worker,
+                    log,
+                    job.id,
+                    stats,
                 )
-            )
-        store.flush()
-        store.finish()
+            except Exception as error:
+                log.exception(
+                    """
+                    failed to import {fpath} in import_csv_nomina task.
+                    <div class="alert alert-danger">{error}</div>""".format(
+                        fpath=filepath, error=error
+                    )
+                )
+        finally:
+            if es_worker is not None:
+                es_worker.close()
+        elapsed = time.time() - start
         log.info(
-            "Imported %s new and %s updated nomina records in Postgres.",
-            reader.created_records,
-            reader.updated_records,
+            "Imported %s new and %s updated nomina records in Postgres "
+            "(%s rows in %.1fs, %.0f rows/s).",
+            stats["created"],
+            stats["updated"],
+            stats["rows"],
+            elapsed,
+            stats["rows"] / elapsed if elapsed else 0,
         )
-        if es_docs:
-            log.info("Start ES indexing of %s nomina records", len(es_docs))
-            indexer = cnx.vreg["es"].select("nomina-indexer", cnx)
-            es = indexer.get_connection()
-            try:
-                es_bulk_index(es, es_docs)
-            except Exception as error:
-                log.error("[es] error: %s" % error)
-            log.info("End ES indexing nomina records")
-        if not reader.created_records + reader.updated_records:
+        if es_worker is not None and es_worker.indexed:
+            log.info("Indexed %s nomina records in ES", es_worker.indexed)
+        if not stats["created"] + stats["updated"]:
             log.info("No valid nomina records found. No nomina records has been imported.")
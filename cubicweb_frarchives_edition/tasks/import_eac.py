@@ -39,11 +39,14 @@ from cubicweb_francearchives.dataimport import eac, sqlutil
 from cubicweb_francearchives.dataimport.stores import create_massive_store
 
 from cubicweb_frarchives_edition.rq import update_progress, rqjob
+from cubicweb_frarchives_edition.tasks.utils import extract_uploaded_zip
 
 
 @rqjob
-def import_eac(cnx, filepaths, nodrop=True, taskeid=None):
+def import_eac(cnx, filepaths, nodrop=True, taskeid=None, archive=None):
     log = logging.getLogger("rq.task")
+    if archive is not None:
+        filepaths = extract_uploaded_zip(archive)
     log.info("Start the task with  %r", "superuser" if POSTGRESQL_SUPERUSER else "no superuser")
 
     job = rq.get_current_job()
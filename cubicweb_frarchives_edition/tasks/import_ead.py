@@ -46,6 +46,7 @@ from cubicweb_francearchives.dataimport.stores import create_massive_store
 
 from cubicweb_frarchives_edition.rq import update_progress, rqjob
 from cubicweb_frarchives_edition.tasks.compute_alignments import compute_alignments
+from cubicweb_frarchives_edition.tasks.utils import extract_uploaded_zip
 
 
 def service_code_from_faeid(cnx, faeids):
@@ -70,7 +71,10 @@ def import_ead(
     force_delete=False,
     auto_align=True,
     taskeid=None,
+    archive=None,
 ):
+    if archive is not None:
+        filepaths = extract_uploaded_zip(archive)
     launch_task(
         cnx,
         ead.Reader,
@@ -37,8 +37,6 @@ import rq
 
 # CubicWeb specific imports
 # library specific imports
-from elasticsearch.helpers import parallel_bulk
-
 from cubicweb_elasticsearch.es import indexable_entities
 
 
@@ -47,12 +45,17 @@ from cubicweb_frarchives_edition.entities.kibana.sqlutils import create_kibana_a
 from cubicweb_frarchives_edition.rq import update_progress, rqjob
 
 
+KIBANA_QUEUE_CHUNKSIZE = 500
+
+
 def update_sql_data(cnx, log):
     log.info("creating sql temporary tables for authorities")
     create_kibana_authorities_sql(cnx)
 
 
-def bulk_actions(cnx, indexer, adapter, etype, log, job, current_progress, progress_step):
+def bulk_actions(
+    cnx, indexer, index_name, adapter, etype, log, job, current_progress, progress_step
+):
     indexed = 0
     for idx, entity in enumerate(indexable_entities(cnx, etype, chunksize=100000), 1):
         serializer = entity.cw_adapt_to(adapter)
@@ -63,14 +66,14 @@ def bulk_actions(cnx, indexer, adapter, etype, log, job, current_progress, progr
         if json:
             data = {
                 "_op_type": "index",
-                "_index": indexer.index_name,
+                "_index": index_name,
                 "_id": serializer.es_id,
                 "_source": json,
             }
             yield data
         indexed += 1
         current_progress = update_progress(job, current_progress + progress_step)
-    log.info("[{}] indexed {} {} entities".format(indexer.index_name, indexed, etype))
+    log.info("[{}] indexed {} {} entities".format(index_name, indexed, etype))
 
 
 @rqjob
@@ -90,21 +93,117 @@ def index_kibana(cnx, index_authorities=True, index_services=False):
         if not es:
             log.error("no elasticsearch configuration found, skipping")
             return
-        indexer.create_index()
         if indexer_name == "kibana-auth-indexer":
             update_sql_data(cnx, log)
             adapter = "IKibanaInitiaLAuthorityIndexSerializable"
         else:
             adapter = "IKibanaIndexSerializable"
-        for etype in indexer.etypes:
-            nb_entities = cnx.execute("Any COUNT(X) WHERE X is %s" % etype)[0][0]
-            progress_step = 1.0 / (nb_entities + 1)
-            log.info("start indexing {} {}".format(nb_entities, etype))
-            for _ in parallel_bulk(
-                es,
-                bulk_actions(
-                    cnx, indexer, adapter, etype, log, job, current_progress, progress_step
-                ),
-            ):
-                pass
-        log.info("""finished reindexing "{}" index """.format(indexer.index_name))
+
+        def populate(new_index):
+            errors = 0
+            for etype in indexer.etypes:
+                nb_entities = cnx.execute("Any COUNT(X) WHERE X is %s" % etype)[0][0]
+                progress_step = 1.0 / (nb_entities + 1)
+                log.info("start indexing {} {}".format(nb_entities, etype))
+                errors += indexer.bulk_index(
+                    es,
+                    bulk_actions(
+                        cnx,
+                        indexer,
+                        new_index,
+                        adapter,
+                        etype,
+                        log,
+                        job,
+                        current_progress,
+                        progress_step,
+                    ),
+                    log,
+                )
+            if errors:
+                log.error("{} documents could not be indexed in {}".format(errors, new_index))
+            return errors
+
+        new_index = indexer.rebuild_index(es, populate)
+        if new_index is None:
+            log.error(
+                """"{}" index is left unchanged because of indexing errors""".format(
+                    indexer.index_name
+                )
+            )
+            continue
+        log.info(
+            """finished reindexing "{}" index, now pointing to "{}" """.format(
+                indexer.index_name, new_index
+            )
+        )
+
+
+def kibana_authority_actions(cnx, indexer, eids):
+    """bulk actions reindexing authorities `eids` in the kibana authority index, or
+    deleting them if they do not exist anymore"""
+    existing = [
+        eid
+        for eid, in cnx.system_sql(
+            "SELECT eid FROM entities WHERE eid = ANY(%(eids)s) AND type = ANY(%(etypes)s)",
+            {"eids": eids, "etypes": list(indexer.etypes)},
+        ).fetchall()
+    ]
+    indexed = set()
+    if existing:
+        rset = cnx.execute(
+            "Any X WHERE X eid IN ({})".format(", ".join(str(eid) for eid in existing))
+        )
+        for entity in rset.entities():
+            serializer = entity.cw_adapt_to("IKibanaIndexSerializable")
+            indexed.add(entity.eid)
+            yield {
+                "_op_type": "index",
+                "_index": indexer.index_name,
+                "_id": serializer.es_id,
+                "_source": serializer.serialize(complete=False),
+            }
+    for eid in set(eids).difference(indexed):
+        yield {"_op_type": "delete", "_index": indexer.index_name, "_id": eid}
+
+
+def reindex_kibana_authority_queue(cnx, log, chunksize=KIBANA_QUEUE_CHUNKSIZE):
+    """reindex authorities recorded in the `kibana_authority_queue` table and return
+    the number of processed authorities
+
+    An authority queued again while being reindexed is kept in the queue.
+    """
+    indexer = cnx.vreg["es"].select("kibana-auth-indexer", cnx)
+    es = indexer.get_connection()
+    if not es:
+        log.error("no elasticsearch configuration found, skipping")
+        return 0
+    processed = 0
+    while True:
+        rows = cnx.system_sql(
+            """SELECT eid, queued_at FROM kibana_authority_queue
+               ORDER BY queued_at, eid LIMIT %(limit)s""",
+            {"limit": chunksize},
+        ).fetchall()
+        if not rows:
+            break
+        eids = [eid for eid, _ in rows]
+        errors = indexer.bulk_index(es, kibana_authority_actions(cnx, indexer, eids), log)
+        if errors:
+            log.warning("[{}] {} authorities not reindexed".format(indexer.index_name, errors))
+        cnx.system_sql(
+            """DELETE FROM kibana_authority_queue
+               WHERE eid = ANY(%(eids)s) AND queued_at <= %(queued_at)s""",
+            {"eids": eids, "queued_at": rows[-1][1]},
+        )
+        cnx.commit()
+        processed += len(rows)
+    return processed
+
+
+@rqjob
+def index_kibana_authority_queue(cnx):
+    """reindex authorities changed since the last run in the kibana authority index"""
+    log = logging.getLogger("rq.task")
+    processed = reindex_kibana_authority_queue(cnx, log)
+    log.info("reindexed {} queued authorities".format(processed))
@@ -31,18 +31,22 @@
 # standard library imports
 import csv
 import logging
-from collections import OrderedDict, defaultdict
-from psycopg2.extras import execute_batch
+from collections import OrderedDict
+from tempfile import SpooledTemporaryFile
 import rq
 
 # CubicWeb specific imports
 
 # library specific imports
+from cubicweb_francearchives.dataimport import es_bulk_index
 from cubicweb_francearchives.storage import S3BfssStorageMixIn
 
+from cubicweb_elasticsearch.es import get_connection
+
 from cubicweb_frarchives_edition.rq import rqjob, update_progress
 
 from cubicweb_frarchives_edition import AUTH_URL_PATTERN
+from cubicweb_frarchives_edition.entities.sync import SuggestIndexBuffer
 
 KIBANA_FIELDNAMES = OrderedDict(
     [
@@ -61,6 +65,11 @@ FIELDNAMES = OrderedDict(
     ]
 )
 
+AUTHORITY_ETYPES = ("AgentAuthority", "LocationAuthority", "SubjectAuthority")
+
+# rows of the CSV file are first copied in this temporary table
+QUALIFICATION_TABLE = "qualified_authorities"
+
 
 def process_quality(quality):
     if quality in ("oui", "yes"):
@@ -71,42 +80,50 @@ def process_quality(quality):
 
 
 def load_data(cnx, csvpath, fieldnames, log):
+    """Copy valid rows of `csvpath` into the QUALIFICATION_TABLE temporary table
+
+    :returns: number of copied rows
+    """
     st = S3BfssStorageMixIn(log=log)
-    data = defaultdict(list)
-    with st.storage_read_file(csvpath) as fp:
-        reader = csv.DictReader(fp, delimiter="\t", fieldnames=fieldnames)
-        next(reader, None)  # skip the headers
-        for idx, line in enumerate(reader):
-            entry = {
-                fieldnames[key.lower()]: value if value else None for key, value in line.items()
-            }
-            try:
-                quality = process_quality(entry["quality"])
-            except Exception as err:
-                log.error(
-                    f"""line {idx}: found a wrong quality value "{entry["quality"]}": ({err}). Skip the row"""  # noqa
-                )
-                continue
-            url = entry["urlpath"]
-            match = AUTH_URL_PATTERN.match(url)
-            if not match:
-                log.error(
-                    f"""line {idx}: found a wrong  identifiant "{url}" found. Skip the row"""
-                )  # noqa
-                continue
-            eid = match["eid"]
-            try:
-                etype = cnx.system_sql(f"select type from entities where eid={eid}").fetchone()[0]
-            except Exception:
-                log.error(
-                    f"""line {idx}: no entity with identifiant "{url}" found. Skip the row"""
-                )  # noqa
-                continue
-            if isinstance(quality, float) and quality > 1:
-                log.error(f"""line {idx}: quality score must be <= 1. Skip the row""")
-                continue
-            data[etype].append({"eid": eid, "quality": quality})
-        return data
+    count = 0
+    with SpooledTemporaryFile(max_size=10 * 1024 * 1024, mode="w+") as buf:
+        with st.storage_read_file(csvpath) as fp:
+            reader = csv.DictReader(fp, delimiter="\t", fieldnames=fieldnames)
+            next(reader, None)  # skip the headers
+            for idx, line in enumerate(reader):
+                entry = {
+                    fieldnames[key.lower()]: value if value else None for key, value in line.items()
+                }
+                try:
+                    quality = process_quality(entry["quality"])
+                except Exception as err:
+                    log.error(
+                        f"""line {idx}: found a wrong quality value "{entry["quality"]}": ({err}). Skip the row"""  # noqa
+                    )
+                    continue
+                url = entry["urlpath"]
+                match = AUTH_URL_PATTERN.match(url or "")
+                if not match:
+                    log.error(
+                        f"""line {idx}: found a wrong  identifiant "{url}" found. Skip the row"""
+                    )  # noqa
+                    continue
+                buf.write(f"{idx}\t{match['eid']}\t{'t' if quality else 'f'}\n")
+                count += 1
+        buf.seek(0)
+        cursor = cnx.cnxset.cu
+        cursor.execute(
+            f"""CREATE TEMPORARY TABLE {QUALIFICATION_TABLE} (
+                line integer, eid bigint, quality boolean
+            ) ON COMMIT DROP"""
+        )
+        cursor.copy_expert(f"COPY {QUALIFICATION_TABLE} (line, eid, quality) FROM STDIN", buf)
+    return count
+
+
+def log_rejected_rows(cnx, log, query, message):
+    for idx, eid in cnx.system_sql(query).fetchall():
+        log.error(f"line {idx}: {message.format(eid=eid)}. Skip the row")
 
 
 def process_qualification(cnx, csvpath, headers, log):
@@ -115,14 +132,77 @@ def process_qualification(cnx, csvpath, headers, log):
     :param Connection cnx: CubicWeb database connection
     :param Logger log: RqTask logger
     :param str csvpath: path to CSV file
+
+    :returns: a {eid: quality} dict of updated authorities
+    :rtype: dict
+    """
+    load_data(cnx, csvpath, headers, log)
+    log_rejected_rows(
+        cnx,
+        log,
+        f"""SELECT q.line, q.eid FROM {QUALIFICATION_TABLE} q
+            LEFT OUTER JOIN entities e ON e.eid = q.eid
+            WHERE e.eid IS NULL ORDER BY q.line""",
+        'no entity with identifiant "{eid}" found',
+    )
+    log_rejected_rows(
+        cnx,
+        log,
+        f"""SELECT q.line, q.eid FROM {QUALIFICATION_TABLE} q
+            JOIN entities e ON e.eid = q.eid
+            WHERE e.type NOT IN ({", ".join(f"'{etype}'" for etype in AUTHORITY_ETYPES)})
+            ORDER BY q.line""",
+        'entity with identifiant "{eid}" is not an authority',
+    )
+    updated = {}
+    for etype in AUTHORITY_ETYPES:
+        # the last row of an authority wins
+        rows = cnx.system_sql(
+            f"""UPDATE cw_{etype} AS a SET cw_quality = q.quality
+                FROM (
+                  SELECT DISTINCT ON (eid) eid, quality FROM {QUALIFICATION_TABLE}
+                  ORDER BY eid, line DESC
+                ) AS q
+                WHERE a.cw_eid = q.eid
+                RETURNING a.cw_eid, a.cw_quality"""
+        ).fetchall()
+        updated.update(rows)
+        log.info(f"""Updated {len(rows)} {etype}""")
+    cnx.commit()
+    return updated
+
+
+def reindex_qualified_authorities(cnx, qualities, log):
+    """Update the quality of authorities in the suggest and kibana indexes
+
+    :param dict qualities: a {eid: quality} dict
     """
-    data = load_data(cnx, csvpath, headers, log)
-    query = "UPDATE cw_{} SET cw_quality=%s WHERE cw_eid=%s"
-    for etype, values in data.items():
-        args = [(row["quality"], row["eid"]) for row in values]
-        execute_batch(cnx.cnxset.cu, query.format(etype), args)
-        cnx.commit()
-    log.info(f"""Updated {len(values)} {etype}""")
+    if cnx.vreg.config.mode == "test" or not qualities:
+        return
+    config = cnx.vreg.config
+    log.info(f"reindex {len(qualities)} authorities")
+    try:
+        buffer = SuggestIndexBuffer(cnx)
+        buffer.add(qualities)
+        buffer.flush()
+        if config["enable-kibana-indexes"]:
+            es = get_connection(config)
+            # only the quality has changed, partially update documents
+            es_bulk_index(
+                es,
+                (
+                    {
+                        "_op_type": "update",
+                        "_index": config["kibana-authorities-index-name"],
+                        "_id": eid,
+                        "doc": {"quality": quality},
+                    }
+                    for eid, quality in qualities.items()
+                ),
+                raise_on_error=False,
+            )
+    except Exception as error:
+        log.error(f"failed to reindex qualified authorities : {error}")
 
 
 @rqjob
@@ -137,9 +217,11 @@ def import_qualified_authorities(cnx, csvpath, headers):
     progress = update_progress(job, 0.0)
     log.info(f"process authority qualification from {csvpath}")
     try:
-        process_qualification(cnx, csvpath, headers, log)
+        qualities = process_qualification(cnx, csvpath, headers, log)
     except Exception as error:
         log.error(f"failed to update authority qualification : {error}")
+    else:
+        reindex_qualified_authorities(cnx, qualities, log)
     progress = update_progress(job, progress + 1)
     # delete the temporary file
     S3BfssStorageMixIn().storage_delete_file(csvpath)
@@ -30,17 +30,48 @@
 
 # standard library imports
 import logging
+import re
 
 # third party imports
+import rq
 from elasticsearch.exceptions import ConnectionError, NotFoundError
+from elasticsearch.helpers import parallel_bulk
 from urllib3.exceptions import ProtocolError
 
 # CubicWeb specific imports
+from cubicweb_elasticsearch.es import get_connection
+
 # library specific imports
 
 from cubicweb_francearchives.utils import delete_from_es_by_eid
 from cubicweb_frarchives_edition.rq import rqjob
 
+# number of authorities deleted in each transaction
+REMOVE_AUTHORITIES_CHUNKSIZE = 500
+
+# number of threads and documents of each bulk request used to reindex documents
+REINDEX_THREAD_COUNT = 4
+REINDEX_CHUNKSIZE = 500
+
+# authorities removed by a task and the documents they were indexed in, kept
+# until documents are reindexed so that an interrupted task can be resumed
+REMOVED_AUTHORITIES_TABLE = "removed_authorities"
+REMOVED_DOCUMENTS_TABLE = "removed_authorities_documents"
+
+AUTHORITY_PATHS = {
+    "AgentAuthority": "agent",
+    "LocationAuthority": "location",
+    "SubjectAuthority": "subject",
+}
+
+# remove `params.authorities` from the index entries of a document
+REMOVE_INDEX_ENTRIES_SCRIPT = """
+if (ctx._source.index_entries == null
+    || !ctx._source.index_entries.removeIf(e -> params.authorities.contains(e.authority))) {
+  ctx.op = 'noop';
+}
+"""
+
 
 def log_results(log, removed, ids, not_found, forbidden):
     if removed:
@@ -55,68 +86,238 @@ def log_results(log, removed, ids, not_found, forbidden):
         )
 
 
+def parse_eids(eids):
+    """return the sorted list of distinct integer eids of `eids`
+
+    `eids` is either a list of eids or a string of eids separated by any non-digit character
+    """
+    if isinstance(eids, (int, str)):
+        eids = re.findall(r"\d+", str(eids))
+    return sorted({int(eid) for eid in eids})
+
+
+def authority_url(cnx, etype, eid):
+    return cnx.build_url(f"{AUTHORITY_PATHS.get(etype, etype.lower())}/{eid}")
+
+
+def removed_authorities(cnx, task):
+    """return a list of (eid, etype) of authorities already removed by `task`"""
+    return cnx.system_sql(
+        f"""SELECT authority, etype FROM {REMOVED_AUTHORITIES_TABLE}
+            WHERE task = %(task)s ORDER BY authority""",
+        {"task": task},
+    ).fetchall()
+
+
+def classify_authorities(cnx, eids, etypes, log, done=()):
+    """sort `eids` out of authorities to remove
+
+    :param list eids: list of integer eids
+    :param tuple etypes: entity types which can be removed
+    :param done: eids of authorities already removed by the task
+
+    :returns: a ({etype: [eid]} dict of removable authorities, not found eids, forbidden urls)
+    """
+    done = set(done)
+    found = dict(
+        cnx.system_sql(
+            "SELECT eid, type FROM entities WHERE eid = ANY(%(eids)s)", {"eids": eids}
+        ).fetchall()
+    )
+    not_found = [str(eid) for eid in eids if eid not in found and eid not in done]
+    candidates = {}
+    for eid, etype in sorted(found.items()):
+        if etype not in etypes:
+            log.warning(
+                'do not remove "{}" ({}) as its etype is not in {}'.format(
+                    authority_url(cnx, etype, eid), eid, etypes
+                )
+            )
+            continue
+        candidates.setdefault(etype, []).append(eid)
+    removable, forbidden = {}, []
+    for etype, etype_eids in candidates.items():
+        qualified = {
+            eid
+            for eid, in cnx.system_sql(
+                f"""SELECT cw_eid FROM cw_{etype}
+                    WHERE cw_eid = ANY(%(eids)s) AND cw_quality""",
+                {"eids": etype_eids},
+            ).fetchall()
+        }
+        for eid in sorted(qualified):
+            log.warning(
+                'do not remove "{}" ({}) as it is a qualified authority'.format(
+                    authority_url(cnx, etype, eid), eid
+                )
+            )
+        eschema = cnx.vreg.schema.eschema(etype)
+        # permissions only depend on groups unless rql expressions or owners are involved
+        granted = eschema.has_perm(cnx, "delete")
+        local_role = not granted and eschema.has_local_role("delete")
+        for eid in etype_eids:
+            if eid in qualified:
+                continue
+            if granted or (local_role and eschema.has_perm(cnx, "delete", eid=eid)):
+                removable.setdefault(etype, []).append(eid)
+            else:
+                forbidden.append(authority_url(cnx, etype, eid))
+    return removable, not_found, forbidden
+
+
+def remove_authorities_chunk(cnx, task, etype, eids):
+    """blacklist and delete `eids` authorities of type `etype` in one transaction
+
+    documents indexed by these authorities are recorded to be reindexed later on
+    """
+    eids_str = ", ".join(str(eid) for eid in eids)
+    documents = cnx.execute(
+        f"DISTINCT Any D, A WHERE I authority A, A eid IN ({eids_str}), I index D"
+    ).rows
+    if documents:
+        cnx.system_sql(
+            f"""INSERT INTO {REMOVED_DOCUMENTS_TABLE} (task, document, authority)
+                SELECT %(task)s, d.document, d.authority
+                FROM unnest(%(documents)s, %(authorities)s) AS d(document, authority)
+                ON CONFLICT DO NOTHING""",
+            {
+                "task": task,
+                "documents": [document for document, _ in documents],
+                "authorities": [authority for _, authority in documents],
+            },
+        )
+    cnx.system_sql(
+        f"""INSERT INTO blacklisted_authorities (label)
+            SELECT DISTINCT a.cw_label FROM cw_{etype} a
+            WHERE a.cw_eid = ANY(%(eids)s) AND NOT EXISTS (
+              SELECT 1 FROM blacklisted_authorities b WHERE b.label = a.cw_label
+            )""",
+        {"eids": eids},
+    )
+    cnx.execute(f"DELETE Any I WHERE I authority A, A eid IN ({eids_str})")
+    cnx.execute(f"DELETE {etype} A WHERE A eid IN ({eids_str})")
+    cnx.system_sql(
+        f"""INSERT INTO {REMOVED_AUTHORITIES_TABLE} (task, authority, etype)
+            SELECT %(task)s, unnest(%(eids)s), %(etype)s
+            ON CONFLICT DO NOTHING""",
+        {"task": task, "eids": eids, "etype": etype},
+    )
+    cnx.commit()
+    return len(documents)
+
+
+def iter_reindex_actions(cnx, task, index_names, chunksize=REINDEX_CHUNKSIZE):
+    """yield update actions removing the index entries of removed authorities from documents"""
+    rows = cnx.system_sql(
+        f"""SELECT document, array_agg(authority) FROM {REMOVED_DOCUMENTS_TABLE}
+            WHERE task = %(task)s GROUP BY document ORDER BY document""",
+        {"task": task},
+    ).fetchall()
+    for idx in range(0, len(rows), chunksize):
+        authorities = dict(rows[idx : idx + chunksize])
+        rset = cnx.execute("Any X WHERE X eid IN (%s)" % ", ".join(str(eid) for eid in authorities))
+        for entity in rset.entities():
+            serializable = entity.cw_adapt_to("IFullTextIndexSerializable")
+            if serializable is None:
+                continue
+            for index_name in index_names:
+                yield {
+                    "_op_type": "update",
+                    "_index": index_name,
+                    "_id": serializable.es_id,
+                    "script": {
+                        "source": REMOVE_INDEX_ENTRIES_SCRIPT,
+                        "lang": "painless",
+                        "params": {"authorities": authorities[entity.eid]},
+                    },
+                }
+
+
+def reindex_documents(cnx, task, log):
+    """remove the index entries of authorities removed by `task` from documents in one sweep
+
+    :returns: the number of documents which could not be updated
+    """
+    config = cnx.vreg.config
+    if config.mode == "test":
+        return 0
+    es = get_connection(config)
+    if not es:
+        log.error("no elasticsearch connection available, documents are not reindexed")
+        return 0
+    index_names = [config["index-name"] + "_all", config["published-index-name"] + "_all"]
+    errors = 0
+    for ok, item in parallel_bulk(
+        es,
+        iter_reindex_actions(cnx, task, index_names),
+        thread_count=REINDEX_THREAD_COUNT,
+        chunk_size=REINDEX_CHUNKSIZE,
+        raise_on_error=False,
+        raise_on_exception=False,
+    ):
+        # unpublished documents are missing from the published index
+        if not ok and item.get("update", {}).get("status") != 404:
+            errors += 1
+            log.warning(f"failed to reindex {item}")
+    return errors
+
+
 @rqjob
 def remove_authorities(cnx, eids, etypes=("SubjectAuthority",)):
     """Remove Authorities. By default do it for SubjectAuthorities
 
+    Authorities are deleted by chunks and each deleted chunk is recorded, so that
+    running the task again after an interruption resumes it.
+
     :param Connection cnx: CubicWeb database connection
     :param eids list: list of eids to remove
     """
     log = logging.getLogger("rq.task")
-    if len(eids) <= 1:
+    eids = parse_eids(eids)
+    if not eids:
         log.warning("empty list of eid")
         return
-    not_found = []
-    removed = []
-    removed_eids = []
-    forbidden = []
-    if not isinstance(eids, (list, tuple)):
-        eids = (eids,)
-    log.info("prepared to remove {} authorities: {}".format(len(eids), "; ".join(eids)))
-    for eid in eids:
-        rset = cnx.execute(
-            """Any X WHERE X eid %(eid)s, X is IN (%(etypes)s)"""
-            % {"eid": eid, "etypes": ", ".join(etypes)},
+    task = int(rq.get_current_job().id)
+    log.info(
+        "prepared to remove {} authorities: {}".format(
+            len(eids), "; ".join(str(eid) for eid in eids)
         )
-        if not rset:
-            not_found.append(eid)
-            continue
-        authority = rset.one()
-        if authority.cw_etype not in etypes:
-            log.warning(
-                'do not remove "{}" ({}) as its etype is not in {}'.format(
-                    authority.absolute_url(), eid, etypes
+    )
+    done = removed_authorities(cnx, task)
+    if done:
+        log.info(f"resume task: {len(done)} authorities have already been removed")
+    removable, not_found, forbidden = classify_authorities(
+        cnx, eids, etypes, log, done=[eid for eid, _ in done]
+    )
+    for etype, etype_eids in removable.items():
+        log.info(f"deleting {len(etype_eids)} {etype}")
+        for idx in range(0, len(etype_eids), REMOVE_AUTHORITIES_CHUNKSIZE):
+            chunk = etype_eids[idx : idx + REMOVE_AUTHORITIES_CHUNKSIZE]
+            try:
+                count = remove_authorities_chunk(cnx, task, etype, chunk)
+            except Exception as err:
+                cnx.rollback()
+                log.error(
+                    f"abort deletion of {len(chunk)} {etype} ({chunk[0]} to {chunk[-1]}): {err}"
                 )
-            )
-            continue
-        if authority.quality:
-            log.warning(
-                'do not remove "{}" ({}) as it is a qualified authority'.format(
-                    authority.absolute_url(), eid
-                )
-            )
-            continue
-        log.info(f'deleting "{authority.absolute_url()}"')
-        if not authority.cw_has_perm("delete"):
-            forbidden.append(f"{authority.absolute_url()}")
-            continue
-        indexes_count = cnx.execute(
-            """Any COUNT(I) WHERE I authority E, E eid %(eid)s""", {"eid": authority.eid}
-        )[0][0]
-        log.info(f"Start reindex ES for {indexes_count} indexes")
-        try:
-            authority.delete_blacklisted()
-        except (ConnectionError, ProtocolError, NotFoundError) as err:
-            log.error(
-                f"abort deletion of {authority.absolute_url()}: elasticsearch indexation: {err}"
-            )
-        except Exception as err:
-            log.error(f"abort deletion of {authority.absolute_url()}: {err}")
-            log_results(log, removed, eids, not_found, forbidden)
-            continue
-        log.info(f"deletion done for {authority.absolute_url()}")
-        removed.append(f"{authority.absolute_url()}")
-        removed_eids.append(eid)
+                continue
+            log.info(f"deleted {len(chunk)} {etype} indexing {count} documents")
+    done = removed_authorities(cnx, task)
+    removed = [authority_url(cnx, etype, eid) for eid, etype in done]
+    removed_eids = [str(eid) for eid, _ in done]
+    log.info("Start reindex ES for documents of removed authorities")
+    try:
+        errors = reindex_documents(cnx, task, log)
+    except (ConnectionError, ProtocolError, NotFoundError) as err:
+        log.error(f"elasticsearch indexation: {err}")
+        log_results(log, removed, eids, not_found, forbidden)
+        # keep checkpoints to reindex documents when the task is run again
+        raise
+    if errors:
+        log.error(f"failed to reindex {errors} documents, run the task again to retry")
+        log_results(log, removed, eids, not_found, forbidden)
+        # keep checkpoints to reindex documents when the task is run again
+        raise Exception(f"failed to reindex {errors} documents")
     log.info("Delete removed authorities from ES")
     indexes = [
         cnx.vreg.config["index-name"] + "_suggest",
@@ -125,4 +326,7 @@ def remove_authorities(cnx, eids, etypes=("SubjectAuthority",)):
     if cnx.vreg.config["enable-kibana-indexes"]:
         indexes.append(cnx.vreg.config["kibana-authorities-index-name"])
     delete_from_es_by_eid(cnx, removed_eids, indexes)
+    for table in (REMOVED_DOCUMENTS_TABLE, REMOVED_AUTHORITIES_TABLE):
+        cnx.system_sql(f"DELETE FROM {table} WHERE task = %(task)s", {"task": task})
+    cnx.commit()
     log_results(log, removed, eids, not_found, forbidden)
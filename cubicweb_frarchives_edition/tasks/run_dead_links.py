@@ -29,56 +29,66 @@
 
 
 # standard library imports
-import csv
 import logging
 import datetime
-import os
-import os.path
 
 # third party imports
 import rq
 
 # CubicWeb specific imports
 # library specific imports
-from cubicweb_francearchives.scripts.dead_links import clean_up_linkchecker, run_linkchecker
-from cubicweb_francearchives.storage import S3BfssStorageMixIn
-
-from cubicweb_frarchives_edition.rq import rqjob
+from cubicweb_frarchives_edition.linkchecker import (
+    DEAD_LINKS_HEADERS,
+    LinkChecker,
+    cached_link_statuses,
+    collect_urls,
+    is_dead,
+    store_link_statuses,
+)
+from cubicweb_frarchives_edition.rq import rqjob, update_progress
 from cubicweb_frarchives_edition.tasks.utils import serve_csv
 
 
 @rqjob
 def run_dead_links(cnx):
-    eid = int(rq.get_current_job().id)
+    job = rq.get_current_job()
+    eid = int(job.id)
     log = logging.getLogger("rq.task")
-    linkchecker_output = cnx.vreg.config["linkchecker-output"]
-    dead_links_output = cnx.vreg.config["dead-links-output"]
-    log.info("start checking dead links. This will take several hours.")
-    try:
-        run_linkchecker(
-            cnx.repo.vreg.config["consultation-base-url"],
-            linkchecker_output,
-            cnx.vreg.config["linkchecker-maxmem"],
-            config=cnx.vreg.config["linkchecker-config"],
-        )
-    except RuntimeError as exception:
-        log.warning("incomplete results:%s", exception)
-    except Exception as exception:
-        log.error(exception)
-        return
-    st = S3BfssStorageMixIn(log=log)
-    try:
-        clean_up_linkchecker(linkchecker_output, dead_links_output)
-    except Exception as exception:
-        log.error(exception)
-        return
-    output_file = os.path.join(dead_links_output, "liens_morts.csv")
-    with st.storage_read_file(output_file) as fp:
-        serve_csv(
-            cnx,
-            eid,
-            f"dead-links-{datetime.datetime.now().strftime('%Y%m%d')}.csv",
-            [row for row in csv.reader(fp, delimiter=";")],
-            delimiter=";",
-        )
+    config = cnx.vreg.config
+    log.info("start checking dead links.")
+    urls = collect_urls(cnx)
+    statuses = cached_link_statuses(cnx, urls, ttl=config["linkchecker-cache-ttl"])
+    to_check = [url for url in urls if url not in statuses]
+    log.info(
+        "found %s external links, %s of them checked less than %s days ago",
+        len(urls),
+        len(statuses),
+        config["linkchecker-cache-ttl"],
+    )
+    checker = LinkChecker(
+        concurrency=config["linkchecker-concurrency"],
+        host_concurrency=config["linkchecker-host-concurrency"],
+        log=log,
+    )
+    checked = checker.check(to_check, progress=lambda idx, total: update_progress(job, idx / total))
+    store_link_statuses(cnx, checked)
+    cnx.commit()
+    statuses.update(checked)
+    rows = [DEAD_LINKS_HEADERS]
+    for url in sorted(urls):
+        status, error = statuses[url]
+        if not is_dead(status, error):
+            continue
+        for entity_eid, etype in urls[url]:
+            rows.append(
+                [url, status or "", error or "", entity_eid, etype, cnx.build_url(str(entity_eid))]
+            )
+    log.info("found %s dead links", len(rows) - 1)
+    serve_csv(
+        cnx,
+        eid,
+        f"dead-links-{datetime.datetime.now().strftime('%Y%m%d')}.csv",
+        rows,
+        delimiter=";",
+    )
     log.info("Stop checking dead links.")
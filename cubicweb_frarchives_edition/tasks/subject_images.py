@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © LOGILAB S.A. (Paris, FRANCE) 2016-2019
+# Contact http://www.logilab.fr -- mailto:contact@logilab.fr
+#
+# This software is governed by the CeCILL-C license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL-C
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systemsand/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL-C license and that you accept its terms.
+
+
+# standard library imports
+import io
+import logging
+import os.path as osp
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# third party imports
+from PIL import Image
+
+# CubicWeb specific imports
+from cubicweb import Binary
+
+# library specific imports
+from cubicweb_francearchives import S3_ACTIVE
+from cubicweb_francearchives.storage import S3BfssStorageMixIn
+
+from cubicweb_frarchives_edition import SUBJECT_IMAGE_SIZE, SUBJECT_IMAGE_THUMBNAIL_SIZES
+from cubicweb_frarchives_edition.rq import rqjob
+
+# number of images downloaded and resized concurrently
+DERIVATIVE_WORKERS = 4
+
+
+def normalise_crop_size(current, target):
+    if current == target:
+        return current
+    current_width, current_height = current
+    target_width, target_height = target
+
+    width_ratio = current_width / float(target_width)
+    height_ratio = current_height / float(target_height)
+
+    if width_ratio > height_ratio:
+        # width is too big
+        ratio = (target_width * current_height) / float(target_height * current_width)
+        return (int(round(current_width * ratio)), current_height)
+    elif height_ratio > width_ratio:
+        # height is too big
+        ratio = (target_height * current_width) / float(target_width * current_height)
+        return (current_width, int(round(current_height * ratio)))
+    else:
+        # ratios are equals
+        return (current_width, current_height)
+
+
+def crop_image(image, final_shape, crop_shape):
+    image_width, image_height = image.size
+    crop_width, crop_height = crop_shape
+    top = int(round(float(image_height) / 2 - (float(crop_height) / 2)))
+    left = int(round(float(image_width) / 2 - (float(crop_width) / 2)))
+    box = (left, top, left + crop_width, top + crop_height)
+    cropped_image = image.crop(box)
+    if cropped_image.size == final_shape:
+        return cropped_image
+    return cropped_image.resize(final_shape, Image.Resampling.LANCZOS)
+
+
+def get_derivative_hash(cnx, source_hash, size):
+    """Return the data_hash of the derivative of `source_hash` at `size`, if any."""
+    cu = cnx.system_sql(
+        """SELECT data_hash FROM subject_image_derivatives
+        WHERE source_hash=%(h)s AND width=%(w)s AND height=%(s)s""",
+        {"h": source_hash, "w": size[0], "s": size[1]},
+    )
+    row = cu.fetchone()
+    return row[0] if row else None
+
+
+def set_derivative_hash(cnx, source_hash, size, data_hash, path=None):
+    """Record `data_hash` as the derivative of `source_hash` at `size`.
+
+    A derivative is also recorded as its own derivative so that it is never
+    processed again. `path` is the storage path of derivatives which are not
+    stored in a File (thumbnails).
+    """
+    for source in {source_hash, data_hash}:
+        cnx.system_sql(
+            """INSERT INTO subject_image_derivatives (source_hash, width, height, data_hash, path)
+            VALUES (%(h)s, %(w)s, %(s)s, %(d)s, %(p)s)
+            ON CONFLICT (source_hash, width, height)
+            DO UPDATE SET data_hash=EXCLUDED.data_hash, path=EXCLUDED.path""",
+            {"h": source, "w": size[0], "s": size[1], "d": data_hash, "p": path},
+        )
+
+
+def get_thumbnail_path(cnx, data_hash, size):
+    """Return the storage path of the thumbnail of `data_hash` at `size`, if any."""
+    cu = cnx.system_sql(
+        """SELECT path FROM subject_image_derivatives
+        WHERE source_hash=%(h)s AND width=%(w)s AND height=%(s)s""",
+        {"h": data_hash, "w": size[0], "s": size[1]},
+    )
+    row = cu.fetchone()
+    return row[0] if row else None
+
+
+def build_derivative(content, size):
+    """Crop and resize image `content` to `size`.
+
+    :param bytes content: source image
+    :param tuple size: target (width, height)
+
+    :returns: derivative content, None if the source already has the target size
+    :rtype: bytes
+    """
+    image = Image.open(io.BytesIO(content))
+    if image.size == size:
+        return None
+    format_ = image.format
+    # avoid an odd difference between the desired size, and old size
+    crop_size = normalise_crop_size(image.size, size)
+    image = crop_image(image, size, crop_size)
+    byte_io = io.BytesIO()
+    image.save(byte_io, format_, optimize=True, quality=100)
+    return byte_io.getvalue()
+
+
+def subject_image_files(cnx, eids):
+    """Return (file entity, storage path, data_hash) of existing subject images."""
+    files = []
+    for eid in eids:
+        rset = cnx.execute(
+            "Any F, FSPATH(D), H WHERE X eid %(e)s, X image_file F, F data D, F data_hash H",
+            {"e": eid},
+        )
+        if not rset or not rset[0][1]:
+            continue
+        path = rset[0][1].getvalue()
+        if path:
+            files.append((rset.get_entity(0, 0), path, rset[0][2]))
+    return files
+
+
+def cached_derivative_path(cnx, data_hash):
+    """Return the storage path of an existing file with `data_hash`, if any."""
+    rset = cnx.execute("Any FSPATH(D) LIMIT 1 WHERE F data_hash %(h)s, F data D", {"h": data_hash})
+    if rset and rset[0][0]:
+        return rset[0][0].getvalue() or None
+    return None
+
+
+def write_thumbnails(st, fobj, content, data_hash, extension, sizes, alg):
+    """Write thumbnails of image `content` to the storage.
+
+    :returns: list of (size, thumbnail data_hash, storage path)
+    :rtype: list
+    """
+    thumbnails = []
+    for size in sizes:
+        thumbnail = build_derivative(content, size) or content
+        filename = "{}_{}x{}{}".format(re.sub(r"\W", "", data_hash), *size, extension)
+        path = st.storage_write_file(filename, thumbnail, subdirectories=["subject_images"])
+        thumbnails.append((size, fobj.compute_hash(thumbnail, alg), path))
+    return thumbnails
+
+
+def update_subject_images(
+    cnx,
+    eids,
+    size=SUBJECT_IMAGE_SIZE,
+    thumbnail_sizes=SUBJECT_IMAGE_THUMBNAIL_SIZES,
+    max_workers=DERIVATIVE_WORKERS,
+):
+    """Replace Image files by their derivative at `size` and build their thumbnails.
+
+    Derivatives are cached by source data_hash and size: a source which has
+    already been processed is either skipped (it is a derivative itself) or
+    replaced by the stored derivative content without being decoded again.
+    Remaining sources are downloaded and resized in a thread pool.
+
+    Thumbnails at `thumbnail_sizes` are stored along with the derivative and
+    recorded as derivatives of its data_hash (see `get_thumbnail_path`).
+
+    :param Connection cnx: CubicWeb database connection
+    :param list eids: Image eids
+    :param tuple size: target (width, height)
+    :param tuple thumbnail_sizes: thumbnails (width, height)
+    :param int max_workers: number of threads
+
+    :returns: number of updated images
+    :rtype: int
+    """
+    log = logging.getLogger("rq.task")
+    st = S3BfssStorageMixIn()
+    alg = cnx.vreg.config["hash-algorithm"]
+    todo = []
+    updated = 0
+    for fobj, path, source_hash in subject_image_files(cnx, eids):
+        derivative_hash = source_hash and get_derivative_hash(cnx, source_hash, size)
+        if derivative_hash is None:
+            todo.append((fobj, path, source_hash))
+        elif derivative_hash != source_hash:
+            cached_path = cached_derivative_path(cnx, derivative_hash)
+            if cached_path is None:
+                todo.append((fobj, path, source_hash))
+                continue
+            fobj.cw_set(
+                data=Binary(st.storage_get_file_content(cached_path)), data_hash=derivative_hash
+            )
+            updated += 1
+    log.info("%s images to resize", len(todo))
+
+    def process(fobj, path):
+        # data_hash are computed with the same function as File.data_hash so
+        # that sources and derivatives can be looked up by File.data_hash
+        try:
+            content = st.storage_get_file_content(path)
+            source_hash = fobj.compute_hash(content, alg)
+            derivative = build_derivative(content, size)
+            data = content if derivative is None else derivative
+            data_hash = fobj.compute_hash(data, alg)
+            thumbnails = write_thumbnails(
+                st, fobj, data, data_hash, osp.splitext(path)[1], thumbnail_sizes, alg
+            )
+            return source_hash, derivative, data_hash, thumbnails, None
+        except Exception as error:
+            return None, None, None, None, error
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            process, [fobj for fobj, _, _ in todo], [path for _, path, _ in todo]
+        )
+        for (fobj, path, stored_hash), (source_hash, content, data_hash, thumbnails, error) in zip(
+            todo, results
+        ):
+            if error is not None:
+                log.error("failed to resize %s: %s", path, error)
+                continue
+            if content is not None:
+                fobj.cw_set(data=Binary(content), data_hash=data_hash)
+                updated += 1
+            elif stored_hash != data_hash:
+                fobj.cw_set(data_hash=data_hash)
+            set_derivative_hash(cnx, source_hash, size, data_hash)
+            for thumbnail_size, thumbnail_hash, thumbnail_path in thumbnails:
+                set_derivative_hash(cnx, data_hash, thumbnail_size, thumbnail_hash, thumbnail_path)
+    return updated
+
+
+@rqjob
+def resize_subject_images(cnx, eids):
+    """Crop and resize subject images to SUBJECT_IMAGE_SIZE and build their thumbnails.
+
+    :param Connection cnx: CubicWeb database connection
+    :param list eids: Image eids
+    """
+    log = logging.getLogger("rq.task")
+    if not S3_ACTIVE:
+        raise Exception("S3 is not active.")
+    updated = update_subject_images(cnx, eids)
+    cnx.commit()
+    log.info("%s images resized to %sx%s", updated, *SUBJECT_IMAGE_SIZE)
@@ -31,18 +31,27 @@
 # standard library imports
 import io
 import csv
+import hashlib
 import logging
+import os
+import os.path as osp
+import shutil
+import threading
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from uuid import uuid4
 from tempfile import NamedTemporaryFile
-from functools import wraps
 
 # third party imports
 
 # CubicWeb specific imports
 from cubicweb import Binary
+from cubicweb.server import hook
+from cubicweb.server.sources.storages import AddFileOp
 
 # library specific imports
+from cubicweb_francearchives import S3_ACTIVE
 
 
 def zip_files(files, archive=""):
@@ -70,30 +79,357 @@ def zip_files(files, archive=""):
     return archive
 
 
-def serve(data_format):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(cnx, eid, title, *args, **kwargs):
-            cw_binary = func(cnx, eid, title, *args, **kwargs)
-            output_file = cnx.create_entity(
-                "File",
-                data=cw_binary,
-                data_format=data_format,
-                data_name=title,
-                title=title,
-                uuid=str(uuid4().hex),
+# number of threads extracting archive members
+ZIP_EXTRACT_WORKERS = 4
+# size of the buffer used to copy each archive member
+ZIP_EXTRACT_CHUNK_SIZE = 1024 * 1024
+
+
+def zip_members(archive, exts):
+    """Return members of Zip archive with one of given extensions.
+
+    :param str archive: Zip archive path
+    :param tuple exts: lowercased file extensions
+
+    :returns: list of members
+    :rtype: list
+    """
+    with zipfile.ZipFile(archive) as zf:
+        return [
+            info
+            for info in zf.infolist()
+            if not info.is_dir() and osp.splitext(info.filename)[1].lower() in exts
+        ]
+
+
+def extract_zip(archive, directory, exts, max_workers=ZIP_EXTRACT_WORKERS):
+    """Extract members of Zip archive with one of given extensions, concurrently.
+
+    Each thread reads the archive with its own file handle and copies members
+    through a fixed size buffer. Members which cannot be extracted (e.g. corrupted
+    or with a path outside `directory`) are logged and skipped.
+
+    :param str archive: Zip archive path
+    :param str directory: extraction directory
+    :param tuple exts: lowercased file extensions
+    :param int max_workers: number of threads
+
+    :returns: extracted file paths, in archive order
+    :rtype: list
+    """
+    log = logging.getLogger("rq.task")
+    directory = osp.abspath(directory)
+    local = threading.local()
+    opened = []
+    lock = threading.Lock()
+
+    def extract(info, path):
+        zf = getattr(local, "zf", None)
+        if zf is None:
+            zf = local.zf = zipfile.ZipFile(archive)
+            with lock:
+                opened.append(zf)
+        os.makedirs(osp.dirname(path), exist_ok=True)
+        tmppath = "{}.part".format(path)
+        with zf.open(info) as src, open(tmppath, "wb") as dest:
+            shutil.copyfileobj(src, dest, ZIP_EXTRACT_CHUNK_SIZE)
+        os.replace(tmppath, path)
+        return path
+
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for info in zip_members(archive, exts):
+                path = osp.abspath(osp.join(directory, info.filename))
+                if not path.startswith(directory + os.sep):
+                    log.error("%s: %s is outside of the archive directory", archive, info.filename)
+                    continue
+                futures.append((info.filename, executor.submit(extract, info, path)))
+    finally:
+        for zf in opened:
+            zf.close()
+    filepaths = []
+    for filename, future in futures:
+        try:
+            filepaths.append(future.result())
+        except Exception as error:
+            log.error("%s: failed to extract %s: %s", archive, filename, error)
+    log.info("extracted %r files from %s", len(filepaths), archive)
+    return filepaths
+
+
+def extract_uploaded_zip(archive):
+    """Extract an archive uploaded to be imported and delete it.
+
+    :param dict archive: archive path, extraction directory and file extensions
+
+    :returns: extracted file paths
+    :rtype: list
+    """
+    try:
+        return extract_zip(archive["path"], archive["directory"], archive["exts"])
+    finally:
+        os.remove(archive["path"])
+
+
+def csv_zip_description(filepaths):
+    """Split CSV files extracted from a Zip archive into data and metadata files.
+
+    :param list filepaths: CSV file paths
+
+    :returns: CSV file paths and metadata file path
+    :rtype: dict
+    """
+    res = {"filepaths": [], "metadata": None}
+    for filepath in filepaths:
+        if filepath.endswith("metadata.csv"):
+            res["metadata"] = filepath
+        else:
+            res["filepaths"].append(filepath)
+    return res
+
+
+# size of the buffer used to stream output files
+OUTPUT_CHUNK_SIZE = 1024 * 1024
+# size of the parts of S3 multipart uploads (at least 5MB)
+OUTPUT_S3_PART_SIZE = 8 * 1024 * 1024
+
+
+class BfssOutputStorage:
+    """Write an output file in the BFSS directory, computing its hash on the fly."""
+
+    def __init__(self, directory, title):
+        self.directory = directory
+        self.title = title
+        self.sha1 = hashlib.sha1()
+        self.fp = NamedTemporaryFile(dir=directory, suffix=".part", delete=False)
+
+    def write(self, data):
+        self.fp.write(data)
+        self.sha1.update(data)
+
+    def finish(self):
+        """Move the file to its final path and return it."""
+        self.fp.close()
+        path = osp.join(self.directory, f"{self.sha1.hexdigest()}_{self.title}")
+        os.replace(self.fp.name, path)
+        return path
+
+    def abort(self):
+        self.fp.close()
+        os.remove(self.fp.name)
+
+
+class S3OutputStorage:
+    """Write an output file in the S3 bucket by a multipart upload, computing its
+    hash on the fly."""
+
+    def __init__(self, storage, key, part_size=OUTPUT_S3_PART_SIZE):
+        self.s3cnx = storage.s3cnx
+        self.bucket = storage.bucket
+        self.key = key
+        self.part_size = part_size
+        self.sha1 = hashlib.sha1()
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+
+    def write(self, data):
+        self.buffer += data
+        self.sha1.update(data)
+        if len(self.buffer) >= self.part_size:
+            self.upload_part()
+
+    def upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.s3cnx.create_multipart_upload(Bucket=self.bucket, Key=self.key)[
+                "UploadId"
+            ]
+        number = len(self.parts) + 1
+        response = self.s3cnx.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=number,
+            Body=bytes(self.buffer),
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": number})
+        self.buffer = bytearray()
+
+    def finish(self):
+        """Complete the upload and return the S3 key."""
+        if self.upload_id is None:
+            # small file, no need for a multipart upload
+            self.s3cnx.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+        else:
+            if self.buffer:
+                self.upload_part()
+            self.s3cnx.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={"Parts": self.parts},
+            )
+        return self.key
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3cnx.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            )
+
+
+class OutputFile(io.RawIOBase):
+    """Stream an output file into the File storage (BFSS or S3) while it is produced.
+
+    Content is written as bytes with `write`, as CSV rows with `writerows` or
+    copied from a file with `copyfile`, by chunks of `chunk_size`. When the
+    context manager exits, the File entity refering to the stored content is
+    created, without reading it back, and available as `entity`. The stored
+    content is discarded if an exception is raised.
+
+    :ivar File entity: output file, once stored
+    """
+
+    def __init__(self, cnx, title, data_format, chunk_size=OUTPUT_CHUNK_SIZE):
+        super().__init__()
+        self.cnx = cnx
+        self.title = title
+        self.data_format = data_format
+        self.chunk_size = chunk_size
+        self.uuid = str(uuid4().hex)
+        self.entity = None
+        if S3_ACTIVE:
+            self.storage = S3OutputStorage(
+                cnx.repo.system_source.storage("File", "data"), f"{self.uuid}_{title}"
             )
-            rq_task = cnx.entity_from_eid(eid)
-            rq_task.cw_set(output_file=output_file)
-            cnx.commit()
-            return output_file
+        else:
+            self.storage = BfssOutputStorage(cnx.vreg.config["appfiles-dir"], title)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.storage.write(bytes(data))
+        return len(data)
+
+    def writerows(self, rows, delimiter=","):
+        """Write CSV rows, `rows` being any iterable."""
+        fp = io.TextIOWrapper(
+            io.BufferedWriter(self, self.chunk_size), encoding="utf-8", newline=""
+        )
+        csv.writer(fp, delimiter=delimiter).writerows(rows)
+        # https://bugs.python.org/issue21363
+        fp.detach().detach()
+
+    def copyfile(self, path):
+        with open(path, "rb") as fp:
+            shutil.copyfileobj(fp, self, self.chunk_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.storage.abort()
+            return False
+        key = self.storage.finish()
+        # remove the stored content if the transaction is rolled back
+        if S3_ACTIVE:
+            RemoveS3ObjectOp.get_instance(self.cnx).add_data(key)
+        else:
+            AddFileOp.get_instance(self.cnx).add_data(key)
+        self.entity = create_stored_file(
+            self.cnx,
+            StoredContent(key, self.storage.sha1.hexdigest()),
+            data_format=self.data_format,
+            data_name=self.title,
+            title=self.title,
+            uuid=self.uuid,
+        )
+        return False
+
+
+class RemoveS3ObjectOp(hook.DataOperationMixIn, hook.Operation):
+    """Remove objects uploaded to the S3 bucket if the transaction is rolled back."""
+
+    def rollback_event(self):
+        storage = self.cnx.repo.system_source.storage("File", "data")
+        for key in self.get_data():
+            try:
+                storage.s3cnx.delete_object(Bucket=storage.bucket, Key=key)
+            except Exception as ex:
+                self.error(f"can't remove {key}: {ex}")
+
+
+class StoredContent(Binary):
+    """Value of the File `data` attribute refering to a content already stored
+    under `key` (BFSS path or S3 key), whose hash is `data_hash`."""
+
+    def __init__(self, key, data_hash):
+        super().__init__(key.encode("utf-8"))
+        self.data_hash = data_hash
+
+
+_STORAGE_LOCK = threading.Lock()
+
+
+@contextmanager
+def keep_stored_content(storage):
+    """Make `storage` save StoredContent values as they are.
+
+    In fs_importing mode, storages read the whole content back when the entity
+    is added. StoredContent values are instead handled as the storages handle
+    the content they have just stored: the key is saved and the content is only
+    read on demand. Other values are still processed by `storage`.
+    """
+
+    def entity_added(entity, attr):
+        value = entity.cw_edited[attr]
+        if not isinstance(value, StoredContent):
+            return type(storage).entity_added(storage, entity, attr)
+        entity._cw_dont_cache_attribute(attr, repo_side=True)
+        # hooks may have computed the hash of the key instead of the content
+        entity.cw_edited.edited_attribute("data_hash", value.data_hash)
+        return value
+
+    with _STORAGE_LOCK:
+        storage.entity_added = entity_added
+        try:
+            yield
+        finally:
+            del storage.entity_added
+
+
+def create_stored_file(cnx, data, **attrs):
+    """Create a File entity whose `data` is a content already stored.
 
-        return wrapper
+    :param Connection cnx: CubicWeb database connection
+    :param StoredContent data: key and hash of the stored content
+
+    :returns: File entity
+    :rtype: File
+    """
+    with keep_stored_content(cnx.repo.system_source.storage("File", "data")):
+        return cnx.create_entity("File", data=data, data_hash=data.data_hash, **attrs)
 
-    return decorator
+
+def attach_output_file(cnx, eid, output_file):
+    """Relate the output file to the RqTask and commit.
+
+    :param Connection cnx: CubicWeb database connection
+    :param int eid: RqTask eid
+    :param File output_file: output file
+
+    :returns: output file
+    :rtype: File
+    """
+    rq_task = cnx.entity_from_eid(eid)
+    rq_task.cw_set(output_file=output_file)
+    cnx.commit()
+    return output_file
 
 
-@serve("application/zip")
 def serve_zip(cnx, eid, title, path):
     """Serve Zip archive.
 
@@ -105,50 +441,49 @@ def serve_zip(cnx, eid, title, path):
     :returns: output file
     :rtype: File
     """
-    cw_binary = Binary()
-    cw_binary.write(open(path, "rb").read())
-    return cw_binary
+    with OutputFile(cnx, title, "application/zip") as output:
+        output.copyfile(path)
+    return attach_output_file(cnx, eid, output.entity)
 
 
-@serve("text/csv")
 def serve_csv(cnx, eid, title, rows, delimiter=","):
     """Serve CSV file.
 
     :param Connection cnx: CubicWeb database connection
     :param in eid: RqTask eid
     :param str title: output file title
-    :param list rows: list of rows
+    :param iterable rows: rows
     :param str delimiter: delimiter
 
     :returns: output file
     :rtype: File
     """
-    return write_binary_csv(rows, delimiter=delimiter)
+    with OutputFile(cnx, title, "text/csv") as output:
+        output.writerows(rows, delimiter=delimiter)
+    return attach_output_file(cnx, eid, output.entity)
 
 
 def _encode(rows):
     """Encode rows.
 
-    :returns: list of encoded rows
-    :rtype: list
+    :returns: encoded rows
+    :rtype: generator
     """
     log = logging.getLogger("rq.task")
-    encoded = []
     for row in rows:
         try:
-            encoded.append(
-                [column.encode("utf-8") if isinstance(column, str) else column for column in row]
-            )
+            yield [column.encode("utf-8") if isinstance(column, str) else column for column in row]
         except UnicodeEncodeError as exception:
             log.debug("failed to encode row : UnicodeEncodeError (%s)", exception)
             continue
-    return encoded
 
 
 def write_binary_csv(rows, delimiter=","):
     """Write rows to Binary.
 
-    :param list rows: rows
+    Prefer `OutputFile` for output files, which does not hold the content in memory.
+
+    :param iterable rows: rows
     """
     cw_binary = Binary()
     fp = io.TextIOWrapper(cw_binary, encoding="utf-8", newline="")
@@ -159,11 +494,11 @@ def write_binary_csv(rows, delimiter=","):
     return cw_binary
 
 
-def write_csv(rows, headers=[], path="", delimiter=","):
+def write_csv(rows, headers=(), path="", delimiter=","):
     """Write rows to CSV file. If path is not set,
     a named temporary file is created.
 
-    :param list rows: rows
+    :param iterable rows: rows
     :param tuple headers: column headers
     :param str path: CSV file path
 
@@ -175,9 +510,9 @@ def write_csv(rows, headers=[], path="", delimiter=","):
         fp = NamedTemporaryFile(delete=False)
         path = fp.name
         fp.close()
-    with open(path, "w") as fp:
+    with open(path, "w", newline="") as fp:
         writer = csv.writer(fp, delimiter=delimiter)
         if headers:
-            rows.insert(0, headers)
+            writer.writerow(headers)
         writer.writerows(rows)
     return path
@@ -28,7 +28,6 @@
 # The fact that you are presently reading this means that you have had
 # knowledge of the CeCILL-C license and that you accept its terms.
 #
-import logging
 
 from collections import defaultdict
 
@@ -49,6 +48,7 @@ from cubicweb_francearchives import FIRST_LEVEL_SECTIONS
 from cubicweb_francearchives.views import primary, circular, index, exturl_link
 from cubicweb_francearchives.views.service import DepartmentMapView, Service as ServiceView
 
+from cubicweb_frarchives_edition.rqlogs import LOG_PAGE_SIZE
 from cubicweb_frarchives_edition.views import get_template
 
 _pvs = uicfg.primaryview_section
@@ -586,40 +586,6 @@ class AnonRqTaskPrimaryView(EditionMixin, primary.ContentPrimaryView):
         return
 
 
-SEVERITY_LVL = {
-    "DEBUG": logging.DEBUG,
-    "INFO": logging.INFO,
-    "WARNING": logging.WARNING,
-    "ERROR": logging.ERROR,
-    "FATAL": logging.FATAL,
-    "CRITICAL": logging.CRITICAL,
-}
-
-
-def log_to_table(loglines):
-    rows = []
-    for line in loglines:
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            severity, date, time, info = line.split(None, 3)
-            SEVERITY_LVL[severity]
-            try:
-                hour, time = time.split(",")
-                date = "{} {}".format(date, hour)
-            except Exception:
-                pass
-            rows.append([severity, date, time, html_unescape(info)])
-        except (ValueError, KeyError):
-            line = html_unescape(line)
-            if rows:
-                rows[-1][-1] += "\n" + line
-            else:
-                rows.append([logging.INFO, "", "", line])
-    return rows
-
-
 class OAIRepositoryURLAttributeView(URLAttributeView):
     """open the url in a new tab"""
 
@@ -671,20 +637,19 @@ class RqTaskPrimaryView(EditionMixin, primary.ContentPrimaryView):
                 "window.setTimeout(function() {document.location.reload();}, 10000)"
             )
 
-    def display_logs(self, entity, limit=50000):
-        logs = entity.cw_adapt_to("IRqJob").log
-        if logs:
-            headers = ["severity", "date", "time", "message"]
-            logs = [line for line in xml_escape(logs).splitlines() if line]
-            logs_size = len(logs)
-            if logs_size > limit:
-                logs = logs[-limit:]
-                self.w(
-                    '<div class="alert alert-warning">This task logs have {size} entries. '
-                    "Only {limit} lines are displayed</div>".format(size=logs_size, limit=limit)
-                )
-            return [dict(list(zip(headers, line))) for line in log_to_table(logs)]
-        return None
+    def display_logs(self, entity, limit=LOG_PAGE_SIZE):
+        """Display the first `limit` log records, the following ones are
+        fetched on demand through the `rqtask-logs` route."""
+        total, records = entity.cw_adapt_to("IRqJob").log_page(0, limit)
+        if not records:
+            return None
+        headers = ["severity", "date", "time", "message"]
+        return {
+            "total": total,
+            "url": self._cw.build_url("rqtask-logs/{}".format(entity.eid)),
+            "page_size": limit,
+            "records": [dict(list(zip(headers, record))) for record in records],
+        }
 
     def display_progress(self, entity):
         progress = entity.cw_adapt_to("IRqJob").progress
@@ -740,7 +705,11 @@ class RqTaskPrimaryView(EditionMixin, primary.ContentPrimaryView):
         attrs["state"] = entity.cw_adapt_to("IRqJob").status
         logs = self.display_logs(entity)
         if logs:
-            attrs["logs"] = {"label": _("task_logs"), "data": json_dumps(logs)}
+            attrs["logs"] = {
+                "label": _("task_logs"),
+                "data": json_dumps(logs.pop("records")),
+                "params": json_dumps(logs),
+            }
         findingaids = self.imported_findingaids(entity)
         if findingaids:
             attrs["findingaids"] = findingaids
@@ -32,6 +32,7 @@
 """cubicweb-frarchives-edition xml utils"""
 
 import hashlib
+import re
 from lxml.builder import E
 from lxml import html as lxml_html
 
@@ -54,9 +55,59 @@ def xml_content(element):
     return remove_html_tags(content[left:right].strip())
 
 
+# headings markup, used to detect changes which do not concern headings
+HEADING_RE = re.compile(r"<h([1-6])\b[^>]*>.*?</h\1\s*>", re.IGNORECASE | re.DOTALL)
+COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+
+
+def headings_key(content):
+    """Return a hash of `content` headings markup
+
+    Two contents with the same key have the same headings (with their ids) in
+    the same order, and thus the same summary for a given summary policy.
+
+    :param str content: HTML
+
+    :return: sha1 hexdigest
+    """
+    if content is None:
+        return None
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", "replace")
+    checksum = hashlib.sha1()
+    for match in HEADING_RE.finditer(COMMENT_RE.sub("", content)):
+        checksum.update(match.group(0).encode("utf-8"))
+        checksum.update(b"\0")
+    return checksum.hexdigest()
+
+
+def headings_changed(old_content, new_content):
+    """Return True if the summary of `new_content` may differ from the `old_content` one"""
+    if old_content == new_content:
+        return False
+    return old_content is None or headings_key(old_content) != headings_key(new_content)
+
+
+def parse_html_fragments(content):
+    """Parse `content` HTML fragments, raise InvalidHTMLError if it is not valid
+
+    :param str content: HTML
+
+    :return: list of lxml elements
+    """
+    try:
+        return lxml_html.fragments_fromstring(content)
+    except Exception as err:
+        log_warning(err)
+        raise InvalidHTMLError(err)
+
+
 def generate_summary(content, last_heading_level, skip_empty=True, root_level=2, as_string=True):
     """Generate a TOC from HTML content headings
 
+    Headings are processed in a single pass, the list of the last heading of
+    each level being kept in `parents`.
+
     :param str content: HTML
     :param int last_heading_level: heading level TOC is generated up to
     :param bool skip_empty: skip empty heading in TOC
@@ -65,11 +116,7 @@ def generate_summary(content, last_heading_level, skip_empty=True, root_level=2,
 
     :return: return summary, modified content or None is content was not modified
     """
-    try:
-        fragments = lxml_html.fragments_fromstring(content)
-    except Exception as err:
-        log_warning(err)
-        raise InvalidHTMLError(err)
+    fragments = parse_html_fragments(content)
     headings = range(1, last_heading_level + 1)
     heading_nodes = fragments[0].xpath("|".join("//h{}".format(h) for h in headings))
     if not heading_nodes:
@@ -78,9 +125,16 @@ def generate_summary(content, last_heading_level, skip_empty=True, root_level=2,
         return None, None
     is_content_modified = False
     # summary related variables
-    current_parent = E.ul({"class": "toc"})
-    previous_node = None
-    parent_lists = [(root_level, current_parent)]
+    root = current_parent = E.ul({"class": "toc"})
+    previous_level = root_level
+    parents = {root_level: root}
+
+    def last_item(parent):
+        # lists only contain items
+        if not len(parent):
+            parent.append(E.li())
+        return parent[-1]
+
     for i, node in enumerate(heading_nodes):
         # process headings
         node_id = node.attrib.get("id")
@@ -100,32 +154,25 @@ def generate_summary(content, last_heading_level, skip_empty=True, root_level=2,
             E.a(text, href="#{}".format(node_id)),
         )
         current_level = int(node.tag[1])
-        previous_level = int(previous_node.tag[1]) if previous_node is not None else root_level
         if current_level > previous_level:  # get down
             for j in range(1, (current_level - previous_level)):
                 # add missing levels is case of invalid headings hierarchy
                 new_parent_list = E.ul()
-                if not current_parent.xpath("./li[last()]"):
-                    current_parent.append(E.li())
-                current_parent.xpath("./li[last()]")[0].append(new_parent_list)
+                last_item(current_parent).append(new_parent_list)
                 current_parent = new_parent_list
-            if not current_parent.xpath("./li[last()]"):
-                current_parent.append(E.li())
             new_parent_list = E.ul(link)
-            current_parent.xpath("./li[last()]")[0].append(new_parent_list)
-            current_parent = new_parent_list
-            parent_lists.insert(0, [current_level, new_parent_list])
+            last_item(current_parent).append(new_parent_list)
+            current_parent = parents[current_level] = new_parent_list
         elif current_level < previous_level:  # get up
-            current_parent = [parent for level, parent in parent_lists if level == current_level]
             # if there is no parent for the current level (invalid headings
             # hierarchy), attach it to the root to avoid errors. Normaly is must not happen
             # as it is managed the previous case
-            current_parent = current_parent[0] if current_parent else parent_lists[-1][1]
+            current_parent = parents.get(current_level, root)
             current_parent.append(link)
         else:
             current_parent.append(link)
-        previous_node = node
-    summary = parent_lists[-1][1]
+        previous_level = current_level
+    summary = root
     if as_string:
         summary = lxml_html.tostring(summary).decode("utf-8").strip()
         if is_content_modified:
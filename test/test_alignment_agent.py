@@ -31,6 +31,11 @@
 # standard library imports
 import os
 import json
+import threading
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
 
 # third party imports
 import mock
@@ -373,6 +378,122 @@ class DataBnfTC(AlignmentTC):
             self.assertEqual("10000", dates["deathdate"]["timestamp"])
 
 
+# canned data.bnf.fr responses, by FRBNF identifier
+DATABNF_BINDINGS = {
+    "12405560": {
+        "label": {"type": "literal", "value": "Igor Stravinsky (1882-1971)"},
+        "birthdate": {"type": "literal", "value": "1882-06-17"},
+        "deathdate": {"type": "literal", "value": "1971-04-06"},
+        "description": {"type": "literal", "xml:lang": "fr", "value": "Compositeur"},
+    },
+    "11907966": {
+        "label": {"type": "literal", "value": "Victor Hugo (1802-1885)"},
+        "birthyear": {
+            "type": "typed-literal",
+            "datatype": "http://www.w3.org/2001/XMLSchema#integer",
+            "value": "1802",
+        },
+    },
+}
+
+
+class SPARQLStubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)["query"][0]
+        self.server.queries.append(query)
+        fieldnames = ["label", "birthyear", "birthdate", "deathyear", "deathdate", "description"]
+        if "VALUES" in query:
+            fieldnames.insert(0, "extid")
+        bindings = []
+        for extid, binding in DATABNF_BINDINGS.items():
+            if '"{}"'.format(extid) in query:
+                binding = dict(binding)
+                binding["extid"] = {
+                    "type": "typed-literal",
+                    "datatype": "http://www.w3.org/2001/XMLSchema#integer",
+                    "value": extid,
+                }
+                bindings.append(binding)
+        body = json.dumps({"head": {"vars": fieldnames}, "results": {"bindings": bindings}}).encode(
+            "utf-8"
+        )
+        self.send_response(200)
+        self.send_header("Content-Type", "application/sparql-results+json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SPARQLCacheTC(unittest.TestCase):
+    """SPARQL cache and batch queries tests against a local SPARQL endpoint."""
+
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SPARQLStubHandler)
+        self.server.queries = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.cache = TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache.cleanup()
+        super().tearDown()
+
+    def databnf(self, **kwargs):
+        databnf = DataBnfDatabase(cache_dir=self.cache.name, **kwargs)
+        databnf.querier.endpoint = "http://127.0.0.1:{}/sparql".format(self.server.server_port)
+        return databnf
+
+    def test_cached_agent_infos(self):
+        """
+        Trying: retrieve the same agent infos twice
+        Expecting: the endpoint is queried once
+        """
+        databnf = self.databnf()
+        data_infos = databnf.agent_infos("12405560")
+        self.assertEqual(data_infos["label"], "Igor Stravinsky (1882-1971)")
+        self.assertEqual(data_infos, databnf.agent_infos("12405560"))
+        self.assertEqual(len(self.server.queries), 1)
+        # the cache is shared by databases using the same endpoint
+        self.assertEqual(data_infos, self.databnf().agent_infos("12405560"))
+        self.assertEqual(len(self.server.queries), 1)
+
+    def test_negative_cache(self):
+        """
+        Trying: retrieve unknown agent infos with and without negative cache
+        Expecting: empty responses are cached for `negative_ttl` seconds
+        """
+        self.assertEqual(self.databnf().agent_infos("10000000"), {})
+        self.assertEqual(self.databnf().agent_infos("10000000"), {})
+        self.assertEqual(len(self.server.queries), 1)
+        self.assertEqual(self.databnf(negative_ttl=-1).agent_infos("10000000"), {})
+        self.assertEqual(len(self.server.queries), 2)
+
+    def test_agent_infos_many(self):
+        """
+        Trying: retrieve infos of several agents
+        Expecting: agents are queried by chunks of `batch_size`
+        """
+        databnf = self.databnf()
+        databnf.batch_size = 2
+        infos = databnf.agent_infos_many(["12405560", "11907966", "10000000", "12405560", "x"])
+        self.assertEqual(len(self.server.queries), 2)
+        self.assertIn("VALUES ?extid", self.server.queries[0])
+        self.assertEqual(set(infos), {"12405560", "11907966", "10000000", "x"})
+        self.assertEqual(infos["12405560"], databnf.agent_infos("12405560"))
+        self.assertEqual(infos["11907966"]["label"], "Victor Hugo (1802-1885)")
+        self.assertEqual(
+            json.loads(infos["11907966"]["dates"])["birthdate"]["timestamp"], "1802-01-01"
+        )
+        self.assertEqual(infos["10000000"], {})
+        self.assertEqual(infos["x"], {})
+
+
 class AgentAlignerTC(AlignmentTC):
     """Wikidata and data.bnf.fr test cases (automatic)."""
 
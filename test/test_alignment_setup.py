@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © LOGILAB S.A. (Paris, FRANCE) 2016-2019
+# Contact http://www.logilab.fr -- mailto:contact@logilab.fr
+#
+# This software is governed by the CeCILL-C license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL-C
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systemsand/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL-C license and that you accept its terms.
+
+import os.path as osp
+from tempfile import TemporaryDirectory
+import unittest
+
+from mock import patch
+import psycopg2
+
+from pgfixtures import setup_module, teardown_module  # noqa
+from utils import FrACubicConfigMixIn
+
+from cubicweb.devtools.testlib import CubicWebTC
+from cubicweb.devtools import PostgresApptestConfiguration
+
+from cubicweb_frarchives_edition.alignments import setup
+
+
+def write_lines(dirpath, lines):
+    path = osp.join(dirpath, "data.txt")
+    with open(path, "w") as fp:
+        fp.writelines(f"{line}\n" for line in lines)
+    return path
+
+
+class FileSegmentsTC(unittest.TestCase):
+    """Data files segmentation test cases."""
+
+    def test_segment_boundaries(self):
+        """Segments are contiguous, end with a new line and cover the whole file"""
+        lines = ["{}\t{}".format(idx, "x" * (idx % 17)) for idx in range(200)]
+        with TemporaryDirectory() as tmpdir:
+            path = write_lines(tmpdir, lines)
+            with open(path, "rb") as fp:
+                content = fp.read()
+            for chunk_size in (1, 7, 64, 1000, len(content), 10 * len(content)):
+                segments = setup.file_segments(path, chunk_size)
+                self.assertEqual(segments[0][0], 0)
+                self.assertEqual(segments[-1][1], len(content))
+                for (_, end), (start, _) in zip(segments, segments[1:]):
+                    self.assertEqual(end, start)
+                read_lines = []
+                for start, end in segments:
+                    self.assertLess(start, end)
+                    self.assertEqual(content[end - 1 : end], b"\n")
+                    with setup.FileSegment(path, start, end) as segment:
+                        data = segment.read()
+                        # nothing can be read past the end of the segment
+                        self.assertEqual(segment.read(), b"")
+                        self.assertEqual(segment.readline(), b"")
+                    read_lines.extend(data.decode("utf-8").splitlines())
+                # no line is split or duplicated across segments
+                self.assertEqual(read_lines, lines)
+
+    def test_segment_readline(self):
+        """FileSegment.readline stops at the end of the segment"""
+        with TemporaryDirectory() as tmpdir:
+            path = write_lines(tmpdir, ["first", "second", "third"])
+            with setup.FileSegment(path, 6, 13) as segment:
+                self.assertEqual(segment.readline(), b"second\n")
+                self.assertEqual(segment.readline(), b"")
+
+
+class GeodataLoadTC(FrACubicConfigMixIn, CubicWebTC):
+    """Geodata staging tables load test cases."""
+
+    configcls = PostgresApptestConfiguration
+
+    @property
+    def dbparams(self):
+        sconf = self.config.system_source_config
+        return {
+            "database": sconf["db-name"],
+            "host": sconf.get("db-host") or None,
+            "port": sconf.get("db-port") or None,
+            "user": sconf["db-user"],
+            "password": sconf.get("db-password") or None,
+        }
+
+    def execute(self, query, args=None):
+        with setup.transaction(psycopg2.connect(**self.dbparams)) as crs:
+            crs.execute(query, args)
+            if crs.description:
+                return crs.fetchall()
+
+    def test_load_file_resume(self):
+        """Segments already loaded are skipped when the load is run again"""
+        self.execute("CREATE TABLE test_staging (idx integer, name text)")
+        lines = ["{}\tname {}".format(idx, idx) for idx in range(100)]
+        with TemporaryDirectory() as tmpdir:
+            path = write_lines(tmpdir, lines)
+            segments = setup.file_segments(path, 100)
+            self.assertGreater(len(segments), 2)
+            signature = setup.file_signature(path)
+            self.assertEqual(setup.loaded_segments(self.dbparams, "test_staging", signature), set())
+            # an interrupted load copied the first segment
+            start, end = segments[0]
+            setup.copy_segment(self.dbparams, "test_staging", "", path, signature, 0, start, end)
+            self.assertEqual(setup.loaded_segments(self.dbparams, "test_staging", signature), {0})
+            with patch(
+                "cubicweb_frarchives_edition.alignments.setup.copy_segment",
+                wraps=setup.copy_segment,
+            ) as copy_segment:
+                total = setup.load_file(self.dbparams, "test_staging", path, chunk_size=100)
+            self.assertCountEqual(
+                [call.args[5] for call in copy_segment.call_args_list], range(1, len(segments))
+            )
+            with open(path, "rb") as fp:
+                first_rows = len(fp.read(end).splitlines())
+            self.assertEqual(total, len(lines) - first_rows)
+            self.assertCountEqual(
+                [idx for idx, in self.execute("SELECT idx FROM test_staging")], range(100)
+            )
+            self.assertEqual(
+                setup.loaded_segments(self.dbparams, "test_staging", signature),
+                set(range(len(segments))),
+            )
+            # another file restarts the load from scratch
+            self.assertEqual(
+                setup.loaded_segments(self.dbparams, "test_staging", "another file"), set()
+            )
+            self.assertEqual(self.execute("SELECT count(*) FROM test_staging"), [(0,)])
+
+    def test_swap_tables(self):
+        """Tables and their indexes are swapped in the caller's transaction"""
+        for tablename, value in (("test_geo", "old"), ("test_geo_new", "new")):
+            self.execute(f"CREATE TABLE {tablename} (name text)")
+            self.execute(f"CREATE INDEX {tablename}_name_idx ON {tablename} (name)")
+            self.execute(f"INSERT INTO {tablename} VALUES (%s)", (value,))
+        # a failure after the swap leaves the current table untouched
+        with self.assertRaises(RuntimeError):
+            with setup.transaction(psycopg2.connect(**self.dbparams)) as crs:
+                setup.swap_tables(crs, ("test_geo",))
+                raise RuntimeError("boom")
+        self.assertEqual(self.execute("SELECT name FROM test_geo"), [("old",)])
+        self.assertEqual(self.execute("SELECT name FROM test_geo_new"), [("new",)])
+        with setup.transaction(psycopg2.connect(**self.dbparams)) as crs:
+            setup.swap_tables(crs, ("test_geo",))
+        self.assertEqual(self.execute("SELECT name FROM test_geo"), [("new",)])
+        self.assertEqual(
+            self.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'test_geo'"),
+            [("test_geo_name_idx",)],
+        )
+        self.assertEqual(
+            self.execute(
+                "SELECT to_regclass('test_geo_new'), to_regclass('test_geo_new_name_idx')"
+            ),
+            [(None, None)],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -33,6 +33,7 @@
 import base64
 from unittest import skip
 import datetime as dt
+import json
 import mimetypes
 
 from mock import patch
@@ -958,6 +959,59 @@ class UISchemaViewTC(BaseTC):
         }
         self.assertEqual(res.json, expected)
 
+    def test_uischema_etag(self):
+        """Test UI schema caching.
+
+        Trying: get the same UI schema twice, with the ETag of the first response
+        Expecting: the second response is a 304 Not Modified
+        """
+        url = "/service/uischema"
+        res = self.webapp.get(url, status=200, headers={"accept": "application/json"})
+        self.assertTrue(res.etag)
+        self.assertIn("no-cache", res.headers["Cache-Control"])
+        self.webapp.get(
+            url,
+            status=304,
+            headers={"accept": "application/json", "If-None-Match": '"{}"'.format(res.etag)},
+        )
+        other = self.webapp.get(
+            "/basecontent/uischema", status=200, headers={"accept": "application/json"}
+        )
+        self.assertNotEqual(other.etag, res.etag)
+
+    def test_schema_etag(self):
+        """Test JSON schema caching.
+
+        Trying: get the creation schema of an entity type twice, then the one of RqTask
+        Expecting: the second response is a 304 Not Modified, RqTask schemas are not cached
+        """
+        headers = {"accept": "application/schema+json"}
+        url = "/service/schema?role=creation"
+        res = self.webapp.get(url, status=200, headers=headers)
+        self.assertTrue(res.etag)
+        headers["If-None-Match"] = '"{}"'.format(res.etag)
+        self.webapp.get(url, status=304, headers=headers)
+        res = self.webapp.get("/rqtask/schema?role=creation", status=200, headers=headers)
+        self.assertIsNone(res.etag)
+
+    def test_schema_database_content(self):
+        """Test schemas enumerating database content are not cached.
+
+        Trying: get the creation schema of CWUser, add a CWGroup and get it again
+        Expecting: the new group is in the second schema
+        """
+        self.login()
+        headers = {"accept": "application/schema+json"}
+        url = "/cwuser/schema?role=creation"
+        res = self.webapp.get(url, status=200, headers=headers)
+        self.assertIsNone(res.etag)
+        with self.admin_access.cnx() as cnx:
+            group = cnx.create_entity("CWGroup", name="new-group")
+            cnx.commit()
+        self.assertNotIn(str(group.eid), json.dumps(res.json))
+        res = self.webapp.get(url, status=200, headers=headers)
+        self.assertIn(str(group.eid), json.dumps(res.json))
+
 
 if __name__ == "__main__":
     import unittest
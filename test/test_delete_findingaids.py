@@ -30,6 +30,7 @@
 
 # standard library imports
 import json
+from unittest.mock import patch
 
 # third party imports
 # CubicWeb specific imports
@@ -39,6 +40,8 @@ from cubicweb_francearchives.testutils import S3BfssStorageTestMixin
 from pgfixtures import setup_module, teardown_module  # noqa
 from utils import TaskTC
 
+from cubicweb_frarchives_edition.tasks.delete_findingaids import resolve_findingaids
+
 
 class DeleteFindingAidsTC(S3BfssStorageTestMixin, TaskTC):
     """Delete finding aids test cases."""
@@ -108,6 +111,87 @@ class DeleteFindingAidsTC(S3BfssStorageTestMixin, TaskTC):
             # finding aids have been deleted
             self.assertTrue(cnx.execute("Any X WHERE X is FindingAid").one())
 
+    def test_delete_sync_failure(self):
+        """Test deleting finding aids when the deletion cannot be synced.
+
+        Trying: deleting an existing finding aid, the sync raises an error
+        Expecting: finding aid is deleted and recorded as such in the job
+        """
+        with self.admin_access.cnx() as cnx:
+            self.login()
+            filename = "delete-finding-aids.csv"
+            data = json.dumps(
+                {"name": "delete_finding_aids", "file": filename, "title": "delete_finding_aids"}
+            )
+            upload_files = [("fileobj", filename, b"\n".join([b"identifier", b"foo0123"]))]
+            post_kwargs = {"params": [("data", data)], "upload_files": upload_files}
+            self.webapp.post(
+                "/RqTask/?schema_type=delete_finding_aids",
+                status=201,
+                headers={"Accept": "application/json"},
+                **post_kwargs
+            )
+            task = cnx.find("RqTask").one()
+            job = task.cw_adapt_to("IRqJob")
+            with patch(
+                "cubicweb_frarchives_edition.tasks.delete_findingaids.sync_batch",
+                side_effect=RuntimeError("sync failed"),
+            ):
+                self._is_executed_successfully(cnx, job)
+            # finding aid has been deleted and is not counted as failed
+            self.assertCountEqual(
+                [row[0] for row in cnx.execute("Any S WHERE X is FindingAid, X stable_id S")],
+                ["bar1234", "baz2345"],
+            )
+            self.assertEqual(
+                [irid for irid, _ in job.get_job().meta["deleted_findingaids"]], ["foo0123"]
+            )
+
+    def test_delete_failure_requeue(self):
+        """Test resuming the deletion of finding aids after a failure.
+
+        Trying: deleting existing finding aids, the deletion raises an error, then
+        requeue the failed job
+        Expecting: the job fails, then the requeued job deletes the finding aids
+        """
+        with self.admin_access.cnx() as cnx:
+            self.login()
+            filename = "delete-finding-aids.csv"
+            data = json.dumps(
+                {"name": "delete_finding_aids", "file": filename, "title": "delete_finding_aids"}
+            )
+            upload_files = [
+                ("fileobj", filename, b"\n".join([b"identifier", b"foo0123", b"bar1234"]))
+            ]
+            post_kwargs = {"params": [("data", data)], "upload_files": upload_files}
+            self.webapp.post(
+                "/RqTask/?schema_type=delete_finding_aids",
+                status=201,
+                headers={"Accept": "application/json"},
+                **post_kwargs
+            )
+            task = cnx.find("RqTask").one()
+            job = task.cw_adapt_to("IRqJob")
+            with patch(
+                "cubicweb_frarchives_edition.tasks.delete_findingaids.delete_batch",
+                side_effect=RuntimeError("delete failed"),
+            ):
+                self.work(cnx)
+            job.refresh()
+            self.assertEqual(job.status, "failed")
+            self.assertEqual(cnx.execute("Any X WHERE X is FindingAid").rowcount, 3)
+            job.get_job().requeue()
+            job.refresh()
+            self._is_executed_successfully(cnx, job)
+            self.assertEqual(
+                [row[0] for row in cnx.execute("Any S WHERE X is FindingAid, X stable_id S")],
+                ["baz2345"],
+            )
+            self.assertCountEqual(
+                [irid for irid, _ in job.get_job().meta["deleted_findingaids"]],
+                ["foo0123", "bar1234"],
+            )
+
     def test_delete_nonexisting(self):
         """Test deleting nonexisting finding aids.
 
@@ -171,3 +255,17 @@ class DeleteFindingAidsTC(S3BfssStorageTestMixin, TaskTC):
             self._is_executed_successfully(cnx, job)
             # finding aids have been deleted
             self.assertEqual(cnx.execute("Any X WHERE X is FindingAid").rowcount, 1)
+
+    def test_resolve_findingaids(self):
+        """Test resolving stable ids and eadids of finding aids.
+
+        Trying: resolving a stable id, an eadid and an unknown identifier at once
+        Expecting: all finding aids having the eadid are found and unknown one is reported
+        """
+        with self.admin_access.cnx() as cnx:
+            findingaids, not_found = resolve_findingaids(cnx, ["foo0123", "1234", "unknown"])
+            self.assertCountEqual(
+                [(irid, stable_id) for irid, _, stable_id, _ in findingaids],
+                [("foo0123", "foo0123"), ("1234", "bar1234"), ("1234", "baz2345")],
+            )
+            self.assertEqual(not_found, ["unknown"])
@@ -136,6 +136,39 @@ class CircularHookESTC(FrACubicConfigMixIn, EsSerializableMixIn, CubicWebTC):
             es = json.loads(es.split()[1])
             self.assertEqual(es["count"], 0)
 
+    @mock.patch("elasticsearch.client.Elasticsearch.bulk", unsafe=True)
+    @mock.patch("elasticsearch.helpers.reindex", unsafe=True)
+    @mock.patch("elasticsearch.client.indices.IndicesClient.create", unsafe=True)
+    @mock.patch("elasticsearch.client.indices.IndicesClient.exists", unsafe=True)
+    @mock.patch("elasticsearch.client.Elasticsearch.index", unsafe=True)
+    def test_suggest_buffer(self, index, exists, create, reindex, bulk):
+        """Test modifying several relations of the same authority in one transaction.
+
+        Trying: add business_field and related_authority relations
+        Expecting: the authority is indexed once in each suggest index
+        """
+        with self.admin_access.cnx() as cnx:
+            subject = cnx.execute("Any X WHERE X is SubjectAuthority").one()
+            circular = cnx.execute("Any X WHERE X is Circular").one()
+            concept = cnx.execute("Any X WHERE X is Concept").one()
+            bc = cnx.create_entity(
+                "ExternRef", reftype="Virtual_exhibit", title="title", content="content"
+            )
+            cnx.commit()
+            bc.cw_set(related_authority=subject)
+            circular.cw_set(business_field=concept)
+            cnx.commit()
+            self.assertEqual(bulk.call_count, 1)
+            args, kwargs = bulk.call_args
+            body = args[0] if args else kwargs["body"]
+            actions = [json.loads(line) for line in body.splitlines()[::2]]
+            # one document per suggest index
+            indexes = [action["index"]["_index"] for action in actions]
+            self.assertEqual(len(indexes), len(set(indexes)))
+            self.assertEqual(
+                {str(action["index"]["_id"]) for action in actions}, {str(subject.eid)}
+            )
+
     @mock.patch("elasticsearch.client.indices.IndicesClient.exists")
     @mock.patch("elasticsearch.client.Elasticsearch.index")
     def test_rename_authority(self, index, exists):
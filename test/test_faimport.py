@@ -48,6 +48,7 @@ import rq
 # library specific imports
 
 from cubicweb_francearchives.dataimport.oai_nomina import compute_nomina_stable_id
+from cubicweb_francearchives.dataimport.stores import create_massive_store
 from cubicweb_francearchives.testutils import OaiSickleMixin, S3BfssStorageTestMixin
 
 from cubicweb_frarchives_edition.tasks.qualify_authorities import KIBANA_FIELDNAMES
@@ -770,6 +771,148 @@ class FAImportsTC(FAImportArchiveMixIn, FAImportsBaseTC):
             self.assertEqual(job.status, "finished")
             self.assertEqual(9, cnx.execute("Any COUNT(X) WHERE X is NominaRecord")[0][0])
 
+    @unittest.mock.patch("cubicweb_frarchives_edition.tasks.import_csv_nomina.NOMINA_CHUNK_SIZE", 4)
+    def test_import_nomina_csv_chunks(self):
+        """Test NOMINA import by chunks.
+
+        Trying: CSV file with more rows than the chunk size
+        Expecting: the file is imported in several chunks, each of them is
+        committed before being indexed and ES receives all NominaRecords
+        """
+        with self.admin_access.cnx() as cnx:
+            cnx.create_entity("Service", code="FRAD056", category="l")
+            cnx.commit()
+            indexer_cls = type(cnx.vreg["es"].select("nomina-indexer", cnx))
+        service = "FRAD056"
+        basename = "morbihan_nomina_exemple.csv"
+        fpath = osp.join(self.datadir, "ir_data", service, basename)
+        data = {
+            "name": "import_csv_nomina",
+            "title": "import nomina",
+            "filepaths": [basename],
+            "service": service,
+            "doctype": "RM",
+            "delimiter": ";",
+        }
+        with open(fpath, "rb") as f:
+            buff = f.read()
+        self.login()
+        self.webapp.post(
+            "/RqTask/?schema_type=import_csv_nomina",
+            status=201,
+            headers={"Accept": "application/json"},
+            params=[("data", json.dumps(data))],
+            upload_files=[("fileobj", basename, buff)],
+        )
+        chunks = []
+
+        def es_bulk_index(es, es_docs):
+            # records sent to ES must already be committed
+            with self.admin_access.repo_cnx() as cnx:
+                committed = cnx.execute("Any COUNT(X) WHERE X is NominaRecord")[0][0]
+            chunks.append((len(es_docs), committed))
+
+        with unittest.mock.patch.object(
+            indexer_cls, "get_connection", return_value=unittest.mock.Mock()
+        ), unittest.mock.patch(
+            "cubicweb_frarchives_edition.tasks.import_csv_nomina.es_bulk_index",
+            side_effect=es_bulk_index,
+        ):
+            with self.admin_access.cnx() as cnx:
+                task = cnx.find("RqTask").one()
+                job = task.cw_adapt_to("IRqJob")
+                self.work(cnx)
+                job.refresh()
+                self.assertEqual(job.status, "finished")
+                self.assertEqual(9, cnx.execute("Any COUNT(X) WHERE X is NominaRecord")[0][0])
+        self.assertGreater(len(chunks), 1)
+        indexed = 0
+        for size, committed in chunks:
+            indexed += size
+            self.assertLessEqual(indexed, committed)
+        self.assertEqual(indexed, 9)
+
+    @unittest.mock.patch("cubicweb_frarchives_edition.tasks.import_csv_nomina.NOMINA_CHUNK_SIZE", 5)
+    def test_import_nomina_csv_two_chunks(self):
+        """Test NOMINA import of a file spanning two chunks.
+
+        Trying: CSV file of 9 rows imported by chunks of 5 rows
+        Expecting: each chunk has its own massive store and the 5 + 4 NominaRecords of both
+        chunks are imported
+        """
+        with self.admin_access.cnx() as cnx:
+            cnx.create_entity("Service", code="FRAD056", category="l")
+            cnx.commit()
+        service = "FRAD056"
+        basename = "morbihan_nomina_exemple.csv"
+        fpath = osp.join(self.datadir, "ir_data", service, basename)
+        data = {
+            "name": "import_csv_nomina",
+            "title": "import nomina",
+            "filepaths": [basename],
+            "service": service,
+            "doctype": "RM",
+            "delimiter": ";",
+        }
+        with open(fpath, "rb") as f:
+            buff = f.read()
+        self.login()
+        self.webapp.post(
+            "/RqTask/?schema_type=import_csv_nomina",
+            status=201,
+            headers={"Accept": "application/json"},
+            params=[("data", json.dumps(data))],
+            upload_files=[("fileobj", basename, buff)],
+        )
+        with unittest.mock.patch(
+            "cubicweb_frarchives_edition.tasks.import_csv_nomina.create_massive_store",
+            wraps=create_massive_store,
+        ) as store_factory:
+            with self.admin_access.cnx() as cnx:
+                task = cnx.find("RqTask").one()
+                job = task.cw_adapt_to("IRqJob")
+                self.work(cnx)
+                job.refresh()
+                self.assertEqual(job.status, "finished")
+                self.assertEqual(9, cnx.execute("Any COUNT(X) WHERE X is NominaRecord")[0][0])
+        self.assertEqual(store_factory.call_count, 2)
+
+    def test_import_nomina_csv_invalid_encoding(self):
+        """Test NOMINA import.
+
+        Trying: CSV file which is not encoded in utf-8
+        Expecting: the file is rejected and no task is created
+        """
+        with self.admin_access.cnx() as cnx:
+            cnx.create_entity("Service", code="FRAD056", category="l")
+            cnx.commit()
+        basename = "morbihan_nomina_latin1.csv"
+        data = {
+            "name": "import_csv_nomina",
+            "title": "import nomina",
+            "filepaths": [basename],
+            "service": "FRAD056",
+            "doctype": "RM",
+            "delimiter": ";",
+        }
+        fpath = osp.join(self.datadir, "ir_data", "FRAD056", "morbihan_nomina_exemple.csv")
+        with open(fpath, "rb") as f:
+            headers, content = f.read().split(b"\n", 1)
+        buff = headers + b"\n" + content + "Léon;Hervé\n".encode("latin-1")
+        self.login()
+        res = self.webapp.post(
+            "/RqTask/?schema_type=import_csv_nomina",
+            status=400,
+            headers={"Accept": "application/json"},
+            params=[("data", json.dumps(data))],
+            upload_files=[("fileobj", basename, buff)],
+        )
+        errors = json.loads(res.text)["errors"]
+        self.assertEqual(errors[0]["status"], 422)
+        self.assertTrue(errors[0]["details"].startswith(f'Unable to read "{basename}"'))
+        with self.admin_access.cnx() as cnx:
+            self.assertFalse(cnx.find("RqTask"))
+
 
 class LocAuthorityGroupTC(FAImportsBaseTC):
     """test cases.
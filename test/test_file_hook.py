@@ -33,9 +33,13 @@
 from io import BytesIO
 import os.path as osp
 import shutil
+import sys
 from PIL import Image
 import unittest
 
+import fakeredis
+import rq
+
 from cubicweb import Binary
 from cubicweb.devtools.testlib import CubicWebTC
 from cubicweb.devtools import PostgresApptestConfiguration
@@ -43,7 +47,10 @@ from cubicweb.devtools import PostgresApptestConfiguration
 from cubicweb_francearchives import S3_ACTIVE
 from cubicweb_francearchives.testutils import PostgresTextMixin, S3BfssStorageTestMixin
 
-from cubicweb_frarchives_edition import SUBJECT_IMAGE_SIZE
+from cubicweb_frarchives_edition import SUBJECT_IMAGE_SIZE, SUBJECT_IMAGE_THUMBNAIL_SIZES
+from cubicweb_frarchives_edition.entities.adapters import FILE_SYNC_MIN_BATCH
+from cubicweb_frarchives_edition.rq import work
+from cubicweb_frarchives_edition.tasks.subject_images import get_thumbnail_path
 
 from utils import FrACubicConfigMixIn, create_findingaid
 from pgfixtures import setup_module, teardown_module  # noqa
@@ -447,6 +454,37 @@ class FileHooksTC(S3BfssStorageTestMixin, PostgresTextMixin, FrACubicConfigMixIn
             published_fkey = self.get_published_fkey(cnx, fobj1, fkey)
             self.assertTrue(self.fileExists(published_fkey))
 
+    def test_publish_findingaid_referenced_files_batch(self):
+        """
+        Trying: publish a FindingAid referencing more files than FILE_SYNC_MIN_BATCH,
+                then publish its files again
+        Expecting: all files are published, then skipped as already published
+        """
+        with self.admin_access.cnx() as cnx:
+            fa = create_findingaid(cnx, name=None)
+            cnx.commit()
+            nb_files = FILE_SYNC_MIN_BATCH + 5
+            for idx in range(nb_files):
+                cnx.create_entity(
+                    "File",
+                    data=Binary("some-file-data-{}".format(idx).encode("utf-8")),
+                    data_name="file-{}.pdf".format(idx),
+                    data_format="application/pdf",
+                    reverse_fa_referenced_files=fa,
+                )
+                cnx.commit()
+            fa = cnx.find("FindingAid", eid=fa.eid).one()
+            fa.cw_adapt_to("IWorkflowable").fire_transition("wft_cmsobject_publish")
+            cnx.commit()
+            ifilesync = cnx.find("FindingAid", eid=fa.eid).one().cw_adapt_to("IFileSync")
+            fpaths = [fpath for fpath, feid in ifilesync.files_to_sync()]
+            self.assertEqual(len(fpaths), nb_files)
+            for fpath in fpaths:
+                self.assertTrue(self.fileExists(ifilesync.get_fullpath(fpath)))
+            outcomes = ifilesync.copy()
+            self.assertEqual(len(outcomes), nb_files)
+            self.assertEqual(set(outcomes.values()), {"skipped"})
+
     def test_file_in_published_entities_image_file(self):
         """
         Trying: reference a same file in a BaseContent's content
@@ -1087,6 +1125,24 @@ class SubjectImagesHookTC(
         super(SubjectImagesHookTC, cls).init_config(config)
         config.set_option("consultation-base-url", "https://francearchives.fr")
 
+    def setUp(self):
+        super(SubjectImagesHookTC, self).setUp()
+        self._rq_connection = rq.Connection(fakeredis.FakeStrictRedis())
+        self._rq_connection.__enter__()
+
+    def tearDown(self):
+        super(SubjectImagesHookTC, self).tearDown()
+        self._rq_connection.__exit__(*sys.exc_info())
+
+    def image_content(self, cnx):
+        image_path = cnx.execute(
+            "Any FSPATH(D) WHERE X eid %(e)s, X image_file F, F data D", {"e": self.image.eid}
+        )[0][0].getvalue()
+        return self.getFileContent(image_path)
+
+    def image_size(self, cnx):
+        return Image.open(BytesIO(self.image_content(cnx))).size
+
     def setup_database(self):
         super(SubjectImagesHookTC, self).setup_database()
         with self.admin_access.cnx() as cnx:
@@ -1102,21 +1158,66 @@ class SubjectImagesHookTC(
 
     def test_create_subject_image_file(self):
         with self.admin_access.cnx() as cnx:
-            image_path = cnx.execute(
-                "Any FSPATH(D) WHERE X eid %(e)s, X image_file F, F data D", {"e": self.image.eid}
-            )[0][0].getvalue()
-            stream = BytesIO(self.getFileContent(image_path))
-            image = Image.open(stream)
-            self.assertEqual((150, 275), image.size)
+            self.assertEqual((150, 275), self.image_size(cnx))
             # use image in as SubjectAuthority
             cnx.create_entity("SubjectAuthority", label="subject", subject_image=self.image)
             cnx.commit()
-            image_path = cnx.execute(
-                "Any FSPATH(D) WHERE X eid %(e)s, X image_file F, F data D", {"e": self.image.eid}
-            )[0][0].getvalue()
-            stream = BytesIO(self.getFileContent(image_path))
-            image = Image.open(stream)
-            self.assertEqual(image.size, SUBJECT_IMAGE_SIZE)
+            # the image is resized by a task
+            self.assertEqual((150, 275), self.image_size(cnx))
+            task = cnx.find("RqTask", name="resize_subject_images").one()
+            work(cnx, burst=True, worker_class=rq.worker.SimpleWorker)
+            self.assertEqual(task.cw_adapt_to("IRqJob").status, "finished")
+            self.assertEqual(self.image_size(cnx), SUBJECT_IMAGE_SIZE)
+            # thumbnails are stored along with the resized image
+            data_hash = cnx.entity_from_eid(self.image.eid).image_file[0].data_hash
+            for size in SUBJECT_IMAGE_THUMBNAIL_SIZES:
+                path = get_thumbnail_path(cnx, data_hash, size)
+                self.assertTrue(path)
+                self.assertEqual(Image.open(BytesIO(self.getFileContent(path))).size, size)
+
+    def test_update_subject_image_file(self):
+        with self.admin_access.cnx() as cnx:
+            cnx.create_entity("SubjectAuthority", label="subject", subject_image=self.image)
+            cnx.commit()
+            work(cnx, burst=True, worker_class=rq.worker.SimpleWorker)
+            fobj = cnx.entity_from_eid(self.image.eid).image_file[0]
+            # the resized content is sent back by the editor: nothing to do
+            fobj.cw_set(data=Binary(self.image_content(cnx)))
+            cnx.commit()
+            self.assertEqual(len(cnx.find("RqTask", name="resize_subject_images")), 1)
+            # a new crop is a new file content
+            with open(osp.join(self.datadir, "cat_narrow.png"), "rb") as stream:
+                fobj.cw_set(data=Binary(stream.read()))
+            cnx.commit()
+            self.assertEqual(len(cnx.find("RqTask", name="resize_subject_images")), 2)
+            work(cnx, burst=True, worker_class=rq.worker.SimpleWorker)
+            self.assertEqual(self.image_size(cnx), SUBJECT_IMAGE_SIZE)
+
+    def test_subject_image_derivative_cache(self):
+        with self.admin_access.cnx() as cnx:
+            cnx.create_entity("SubjectAuthority", label="subject", subject_image=self.image)
+            cnx.commit()
+            work(cnx, burst=True, worker_class=rq.worker.SimpleWorker)
+            # editing the caption does not create a task
+            subject_image = cnx.entity_from_eid(self.image.eid)
+            subject_image.cw_set(caption="new caption")
+            cnx.commit()
+            self.assertEqual(len(cnx.find("RqTask", name="resize_subject_images")), 1)
+            # the same source image is not resized again
+            with open(osp.join(self.datadir, "cat_narrow.png"), "rb") as stream:
+                fobj = cnx.create_entity(
+                    "File",
+                    data=Binary(stream.read()),
+                    data_name="cat2.png",
+                    data_format="image/png",
+                )
+            image = cnx.create_entity("Image", caption="other-caption", image_file=fobj)
+            cnx.create_entity("SubjectAuthority", label="other subject", subject_image=image)
+            cnx.commit()
+            self.assertEqual(len(cnx.find("RqTask", name="resize_subject_images")), 2)
+            work(cnx, burst=True, worker_class=rq.worker.SimpleWorker)
+            fobj.cw_clear_all_caches()
+            self.assertEqual(fobj.data_hash, subject_image.image_file[0].data_hash)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © LOGILAB S.A. (Paris, FRANCE) 2016-2019
+# Contact http://www.logilab.fr -- mailto:contact@logilab.fr
+#
+# This software is governed by the CeCILL-C license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL-C
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systemsand/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL-C license and that you accept its terms.
+"""cubicweb-frarchives_edition unit tests for subject authorities grouping."""
+
+import unittest
+
+from mock import MagicMock, patch
+
+from cubicweb_frarchives_edition.alignments import group_subjects
+
+
+class GroupCandidatesTC(unittest.TestCase):
+    def setUp(self):
+        self.cnx = MagicMock()
+        self.cnx.vreg.config.mode = "all-in-one"
+        self.service = self.cnx.vreg["services"].select.return_value
+        self.indexed = []
+        self.service.index_authority_eids.side_effect = lambda eids, chunksize: (
+            self.indexed.append(sorted(eids))
+        )
+
+        def entity_from_eid(eid):
+            target = MagicMock(eid=eid)
+            if eid == "5":
+                target.group.side_effect = RuntimeError("grouping failed")
+            return target
+
+        self.cnx.entity_from_eid.side_effect = entity_from_eid
+
+    def test_flush_by_chunks(self):
+        """Grouped authorities are reindexed each time SUGGEST_FLUSH_SIZE is reached"""
+        candidates = [[("1", "a", "0"), ("2", "a", "0")], [("3", "b", "0"), ("4", "b", "0")]]
+        with patch.object(group_subjects, "SUGGEST_FLUSH_SIZE", 2):
+            group_subjects.group_candidates(self.cnx, candidates, None, 10)
+        self.assertEqual(self.indexed, [[1, 2], [3, 4]])
+
+    def test_flush_on_error(self):
+        """Committed groups are reindexed when a later group fails"""
+        candidates = [[("1", "a", "0"), ("2", "a", "0")], [("5", "b", "0"), ("6", "b", "0")]]
+        with self.assertRaises(RuntimeError):
+            group_subjects.group_candidates(self.cnx, candidates, None, 10)
+        self.assertEqual(self.indexed, [[1, 2]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -29,7 +29,7 @@
 # knowledge of the CeCILL-C license and that you accept its terms.
 
 from pgfixtures import setup_module, teardown_module  # noqa
-from utils import FrACubicConfigMixIn
+from utils import FrACubicConfigMixIn, create_findingaid
 
 from cubicweb.devtools.testlib import CubicWebTC
 from cubicweb.devtools import PostgresApptestConfiguration
@@ -38,7 +38,10 @@ from cubicweb_frarchives_edition.alignments.group_locations import (
     process_candidates,
     Label,
     compute_location_authorities_to_group,
+    documents_count,
+    group_authorities,
 )
+from cubicweb_frarchives_edition.alignments.location import cached_geodata, clear_geodata_cache
 
 
 class GroupLocationsTC(FrACubicConfigMixIn, CubicWebTC):
@@ -71,6 +74,10 @@ class GroupLocationsTC(FrACubicConfigMixIn, CubicWebTC):
             sqlcursor.executemany(sql, countries)
             cnx.commit()
 
+    def setUp(self):
+        super(GroupLocationsTC, self).setUp()
+        clear_geodata_cache()
+
     def create_candidates(self, cnx, quality=None):
         candidates = [
             Label(
@@ -272,3 +279,74 @@ class GroupLocationsTC(FrACubicConfigMixIn, CubicWebTC):
             for label_to, other_labels in list(to_be_grouped.items()):
                 self.assertEqual("Toulouse (France)", label_to.label)
                 self.assertEqual([str(t2.eid)], [o.eid for o in other_labels])
+
+    def test_cached_geodata(self):
+        """Geodata is only built once by process until the cache is cleared"""
+        with self.admin_access.cnx() as cnx:
+            geodata = cached_geodata(cnx)
+            # maps are computed at once and the shared instance keeps no connection
+            self.assertIsNone(geodata.cnx)
+            self.assertIn("belgique", geodata.simplified_countries.values())
+            self.assertIs(geodata, cached_geodata(cnx))
+            clear_geodata_cache()
+            self.assertIsNot(geodata, cached_geodata(cnx))
+
+    def test_cached_geodata_rebuilt_tables(self):
+        """Geodata is built again when tables have been rebuilt, e.g. by another process"""
+        with self.admin_access.cnx() as cnx:
+            geodata = cached_geodata(cnx)
+            # geonames loading drops geodata, without clearing the cache of this process
+            cnx.system_sql("DROP TABLE geodata")
+            cnx.commit()
+            other = cached_geodata(cnx)
+            self.assertIsNot(geodata, other)
+            self.assertIs(other, cached_geodata(cnx))
+
+    def test_countries_candidates(self):
+        """Country candidates are grouped into the one having the most documents"""
+        with self.admin_access.cnx() as cnx:
+            belgique = cnx.create_entity(
+                "ExternalUri",
+                source="geoname",
+                label="Belgique",
+                uri="https://www.geonames.org/2802361",
+            )
+            b1 = cnx.create_entity(
+                "LocationAuthority",
+                label="Belgique",
+                same_as=belgique,
+                reverse_authority=cnx.create_entity("Geogname", label="Belgique"),
+            )
+            findingaid = create_findingaid(cnx)
+            b2 = cnx.create_entity(
+                "LocationAuthority",
+                label="Belgique",
+                same_as=belgique,
+                reverse_authority=cnx.create_entity("Geogname", label="Belgique", index=findingaid),
+            )
+            cnx.commit()
+            self.assertEqual(
+                documents_count(cnx, [b1.eid, b2.eid]), {str(b1.eid): 0, str(b2.eid): 1}
+            )
+            to_be_grouped, not_to_be_grouped = compute_location_authorities_to_group(cnx)
+            self.assertEqual(1, len(to_be_grouped.items()))
+            for label_to, other_labels in list(to_be_grouped.items()):
+                self.assertEqual(str(b2.eid), label_to.eid)
+                self.assertEqual([str(b1.eid)], [o.eid for o in other_labels])
+
+    def test_group_authorities_failed_batch(self):
+        """A failing group does not prevent other groups of its batch to be grouped"""
+        with self.admin_access.cnx() as cnx:
+            t1 = cnx.create_entity("LocationAuthority", label="Toulouse")
+            s1 = cnx.create_entity(
+                "LocationAuthority",
+                label="Toulouse (Haute-Garonne)",
+                reverse_authority=cnx.create_entity("Geogname", label="Toulouse"),
+            )
+            cnx.commit()
+            groups = [(t1.eid, [s1.eid]), (999999, [s1.eid])]
+            grouped, failed = group_authorities(cnx, groups, batch_size=10)
+            self.assertEqual(grouped, {t1.eid, s1.eid})
+            self.assertEqual(failed, [(999999, [s1.eid])])
+            s1 = cnx.find("LocationAuthority", eid=s1.eid).one()
+            self.assertEqual([t1.eid], [e.eid for e in s1.grouped_with])
@@ -29,7 +29,10 @@
 # knowledge of the CeCILL-C license and that you accept its terms.
 #
 """cubicweb-frarchives_edition unit tests for hooks"""
+from contextlib import contextmanager
 from datetime import datetime
+import io
+import logging
 import os.path as osp
 from copy import deepcopy
 import mock
@@ -47,6 +50,8 @@ from cubicweb_francearchives.utils import reveal_glossary
 
 from cubicweb_francearchives.testutils import HashMixIn, PostgresTextMixin
 from cubicweb_frarchives_edition import get_samesas_history
+from cubicweb_frarchives_edition.ccplugin import BenchmarkSummary
+from cubicweb_frarchives_edition.tasks.agent_infos import refresh_agent_info_queue
 
 from utils import FrACubicConfigMixIn
 from pgfixtures import setup_module, teardown_module  # noqa
@@ -614,7 +619,9 @@ class ExternalUriHookTC(FrACubicConfigMixIn, CubicWebTC):
         Trying: add an same_as relation to a databnf ExternalUri
         Expecting: retrive dates (full date) and notes
         """
-        mock_method = "cubicweb_frarchives_edition.alignments.databnf.DataBnfDatabase.agent_infos"
+        mock_method = (
+            "cubicweb_frarchives_edition.alignments.databnf.DataBnfDatabase.agent_infos_batch"
+        )
         return_value = {
             "label": "Igor Stravinsky (1882-1971)",
             "description": "Compositeur. - Pianiste. - Chef d'orchestre",
@@ -623,13 +630,17 @@ class ExternalUriHookTC(FrACubicConfigMixIn, CubicWebTC):
                 "deathdate": {"timestamp": "1971-04-06", "precision": "d"},
             },
         }
-        # use deepcopy because return_value is modified during hook execution
-        with mock.patch(mock_method, return_value=deepcopy(return_value)):
-            with self.admin_access.client_cnx() as cnx:
+        with mock.patch(mock_method, return_value={"12405560": deepcopy(return_value)}):
+            with self.admin_access.cnx() as cnx:
                 uri = "http://data.bnf.fr/12405560/igor_stravinsky/"
                 url = cnx.create_entity("ExternalUri", uri=uri)
                 cnx.create_entity("AgentAuthority", label="Igor Strawinsky", same_as=url)
                 cnx.commit()
+                # AgentInfo is retrieved by the refresh_agent_infos task
+                self.assertFalse(
+                    cnx.execute("Any X WHERE X agent_info_of U, U eid %(e)s", {"e": url.eid})
+                )
+                self.assertEqual((1, 0), refresh_agent_info_queue(cnx, logging.getLogger()))
                 agent_info = cnx.execute(
                     """Any X, D, DD WHERE X is AgentInfo,
                     X dates D,
@@ -675,7 +686,9 @@ class ExternalUriHookTC(FrACubicConfigMixIn, CubicWebTC):
         Trying: add an same_as relation to a Wikidata ExternalUri
         Expecting: retrive dates and notes
         """
-        mock_method = "cubicweb_frarchives_edition.alignments.wikidata.WikidataDatabase.agent_infos"
+        mock_method = (
+            "cubicweb_frarchives_edition.alignments.wikidata.WikidataDatabase.agent_infos_batch"
+        )
         return_value = {
             "label": "Igor Stravinsky",
             "description": "pianiste et compositeur",
@@ -684,13 +697,17 @@ class ExternalUriHookTC(FrACubicConfigMixIn, CubicWebTC):
                 "deathdate": {"timestamp": "1971-04-06", "precision": "d"},
             },
         }
-        # use deepcopy because return_value is modified during hook execution
-        with mock.patch(mock_method, return_value=deepcopy(return_value)):
-            with self.admin_access.client_cnx() as cnx:
+        with mock.patch(mock_method, return_value={"Q7314": deepcopy(return_value)}):
+            with self.admin_access.cnx() as cnx:
                 uri = "https://www.wikidata.org/wiki/Q7314/"
                 url = cnx.create_entity("ExternalUri", uri=uri)
                 cnx.create_entity("AgentAuthority", label="Igor Strawinsky", same_as=url)
                 cnx.commit()
+                # AgentInfo is retrieved by the refresh_agent_infos task
+                self.assertFalse(
+                    cnx.execute("Any X WHERE X agent_info_of U, U eid %(e)s", {"e": url.eid})
+                )
+                self.assertEqual((1, 0), refresh_agent_info_queue(cnx, logging.getLogger()))
                 agent_info = cnx.execute(
                     """Any X, D, DD WHERE X is AgentInfo,
                     X dates D,
@@ -719,6 +736,39 @@ class ExternalUriHookTC(FrACubicConfigMixIn, CubicWebTC):
                 url = cnx.find("ExternalUri", eid=url.eid).one()
                 self.assertEqual(return_value["label"], url.label)
 
+    def test_agentinfo_retry(self):
+        """
+        Trying: add an same_as relation to a databnf ExternalUri while data.bnf.fr fails
+        Expecting: the ExternalUri is kept in the queue and retried later
+        """
+        mock_method = (
+            "cubicweb_frarchives_edition.alignments.databnf.DataBnfDatabase.agent_infos_batch"
+        )
+        with self.admin_access.cnx() as cnx:
+            url = cnx.create_entity(
+                "ExternalUri", uri="http://data.bnf.fr/12405560/igor_stravinsky/"
+            )
+            cnx.create_entity("AgentAuthority", label="Igor Strawinsky", same_as=url)
+            cnx.commit()
+            with mock.patch(mock_method, side_effect=Exception("timed out")):
+                self.assertEqual((0, 1), refresh_agent_info_queue(cnx, logging.getLogger()))
+            attempts, last_error = cnx.system_sql(
+                "SELECT attempts, last_error FROM agent_info_queue WHERE eid=%(e)s",
+                {"e": url.eid},
+            ).fetchone()
+            self.assertEqual(1, attempts)
+            self.assertEqual("timed out", last_error)
+            # the ExternalUri is not retried before its next attempt
+            with mock.patch(mock_method, return_value={"12405560": {"description": "B"}}):
+                self.assertEqual((0, 0), refresh_agent_info_queue(cnx, logging.getLogger()))
+                cnx.system_sql(
+                    "UPDATE agent_info_queue SET next_attempt=LOCALTIMESTAMP WHERE eid=%(e)s",
+                    {"e": url.eid},
+                )
+                self.assertEqual((1, 0), refresh_agent_info_queue(cnx, logging.getLogger()))
+            self.assertEqual("B", cnx.find("AgentInfo").one().description)
+            self.assertFalse(cnx.system_sql("SELECT eid FROM agent_info_queue").fetchall())
+
 
 class BaseContentHookTC(FrACubicConfigMixIn, CubicWebTC):
     """Tests for BaseContent hooks."""
@@ -796,6 +846,83 @@ class BaseContentHookTC(FrACubicConfigMixIn, CubicWebTC):
             for tr in cnx.find("BaseContentTranslation").entities():
                 self.assertFalse(tr.summary)
 
+    def test_basecontent_summary_text_change(self):
+        """
+        Trying: change a BaseContent text outside of its headings, then a heading
+        Expecting: the toc is only regenerated when a heading is changed
+        """
+        with self.admin_access.repo_cnx() as cnx:
+            article = cnx.create_entity(
+                "BaseContent",
+                title="article",
+                content="<h1>titre 1</h1><p>text</p><h2>titre 2</h2><p>text</p>",
+                summary_policy="summary_headers_2",
+            )
+            cnx.commit()
+            article = cnx.find("BaseContent", eid=article.eid).one()
+            summary, content = article.summary, article.content
+            self.assertIn(">titre 2</a>", summary)
+            article.cw_set(content=content.replace("<p>text</p>", "<p>other text</p>"))
+            cnx.commit()
+            article = cnx.find("BaseContent", eid=article.eid).one()
+            self.assertEqual(summary, article.summary)
+            self.assertIn("other text", article.content)
+            article.cw_set(content=article.content.replace("titre 2", "titre 3"))
+            cnx.commit()
+            article = cnx.find("BaseContent", eid=article.eid).one()
+            self.assertIn(">titre 3</a>", article.summary)
+
+    def test_basecontent_invalid_content_text_change(self):
+        """
+        Trying: change a BaseContent text outside of its headings with an invalid HTML
+        Expecting: the content is still validated and a ValidationError is raised
+        """
+        with self.admin_access.repo_cnx() as cnx:
+            article = cnx.create_entity(
+                "BaseContent",
+                title="article",
+                content="<h1>titre 1</h1><p>text</p>",
+                summary_policy="summary_headers_2",
+            )
+            cnx.commit()
+            article = cnx.find("BaseContent", eid=article.eid).one()
+            with mock.patch(
+                "cubicweb_frarchives_edition.xmlutils.lxml_html.fragments_fromstring",
+                side_effect=ValueError("invalid HTML"),
+            ):
+                article.cw_set(content=article.content.replace("<p>text</p>", "<p>other</p>"))
+                with self.assertRaises(ValidationError):
+                    cnx.commit()
+
+    def test_benchmark_summary_command(self):
+        """
+        Trying: run the fa-benchmark-summary command
+        Expecting: the timings of the longest content are printed
+        """
+        with self.admin_access.repo_cnx() as cnx:
+            article = cnx.create_entity(
+                "BaseContent",
+                title="article",
+                content="<h1>titre 1</h1><p>text</p>" * 1000,
+                summary_policy="summary_headers_2",
+            )
+            cnx.commit()
+
+            @contextmanager
+            def admincnx(appid):
+                yield cnx
+
+            with mock.patch("cubicweb_frarchives_edition.ccplugin.admincnx", admincnx), mock.patch(
+                "sys.stdout", new_callable=io.StringIO
+            ) as stdout:
+                BenchmarkSummary(logging.getLogger()).main_run(
+                    ["--limit", "1", "--repeat", "1", "instance"]
+                )
+            lines = stdout.getvalue().splitlines()
+            self.assertEqual(2, len(lines))
+            eid, length = lines[1].split("\t")[:2]
+            self.assertEqual(str(article.eid), eid)
+
 
 class LeafletMapCacheHookTC(FrACubicConfigMixIn, CubicWebTC):
     """Tests for LeafletMapCache hooks."""
@@ -30,6 +30,7 @@
 #
 """cubicweb-frarchives_edition unit tests for hooks"""
 from datetime import datetime
+import logging
 from copy import deepcopy
 import mock
 
@@ -39,6 +40,7 @@ from cubicweb.devtools import PostgresApptestConfiguration
 
 from cubicweb_francearchives.testutils import S3BfssStorageTestMixin, PostgresTextMixin
 from cubicweb_frarchives_edition import get_samesas_history
+from cubicweb_frarchives_edition.tasks.agent_infos import refresh_agent_info_queue
 
 from utils import FrACubicConfigMixIn
 from pgfixtures import setup_module, teardown_module  # noqa
@@ -246,6 +248,40 @@ class ExternalUriHookTC(FrACubicConfigMixIn, CubicWebTC):
             expected = (51.03297, 2.377)
             self.assertEqual(expected, (loc.latitude, loc.longitude))
 
+    def test_sameas_geoname_location_batch(self):
+        """
+        Test coordinates of several authorities aligned in the same transaction
+        """
+        with self.admin_access.cnx() as cnx:
+            moscou = cnx.create_entity(
+                "ExternalUri",
+                source="source",
+                label="Moscou (Russie)",
+                uri="http://www.geonames.org/524901",
+            )
+            dunkerque = cnx.create_entity(
+                "ExternalUri",
+                source="source",
+                label="Dunkerque (Nord, France)",
+                uri="http://www.geonames.org/3020686/",
+            )
+            loc1 = cnx.create_entity("LocationAuthority", label="Moscou (Russie)")
+            loc2 = cnx.create_entity("LocationAuthority", label="Dunkerque (Nord, France)")
+            cnx.commit()
+            loc1.cw_set(same_as=moscou)
+            loc2.cw_set(same_as=(dunkerque, moscou))
+            cnx.commit()
+            loc1 = cnx.find("LocationAuthority", eid=loc1.eid).one()
+            self.assertEqual((48.86, 2.34444), (loc1.latitude, loc1.longitude))
+            loc2 = cnx.find("LocationAuthority", eid=loc2.eid).one()
+            self.assertIn((loc2.latitude, loc2.longitude), [(48.86, 2.34444), (51.03297, 2.377)])
+            cnx.execute("DELETE A same_as E WHERE E eid %(e)s", {"e": moscou.eid})
+            cnx.commit()
+            loc1 = cnx.find("LocationAuthority", eid=loc1.eid).one()
+            self.assertEqual((None, None), (loc1.latitude, loc1.longitude))
+            loc2 = cnx.find("LocationAuthority", eid=loc2.eid).one()
+            self.assertEqual((51.03297, 2.377), (loc2.latitude, loc2.longitude))
+
     def test_sameas_location(self):
         """
         Test Authority location is updated on add/remove ExternalUri
@@ -332,7 +368,9 @@ class ExternalUriHookTC(FrACubicConfigMixIn, CubicWebTC):
         Trying: add an same_as relation to a databnf ExternalUri
         Expecting: retrive dates (full date) and notes
         """
-        mock_method = "cubicweb_frarchives_edition.alignments.databnf.DataBnfDatabase.agent_infos"
+        mock_method = (
+            "cubicweb_frarchives_edition.alignments.databnf.DataBnfDatabase.agent_infos_batch"
+        )
         return_value = {
             "label": "Igor Stravinsky (1882-1971)",
             "description": "Compositeur. - Pianiste. - Chef d'orchestre",
@@ -341,13 +379,17 @@ class ExternalUriHookTC(FrACubicConfigMixIn, CubicWebTC):
                 "deathdate": {"timestamp": "1971-04-06", "precision": "d"},
             },
         }
-        # use deepcopy because return_value is modified during hook execution
-        with mock.patch(mock_method, return_value=deepcopy(return_value)):
-            with self.admin_access.client_cnx() as cnx:
+        with mock.patch(mock_method, return_value={"12405560": deepcopy(return_value)}):
+            with self.admin_access.cnx() as cnx:
                 uri = "http://data.bnf.fr/12405560/igor_stravinsky/"
                 url = cnx.create_entity("ExternalUri", uri=uri)
                 cnx.create_entity("AgentAuthority", label="Igor Strawinsky", same_as=url)
                 cnx.commit()
+                # AgentInfo is retrieved by the refresh_agent_infos task
+                self.assertFalse(
+                    cnx.execute("Any X WHERE X agent_info_of U, U eid %(e)s", {"e": url.eid})
+                )
+                self.assertEqual((1, 0), refresh_agent_info_queue(cnx, logging.getLogger()))
                 agent_info = cnx.execute(
                     """Any X, D, DD WHERE X is AgentInfo,
                     X dates D,
@@ -393,7 +435,9 @@ class ExternalUriHookTC(FrACubicConfigMixIn, CubicWebTC):
         Trying: add an same_as relation to a Wikidata ExternalUri
         Expecting: retrive dates and notes
         """
-        mock_method = "cubicweb_frarchives_edition.alignments.wikidata.WikidataDatabase.agent_infos"
+        mock_method = (
+            "cubicweb_frarchives_edition.alignments.wikidata.WikidataDatabase.agent_infos_batch"
+        )
         return_value = {
             "label": "Igor Stravinsky",
             "description": "pianiste et compositeur",
@@ -402,13 +446,17 @@ class ExternalUriHookTC(FrACubicConfigMixIn, CubicWebTC):
                 "deathdate": {"timestamp": "1971-04-06", "precision": "d"},
             },
         }
-        # use deepcopy because return_value is modified during hook execution
-        with mock.patch(mock_method, return_value=deepcopy(return_value)):
-            with self.admin_access.client_cnx() as cnx:
+        with mock.patch(mock_method, return_value={"Q7314": deepcopy(return_value)}):
+            with self.admin_access.cnx() as cnx:
                 uri = "https://www.wikidata.org/wiki/Q7314/"
                 url = cnx.create_entity("ExternalUri", uri=uri)
                 cnx.create_entity("AgentAuthority", label="Igor Strawinsky", same_as=url)
                 cnx.commit()
+                # AgentInfo is retrieved by the refresh_agent_infos task
+                self.assertFalse(
+                    cnx.execute("Any X WHERE X agent_info_of U, U eid %(e)s", {"e": url.eid})
+                )
+                self.assertEqual((1, 0), refresh_agent_info_queue(cnx, logging.getLogger()))
                 agent_info = cnx.execute(
                     """Any X, D, DD WHERE X is AgentInfo,
                     X dates D,
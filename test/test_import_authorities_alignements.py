@@ -145,6 +145,56 @@ class AgentimportAlignerTC(PostgresTextMixin, CubicWebTC):
             )
             self.assertCountEqual(expected, [link.uri for link in agent.same_as])
 
+    def test_process_alignments_skipped(self):
+        """Test skipped alignments.
+
+        Trying: add alignments to an unknown authority, with an invalid identifiant
+        and which has been removed by a user
+        Expecting: only the other alignment is added, with a new ExternalUri
+        """
+        with self.admin_access.cnx() as cnx:
+            camus = self.eids_map["131399075"]
+            hugo = self.eids_map["130963047"]
+            cnx.system_sql(
+                """INSERT INTO sameas_history (sameas_uri, autheid, action)
+                VALUES ('https://www.wikidata.org/wiki/Q535', %(hugo)s, false)""",
+                {"hugo": hugo},
+            )
+            cnx.commit()
+
+            def record(autheid, externaluri, label):
+                return AgentImportRecord(
+                    {
+                        "identifiant_AgentAuthority": str(autheid),
+                        "libelle_AgentAuthority": "agent",
+                        "URI_ExternalUri": externaluri,
+                        "libelle_ExternalUri": label,
+                        "keep": "yes",
+                    }
+                )
+
+            new_alignments = {
+                (key[0], key[1]): record(*key)
+                for key in (
+                    (camus, "https://www.wikidata.org/wiki/Q34670", "Albert Camus"),
+                    (hugo, "https://www.wikidata.org/wiki/Q535", "Victor Hugo"),
+                    ("x", "https://www.wikidata.org/wiki/Q34670", "Albert Camus"),
+                    (123456789, "https://www.wikidata.org/wiki/Q34670", "Albert Camus"),
+                )
+            }
+            aligner = AgentImportAligner(cnx)
+            aligner.process_alignments(new_alignments, {}, override_alignments=False)
+            exturi = cnx.find("ExternalUri", uri="https://www.wikidata.org/wiki/Q34670").one()
+            self.assertEqual("Albert Camus", exturi.label)
+            self.assertEqual("wikidata", exturi.source)
+            self.assertEqual("Q34670", exturi.extid)
+            agent = cnx.find("AgentAuthority", eid=camus).one()
+            self.assertIn(exturi.eid, [link.eid for link in agent.same_as])
+            self.assertFalse(cnx.find("ExternalUri", uri="https://www.wikidata.org/wiki/Q535"))
+            self.assertFalse(
+                cnx.system_sql("SELECT 1 FROM same_as_relation WHERE eid_from=123456789").fetchall()
+            )
+
     def test_process_subject_csv_file(self):
         """Test import subject alignments form CSV file. Subjects and Agents
         share the same import alignments code. Only CSV headers are différents
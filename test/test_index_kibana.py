@@ -29,6 +29,8 @@
 # knowledge of the CeCILL-C license and that you accept its terms.
 #
 import datetime
+from functools import partial
+import logging
 
 from mock import patch
 
@@ -40,10 +42,100 @@ from cubicweb.devtools import PostgresApptestConfiguration
 from cubicweb_francearchives.testutils import EADImportMixin
 
 from cubicweb_frarchives_edition.entities.kibana.sqlutils import create_kibana_authorities_sql
+from cubicweb_frarchives_edition.tasks.index_kibana import reindex_kibana_authority_queue
 
 from pgfixtures import setup_module, teardown_module  # noqa
 
 
+class FakeIndicesClient(object):
+    """in-memory stand-in for the elasticsearch indices API"""
+
+    def __init__(self):
+        self.indexes = {}
+        self.mappings = {}
+        self.aliases = {}
+
+    def create(self, index, body=None):
+        assert index not in self.indexes and index not in self.aliases
+        self.indexes[index] = dict(body["settings"])
+        self.mappings[index] = dict(body["mappings"])
+
+    def get(self, index, ignore=None):
+        prefix = index.rstrip("*")
+        return {
+            name: {
+                "aliases": {alias: {} for alias, target in self.aliases.items() if target == name}
+            }
+            for name in self.indexes
+            if name.startswith(prefix)
+        }
+
+    def get_mapping(self, index):
+        return {index: {"mappings": self.mappings[index]}}
+
+    def put_mapping(self, index, body):
+        self.mappings[index].update(body)
+
+    def exists(self, index):
+        return index in self.indexes or index in self.aliases
+
+    def exists_alias(self, name):
+        return name in self.aliases
+
+    def get_alias(self, name):
+        return {self.aliases[name]: {"aliases": {name: {}}}}
+
+    def put_settings(self, index, body):
+        self.indexes[index].update(body["index"])
+
+    def refresh(self, index):
+        pass
+
+    def update_aliases(self, body):
+        for action in body["actions"]:
+            ((kind, params),) = action.items()
+            if kind == "remove_index":
+                del self.indexes[params["index"]]
+            elif kind == "remove":
+                del self.aliases[params["alias"]]
+            else:
+                assert params["alias"] not in self.indexes
+                self.aliases[params["alias"]] = params["index"]
+
+    def delete(self, index, ignore=None):
+        self.indexes.pop(index, None)
+
+
+class FakeTasksClient(object):
+    def __init__(self):
+        self.results = {}
+
+    def get(self, task_id):
+        return self.results[task_id]
+
+
+class FakeElasticsearch(object):
+    """in-memory stand-in for an elasticsearch connection"""
+
+    def __init__(self):
+        self.indices = FakeIndicesClient()
+        self.tasks = FakeTasksClient()
+        self.reindexed_slices = []
+        self.failing_slices = set()
+
+    def reindex(self, body, wait_for_completion=True):
+        slice_id = body["source"]["slice"]["id"]
+        self.reindexed_slices.append(slice_id)
+        task_id = "task:{}".format(len(self.reindexed_slices))
+        failures = ["shard failure"] if slice_id in self.failing_slices else []
+        self.tasks.results[task_id] = {
+            "completed": True,
+            "task": {"status": {"total": 10, "created": 10, "updated": 0}},
+            "response": {"failures": failures},
+        }
+        return {"task": task_id}
+
+
 class KibanaIndexerImporterTC(EADImportMixin, CubicWebTC):
     configcls = PostgresApptestConfiguration
 
@@ -295,6 +387,152 @@ class KibanaIndexerImporterTC(EADImportMixin, CubicWebTC):
                 [{"label": "FRAN_NP_006883", "uri": "FRAN_NP_006883", "source": "EAC-CPF"}],
             )
 
+    @patch("elasticsearch.client.indices.IndicesClient.exists")
+    @patch("elasticsearch.client.Elasticsearch.bulk")
+    def test_kibana_authority_queue(self, bulk, exists):
+        """Test changed authorities are queued and reindexed by the queue task"""
+        self.config.global_set_option("enable-kibana-indexes", "yes")
+
+        def queued(cnx):
+            return [eid for eid, in cnx.system_sql("SELECT eid FROM kibana_authority_queue")]
+
+        with self.admin_access.cnx() as cnx:
+            cnx.system_sql("DELETE FROM kibana_authority_queue")
+            cnx.commit()
+            loc = cnx.create_entity("LocationAuthority", label="Paris")
+            cnx.commit()
+            self.assertEqual(queued(cnx), [loc.eid])
+            loc.cw_set(label="Paris (France)")
+            cnx.commit()
+            self.assertEqual(queued(cnx), [loc.eid])
+            log = logging.getLogger("rq.task")
+            self.assertEqual(reindex_kibana_authority_queue(cnx, log), 1)
+            self.assertEqual(queued(cnx), [])
+            body = bulk.call_args[0][0]
+            self.assertIn('"index"', body)
+            self.assertIn("Paris (France)", body)
+            # grouping queues both authorities
+            other = cnx.create_entity("LocationAuthority", label="Paris, France")
+            cnx.commit()
+            cnx.system_sql("DELETE FROM kibana_authority_queue")
+            cnx.commit()
+            other.cw_set(grouped_with=loc)
+            cnx.commit()
+            self.assertCountEqual(queued(cnx), [loc.eid, other.eid])
+            # deleted authorities are removed from the index
+            cnx.system_sql("DELETE FROM kibana_authority_queue")
+            loc.cw_delete()
+            cnx.commit()
+            self.assertIn(loc.eid, queued(cnx))
+            bulk.reset_mock()
+            reindex_kibana_authority_queue(cnx, log)
+            self.assertEqual(queued(cnx), [])
+            body = bulk.call_args[0][0]
+            self.assertIn('"delete"', body)
+            self.assertIn(str(loc.eid), body)
+
+    def test_rebuild_index(self):
+        """Test kibana indexes are rebuilt in a new index before swapping the alias"""
+        with self.admin_access.cnx() as cnx:
+            indexer = cnx.vreg["es"].select("kibana-service-indexer", cnx)
+            alias = indexer.index_name
+            es = FakeElasticsearch()
+            # index created before versioned indexes were introduced
+            es.indices.create(alias, body=indexer.settings)
+            loaded = []
+
+            def populate(new_index):
+                self.assertEqual(es.indices.indexes[new_index]["number_of_replicas"], 0)
+                self.assertEqual(es.indices.indexes[new_index]["refresh_interval"], "-1")
+                self.assertNotEqual(es.indices.aliases.get(alias), new_index)
+                loaded.append(new_index)
+
+            first = indexer.rebuild_index(es, populate)
+            self.assertEqual(loaded, [first])
+            self.assertTrue(first.startswith(alias + "_"))
+            self.assertEqual(es.indices.aliases, {alias: first})
+            self.assertEqual(list(es.indices.indexes), [first])
+            self.assertEqual(es.indices.indexes[first]["number_of_replicas"], 1)
+            self.assertIsNone(es.indices.indexes[first]["refresh_interval"])
+            second = indexer.rebuild_index(es, populate)
+            self.assertEqual(es.indices.aliases, {alias: second})
+            self.assertEqual(list(es.indices.indexes), [second])
+
+            def failing_populate(new_index):
+                raise RuntimeError("boom")
+
+            with self.assertRaises(RuntimeError):
+                indexer.rebuild_index(es, failing_populate)
+            # the live index is left untouched
+            self.assertEqual(es.indices.aliases, {alias: second})
+            self.assertEqual(list(es.indices.indexes), [second])
+
+            def partial_populate(new_index):
+                loaded.append(new_index)
+                return 2
+
+            # documents failed to be indexed: the partial index is not published
+            self.assertIsNone(indexer.rebuild_index(es, partial_populate))
+            self.assertEqual(es.indices.aliases, {alias: second})
+            self.assertEqual(list(es.indices.indexes), [second])
+
+    def test_rebuild_index_failed_runs(self):
+        """Test failed rebuilds of a resumable index do not leak unpublished versions"""
+        with self.admin_access.cnx() as cnx:
+            indexer = cnx.vreg["es"].select("kibana-ir-indexer", cnx)
+            self.assertTrue(indexer.resumable)
+            alias = indexer.index_name
+            es = FakeElasticsearch()
+
+            def failing_populate(new_index):
+                raise RuntimeError("boom")
+
+            for _ in range(2):
+                with self.assertRaises(RuntimeError):
+                    indexer.rebuild_index(es, failing_populate)
+                # only the last failed version is kept to be resumed
+                self.assertEqual(len(es.indices.indexes), 1)
+                self.assertEqual(list(es.indices.indexes), [indexer.pending_index(es)])
+            published = indexer.rebuild_index(es, lambda new_index: 0)
+            self.assertEqual(es.indices.aliases, {alias: published})
+            self.assertEqual(list(es.indices.indexes), [published])
+            self.assertIsNone(indexer.pending_index(es))
+
+    def test_populate_ir_index_resume(self):
+        """Test the kibana IR index is reindexed by slices which can be resumed"""
+        with self.admin_access.cnx() as cnx:
+            indexer = cnx.vreg["es"].select("kibana-ir-indexer", cnx)
+            indexer.reindex_poll_interval = 0
+            indexer.reindex_retries = 1
+            es = FakeElasticsearch()
+            es.failing_slices = {3}
+            progress = []
+            with patch(
+                "cubicweb_frarchives_edition.entities.kibana.documents.get_connection",
+                return_value=es,
+            ):
+                with self.assertRaises(Exception):
+                    indexer.rebuild_index(
+                        es, partial(indexer.populate_index, progress=progress.append)
+                    )
+                # slice 3 was run and retried once
+                self.assertEqual(sorted(es.reindexed_slices), [0, 1, 2, 3, 3, 4, 5, 6, 7])
+                # the partially loaded index is kept and nothing is published
+                new_index = indexer.pending_index(es)
+                self.assertIsNotNone(new_index)
+                self.assertEqual(es.indices.aliases, {})
+                state = indexer.reindex_state(es, new_index)
+                self.assertCountEqual(state["completed"], [0, 1, 2, 4, 5, 6, 7])
+                es.failing_slices = set()
+                es.reindexed_slices = []
+                published = indexer.rebuild_index(
+                    es, partial(indexer.populate_index, progress=progress.append), resume=True
+                )
+            self.assertEqual(published, new_index)
+            self.assertEqual(es.reindexed_slices, [3])
+            self.assertEqual(es.indices.aliases, {indexer.index_name: new_index})
+            self.assertEqual(progress[-1], 1.0)
+
 
 if __name__ == "__main__":
     unittest.main
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © LOGILAB S.A. (Paris, FRANCE) 2016-2019
+# Contact http://www.logilab.fr -- mailto:contact@logilab.fr
+#
+# This software is governed by the CeCILL-C license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL-C
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systemsand/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL-C license and that you accept its terms.
+"""cubicweb-frarchives_edition unit tests for dead links checking"""
+
+# standard library imports
+import datetime
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# third party imports
+# CubicWeb specific imports
+# library specific imports
+from cubicweb_frarchives_edition.linkchecker import (
+    LinkChecker,
+    cached_link_statuses,
+    collect_urls,
+    store_link_statuses,
+    urls_from_content,
+)
+from cubicweb_frarchives_edition.tasks.run_dead_links import run_dead_links
+
+from utils import TaskTC
+from pgfixtures import setup_module, teardown_module  # noqa
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def _respond(self):
+        self.server.requests.append((self.command, self.path))
+        if self.path == "/missing":
+            status = 404
+        elif self.path == "/nohead" and self.command == "HEAD":
+            status = 405
+        else:
+            status = 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_HEAD = do_GET = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServerMixIn(object):
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+
+class LinkCheckerTC(StubServerMixIn, unittest.TestCase):
+    def test_urls_from_content(self):
+        content = """<p><a href="http://foo.fr/a">a</a> <img src="/static/b.png"/>
+        <a name="anchor">c</a></p>"""
+        self.assertEqual(urls_from_content(content), ["http://foo.fr/a", "/static/b.png"])
+        self.assertEqual(urls_from_content(""), [])
+
+    def test_check(self):
+        """Test checking urls against a local server.
+
+        Trying: existing, missing, HEAD-less and unreachable urls
+        Expecting: status codes or errors for each url
+        """
+        # an unused port
+        closed = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        unreachable = "http://127.0.0.1:{}/ok".format(closed.server_port)
+        closed.server_close()
+        urls = [f"{self.base_url}/ok", f"{self.base_url}/missing", f"{self.base_url}/nohead"]
+        progress = []
+        checker = LinkChecker(host_concurrency=1, host_delay=0, timeout=5)
+        statuses = checker.check(
+            urls + [unreachable], progress=lambda idx, total: progress.append((idx, total))
+        )
+        self.assertEqual(statuses[f"{self.base_url}/ok"], (200, None))
+        self.assertEqual(statuses[f"{self.base_url}/missing"], (404, None))
+        self.assertEqual(statuses[f"{self.base_url}/nohead"], (200, None))
+        status, error = statuses[unreachable]
+        self.assertIsNone(status)
+        self.assertTrue(error)
+        self.assertEqual(progress[-1], (4, 4))
+        self.assertIn(("GET", "/nohead"), self.server.requests)
+
+    def test_check_no_urls(self):
+        self.assertEqual(LinkChecker().check([]), {})
+
+
+class DeadLinksTaskTC(StubServerMixIn, TaskTC):
+    def test_cache(self):
+        """Test the dead links cache.
+
+        Trying: store statuses, one of them being outdated
+        Expecting: only the fresh status is returned
+        """
+        with self.admin_access.cnx() as cnx:
+            store_link_statuses(
+                cnx, {"http://foo.fr": (200, None), "http://bar.fr": (None, "timeout")}
+            )
+            cnx.system_sql(
+                "UPDATE dead_links_cache SET checked_at=%(date)s WHERE url='http://foo.fr'",
+                {"date": datetime.datetime.now() - datetime.timedelta(days=10)},
+            )
+            self.assertEqual(
+                cached_link_statuses(cnx, ["http://foo.fr", "http://bar.fr"], ttl=7),
+                {"http://bar.fr": (None, "timeout")},
+            )
+            store_link_statuses(cnx, {"http://foo.fr": (404, None)})
+            self.assertEqual(
+                cached_link_statuses(cnx, ["http://foo.fr"], ttl=7),
+                {"http://foo.fr": (404, None)},
+            )
+
+    def test_run_dead_links(self):
+        """Test running the dead links task twice.
+
+        Trying: links in an ExternRef url and content
+        Expecting: links are checked once and the missing one is reported
+        """
+        with self.admin_access.cnx() as cnx:
+            externref = cnx.create_entity(
+                "ExternRef",
+                reftype="Virtual_exhibit",
+                title="title",
+                url=f"{self.base_url}/missing",
+                content=f'<a href="{self.base_url}/ok">ok</a> <a href="/relative">relative</a>',
+            )
+            cnx.commit()
+            urls = collect_urls(cnx)
+            self.assertEqual(
+                urls,
+                {
+                    f"{self.base_url}/ok": [(externref.eid, "ExternRef")],
+                    f"{self.base_url}/missing": [(externref.eid, "ExternRef")],
+                },
+            )
+            for _ in range(2):
+                task = cnx.create_entity("RqTask", name="run_dead_links", title="run_dead_links")
+                job = task.cw_adapt_to("IRqJob")
+                job.enqueue(run_dead_links)
+                cnx.commit()
+                self._is_executed_successfully(cnx, job)
+                self.assertEqual(len(task.output_file), 1)
+            # second run only used cached results
+            self.assertEqual(len(self.server.requests), 2)
+            self.assertEqual(
+                cached_link_statuses(cnx, urls),
+                {f"{self.base_url}/ok": (200, None), f"{self.base_url}/missing": (404, None)},
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -131,6 +131,36 @@ class ImportTC(S3BfssStorageTestMixin, FrACubicConfigMixIn, CubicWebTC):
                     continue
                 self.assertEqual(qualification, entity.quality)
 
+    def test_process_qualification_rejected_rows(self):
+        """Test authorities qualification process with invalid rows.
+
+        Trying: unknown eid, non-authority entity and duplicated authority rows
+        Expecting: invalid rows are logged, the last row of an authority wins
+        """
+        with self.admin_access.cnx() as cnx:
+            agent = cnx.find("AgentAuthority", label="Jacques Martin").one()
+            service = cnx.create_entity("Service", category="foo", code="FRAD000", name="FOO")
+            cnx.commit()
+            with open(os.path.join(self.import_dir, "rejected.csv"), "w") as fp:
+                writer = csv.writer(fp, delimiter="\t")
+                writer.writerow(FIELDNAMES.keys())
+                writer.writerow((str(agent.eid), agent.label, "oui"))
+                writer.writerow(("999999999", "unknown", "oui"))
+                writer.writerow((str(service.eid), "service", "oui"))
+                writer.writerow((str(agent.eid), agent.label, "non"))
+                writer.writerow((str(agent.eid), agent.label, "oui"))
+            csvpath = self.get_or_create_imported_filepath("qualif/rejected.csv")
+            with self.assertLogs("rq.task", level="ERROR") as cm:
+                updated = process_qualification(
+                    cnx, csvpath, FIELDNAMES, logging.getLogger("rq.task")
+                )
+            self.assertEqual(updated, {agent.eid: True})
+            self.assertEqual(len(cm.output), 2)
+            self.assertIn('line 1: no entity with identifiant "999999999"', cm.output[0])
+            self.assertIn("line 2: entity with identifiant", cm.output[1])
+            agent.cw_clear_all_caches()
+            self.assertTrue(agent.quality)
+
     def test_auth_url_pattern_re(self):
         """TEST AUTH_URL_PATTERN
         Trying: test autorized value for indentifier
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © LOGILAB S.A. (Paris, FRANCE) 2016-2019
+# Contact http://www.logilab.fr -- mailto:contact@logilab.fr
+#
+# This software is governed by the CeCILL-C license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL-C
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systemsand/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL-C license and that you accept its terms.
+
+
+# standard library imports
+import json
+from unittest.mock import patch
+
+# third party imports
+# CubicWeb specific imports
+# library specific imports
+from pgfixtures import setup_module, teardown_module  # noqa
+from utils import TaskTC
+
+
+class RemoveAuthoritiesTC(TaskTC):
+    """Remove authorities task test cases."""
+
+    def test_remove_authorities(self):
+        """Test removing authorities.
+
+        Trying: removing an orphan, a qualified, a location and a nonexistent authority
+        Expecting: only the orphan subject authority is removed and blacklisted
+        """
+        with self.admin_access.cnx() as cnx:
+            orphan = cnx.create_entity("SubjectAuthority", label="orphan")
+            qualified = cnx.create_entity("SubjectAuthority", label="qualified", quality=True)
+            location = cnx.create_entity("LocationAuthority", label="location")
+            cnx.commit()
+            self.login()
+            eids = [orphan.eid, qualified.eid, location.eid, 999999]
+            data = json.dumps(
+                {
+                    "name": "remove_authorities",
+                    "title": "remove_authorities",
+                    "authority_eid": ", ".join(str(eid) for eid in eids),
+                }
+            )
+            self.webapp.post(
+                "/RqTask/?schema_type=remove_authorities",
+                status=201,
+                headers={"Accept": "application/json"},
+                params=[("data", data)],
+            )
+            task = cnx.find("RqTask", name="remove_authorities").one()
+            job = task.cw_adapt_to("IRqJob")
+            self._is_executed_successfully(cnx, job)
+            self.assertFalse(cnx.find("SubjectAuthority", eid=orphan.eid))
+            self.assertTrue(cnx.find("SubjectAuthority", eid=qualified.eid))
+            self.assertTrue(cnx.find("LocationAuthority", eid=location.eid))
+            labels = [
+                label for label, in cnx.system_sql("SELECT label FROM blacklisted_authorities")
+            ]
+            self.assertIn("orphan", labels)
+            self.assertNotIn("qualified", labels)
+            # checkpoints are cleaned up once the task is done
+            for table in ("removed_authorities", "removed_authorities_documents"):
+                self.assertFalse(cnx.system_sql(f"SELECT * FROM {table}").fetchall())
+
+    def test_remove_authorities_reindex_errors(self):
+        """Test removing authorities when documents fail to be reindexed.
+
+        Trying: removing an orphan authority, reindexing documents fails
+        Expecting: the authority is removed, the job fails and the checkpoints are kept
+        """
+        with self.admin_access.cnx() as cnx:
+            orphan = cnx.create_entity("SubjectAuthority", label="orphan")
+            cnx.commit()
+            self.login()
+            data = json.dumps(
+                {
+                    "name": "remove_authorities",
+                    "title": "remove_authorities",
+                    "authority_eid": str(orphan.eid),
+                }
+            )
+            self.webapp.post(
+                "/RqTask/?schema_type=remove_authorities",
+                status=201,
+                headers={"Accept": "application/json"},
+                params=[("data", data)],
+            )
+            task = cnx.find("RqTask", name="remove_authorities").one()
+            job = task.cw_adapt_to("IRqJob")
+            with patch(
+                "cubicweb_frarchives_edition.tasks.remove_authorities.reindex_documents",
+                return_value=2,
+            ):
+                self.work(cnx)
+            job.refresh()
+            self.assertEqual(job.status, "failed")
+            self.assertFalse(cnx.find("SubjectAuthority", eid=orphan.eid))
+            # checkpoints are kept to reindex documents when the task is run again
+            self.assertEqual(
+                cnx.system_sql("SELECT authority FROM removed_authorities").fetchall(),
+                [(orphan.eid,)],
+            )
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -36,6 +36,7 @@ import rq.job
 import fakeredis
 from cubicweb.devtools.testlib import CubicWebTC
 from cubicweb_frarchives_edition.rq import work, rqjob
+from cubicweb_frarchives_edition.rqlogs import store_task_log, task_log_page
 
 from utils import FrACubicConfigMixIn
 
@@ -93,6 +94,10 @@ class RQTaskTC(FrACubicConfigMixIn, CubicWebTC):
             for attr in ("enqueued_at", "started_at"):
                 self.assertDateAlmostEqual(getattr(task, attr), getattr(job, attr))
             self.assertEqual(task.log.read(), log.encode("utf-8"))
+            total, records = task.cw_adapt_to("IRqJob").log_page(level="ERROR")
+            self.assertEqual(total, 3)
+            self.assertEqual([r[0] for r in records], ["ERROR", "CRITICAL", "ERROR"])
+            self.assertIn("RuntimeError: catched", records[-1][-1])
 
     def test_failure(self):
         with self.admin_access.cnx() as cnx, rq.Connection(self.fakeredis):
@@ -122,3 +127,31 @@ class RQTaskTC(FrACubicConfigMixIn, CubicWebTC):
             for attr in ("enqueued_at", "started_at"):
                 self.assertDateAlmostEqual(getattr(job, attr), getattr(task, attr))
             self.assertEqual(task.log.read(), log.encode("utf-8"))
+
+    def test_log_pages(self):
+        lines = []
+        for idx in range(10):
+            severity = ("INFO", "WARNING", "ERROR")[idx % 3]
+            lines.append("{} 2021-01-01 10:00:00,{:03d} mod 1 msg {}".format(severity, idx, idx))
+        lines.append("Traceback (most recent call last):")
+        with self.admin_access.cnx() as cnx:
+            task = cnx.create_entity("RqTask", name="import_ead")
+            cnx.commit()
+            self.assertIsNone(task_log_page(cnx, task.eid))
+            self.assertEqual(store_task_log(cnx, task.eid, lines, chunk_size=3), 4)
+            total, records = task_log_page(cnx, task.eid, offset=2, limit=5)
+            self.assertEqual(total, 10)
+            self.assertEqual([r[-1] for r in records], ["msg {}".format(i) for i in range(2, 7)])
+            total, records = task_log_page(cnx, task.eid, offset=1, limit=5, level="WARNING")
+            self.assertEqual(total, 6)
+            self.assertEqual(
+                [r[-1][:5] for r in records], ["msg 2", "msg 4", "msg 5", "msg 7", "msg 8"]
+            )
+            total, records = task_log_page(cnx, task.eid, offset=3, level="ERROR")
+            self.assertEqual(total, 3)
+            self.assertEqual(records, [])
+            total, records = task_log_page(cnx, task.eid, offset=2, level="ERROR")
+            self.assertEqual(records[0][-1], "msg 8")
+            task.cw_delete()
+            cnx.commit()
+            self.assertIsNone(task_log_page(cnx, task.eid))
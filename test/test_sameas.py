@@ -32,7 +32,7 @@
 from utils import FrACubicConfigMixIn
 from pgfixtures import setup_module, teardown_module  # noqa
 
-from cubicweb_frarchives_edition.alignments import compute_label_from_url
+from cubicweb_frarchives_edition.alignments import compute_geonames_labels, compute_label_from_url
 
 from cubicweb.devtools import PostgresApptestConfiguration
 from cubicweb.devtools.testlib import CubicWebTC
@@ -171,3 +171,32 @@ class FaapiTC(FrACubicConfigMixIn, CubicWebTC):
             url = "https://www.geonames.org/1234567/fontenay-sous-bois.html"
             label = compute_label_from_url(cnx, url)
             self.assertEqual(label, "Fontenay-sous-Bois (Île-de-France, Val-de-Marne)")
+
+    def test_compute_geonames_labels(self):
+        """Test GeoNames labels creation of several URLs at once.
+
+        Trying: French, foreign, unknown, invalid and duplicated GeoNames URLs
+        Expecting: labels of known GeoNames URLs
+        """
+        with self.admin_access.cnx() as cnx:
+            urls = [
+                "https://www.geonames.org/1234567",
+                "https://www.geonames.org/1234567/fontenay-sous-bois.html",
+                "https://www.geonames.org/2935453",
+                "https://www.geonames.org/524901",
+                "https://www.geonames.org/5678901",
+                "https://www.wikidata.org/wiki/Q90",
+            ]
+            self.assertEqual(
+                {
+                    "https://www.geonames.org/1234567": (
+                        "Fontenay-sous-Bois (Île-de-France, Val-de-Marne)"
+                    ),
+                    "https://www.geonames.org/1234567/fontenay-sous-bois.html": (
+                        "Fontenay-sous-Bois (Île-de-France, Val-de-Marne)"
+                    ),
+                    "https://www.geonames.org/2935453": "Dossenheim (Allemagne)",
+                    "https://www.geonames.org/524901": "Moscou",
+                },
+                compute_geonames_labels(cnx, urls),
+            )
@@ -31,19 +31,65 @@
 # standard library imports
 from lxml import html as lxml_html
 
+import glob
+import hashlib
+import os
 import os.path as osp
+import zipfile
+from tempfile import TemporaryDirectory
 
-import unittest
+import unittest.mock
 
 from logilab.common import flatten
 
+from cubicweb.devtools import PostgresApptestConfiguration
 from cubicweb.devtools.testlib import CubicWebTC
 
-from cubicweb_francearchives.testutils import XMLCompMixin
+from cubicweb_francearchives.testutils import S3BfssStorageTestMixin, XMLCompMixin
 
-from cubicweb_frarchives_edition.xmlutils import generate_summary
+from cubicweb_frarchives_edition.xmlutils import generate_summary, headings_changed
 
 from cubicweb_frarchives_edition import FILE_URL_RE
+from cubicweb_frarchives_edition.tasks.utils import (
+    BfssOutputStorage,
+    extract_zip,
+    OutputFile,
+    RemoveS3ObjectOp,
+    S3OutputStorage,
+    write_csv,
+)
+
+from utils import FrACubicConfigMixIn
+from pgfixtures import setup_module, teardown_module  # noqa
+
+
+class FakeS3Client:
+    """record the uploaded parts and objects of a S3 bucket"""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.uploads[Key] = {}
+        return {"UploadId": Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": "etag{}".format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"])
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+
+    def delete_object(self, Bucket, Key):
+        del self.objects[Key]
 
 
 class UtilsTest(CubicWebTC):
@@ -67,6 +113,138 @@ class UtilsTest(CubicWebTC):
         ):
             self.assertIsNone(FILE_URL_RE.search(url))
 
+    def test_extract_zip(self):
+        with TemporaryDirectory() as tmpdir:
+            directory = osp.join(tmpdir, "extracted")
+            archive = osp.join(tmpdir, "archive.zip")
+            with zipfile.ZipFile(archive, "w") as zf:
+                for idx in range(10):
+                    zf.writestr("ead/fa{}.XML".format(idx), "<ead>{}</ead>".format(idx))
+                zf.writestr("ead/readme.txt", "readme")
+                zf.writestr("../outside.xml", "<ead/>")
+            filepaths = extract_zip(archive, directory, (".xml",), max_workers=3)
+            self.assertEqual(
+                filepaths,
+                [osp.join(directory, "ead", "fa{}.XML".format(idx)) for idx in range(10)],
+            )
+            with open(filepaths[3]) as f:
+                self.assertEqual(f.read(), "<ead>3</ead>")
+            self.assertFalse(osp.exists(osp.join(tmpdir, "outside.xml")))
+            self.assertFalse(osp.exists(osp.join(directory, "ead", "readme.txt")))
+
+    def test_bfss_output_storage(self):
+        with TemporaryDirectory() as tmpdir:
+            storage = BfssOutputStorage(tmpdir, "export.csv")
+            for idx in range(3):
+                storage.write("line {}\n".format(idx).encode("utf-8"))
+            path = storage.finish()
+            content = b"line 0\nline 1\nline 2\n"
+            self.assertEqual(
+                path, osp.join(tmpdir, "{}_export.csv".format(hashlib.sha1(content).hexdigest()))
+            )
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), content)
+            # no temporary file is left
+            self.assertEqual(os.listdir(tmpdir), [osp.basename(path)])
+
+    def test_s3_output_storage_multipart(self):
+        storage = unittest.mock.Mock(s3cnx=FakeS3Client(), bucket="bucket")
+        output = S3OutputStorage(storage, "export.csv", part_size=10)
+        chunks = [b"0123456", b"789abcdef", b"ghijklmnopqrstu", b"vwxyz"]
+        for chunk in chunks:
+            output.write(chunk)
+        self.assertEqual(output.finish(), "export.csv")
+        content = b"".join(chunks)
+        self.assertEqual(storage.s3cnx.objects["export.csv"], content)
+        self.assertEqual([part["PartNumber"] for part in output.parts], [1, 2, 3])
+        self.assertEqual(output.sha1.hexdigest(), hashlib.sha1(content).hexdigest())
+        # small files are uploaded at once
+        output = S3OutputStorage(storage, "small.csv", part_size=10)
+        output.write(b"abc")
+        output.finish()
+        self.assertEqual(storage.s3cnx.objects["small.csv"], b"abc")
+        self.assertIsNone(output.upload_id)
+
+    def test_write_csv(self):
+        with TemporaryDirectory() as tmpdir:
+            path = osp.join(tmpdir, "rows.csv")
+            rows = (("a{}".format(idx), idx) for idx in range(3))
+            write_csv(rows, headers=("label", "idx"), path=path, delimiter="\t")
+            with open(path) as f:
+                self.assertEqual(f.read(), "label\tidx\r\na0\t0\r\na1\t1\r\na2\t2\r\n")
+
+
+class OutputFileTC(S3BfssStorageTestMixin, FrACubicConfigMixIn, CubicWebTC):
+    configcls = PostgresApptestConfiguration
+
+    def setUp(self):
+        super(OutputFileTC, self).setUp()
+        self.config.global_set_option("appfiles-dir", str(self.datapath("appfiles")))
+
+    def tearDown(self):
+        super(OutputFileTC, self).tearDown()
+        for filename in glob.glob(osp.join(self.config["appfiles-dir"], "*")):
+            os.remove(filename)
+
+    def test_output_file_writerows(self):
+        """
+        Trying: stream CSV rows in an OutputFile
+        Expecting: a File entity refers to the stored content
+        """
+        rows = [("label", "idx")] + [("a{}".format(idx), idx) for idx in range(1000)]
+        expected = "".join("{},{}\r\n".format(*row) for row in rows).encode("utf-8")
+        with self.admin_access.cnx() as cnx:
+            with OutputFile(cnx, "rows.csv", "text/csv", chunk_size=64) as output:
+                output.writerows(iter(rows))
+            cnx.commit()
+            fobj = cnx.find("File", eid=output.entity.eid).one()
+            self.assertEqual(fobj.title, "rows.csv")
+            self.assertEqual(fobj.data_name, "rows.csv")
+            self.assertEqual(fobj.data_format, "text/csv")
+            self.assertEqual(fobj.data_hash, hashlib.sha1(expected).hexdigest())
+            content = fobj.read()
+            self.assertEqual(len(content), len(expected))
+            self.assertEqual(content, expected)
+
+    def test_output_file_not_read_back(self):
+        """
+        Trying: store an OutputFile then rollback the transaction
+        Expecting: the File is created without the storage processing its content
+        and the stored content is removed on rollback
+        """
+        with self.admin_access.cnx() as cnx:
+            storage = cnx.repo.system_source.storage("File", "data")
+            with unittest.mock.patch.object(type(storage), "entity_added") as entity_added:
+                with OutputFile(cnx, "data.txt", "text/plain") as output:
+                    output.write(b"some data")
+                entity_added.assert_not_called()
+            self.assertNotIn("entity_added", vars(storage))
+            self.assertEqual(output.entity.data_hash, hashlib.sha1(b"some data").hexdigest())
+            path = osp.join(
+                self.config["appfiles-dir"],
+                "{}_data.txt".format(hashlib.sha1(b"some data").hexdigest()),
+            )
+            self.assertTrue(osp.isfile(path))
+            cnx.rollback()
+            self.assertFalse(osp.exists(path))
+            self.assertFalse(cnx.find("File", title="data.txt"))
+
+    def test_remove_s3_object_on_rollback(self):
+        """
+        Trying: rollback a transaction in which an object has been uploaded to S3
+        Expecting: the object is removed from the bucket
+        """
+        s3cnx = FakeS3Client()
+        s3cnx.put_object(Bucket="bucket", Key="export.csv", Body=b"data")
+        storage = unittest.mock.Mock(s3cnx=s3cnx, bucket="bucket")
+        with self.admin_access.cnx() as cnx:
+            with unittest.mock.patch.object(
+                cnx.repo.system_source, "storage", return_value=storage
+            ):
+                RemoveS3ObjectOp.get_instance(cnx).add_data("export.csv")
+                cnx.rollback()
+        self.assertEqual(s3cnx.objects, {})
+
 
 class XMLUtilsTest(XMLCompMixin, CubicWebTC):
     def assertHTMLEqual(self, expected_filepath, result):
@@ -117,6 +295,16 @@ class XMLUtilsTest(XMLCompMixin, CubicWebTC):
                     flatten([expected_ids.get(k) for k in expected_ids.keys()]),
                 )
 
+    def test_headings_changed(self):
+        content = '<h2 id="a">title</h2><p>text</p><h3 id="b">sub<em>title</em></h3>'
+        self.assertTrue(headings_changed(None, content))
+        self.assertFalse(headings_changed(content, content))
+        self.assertFalse(headings_changed(content, content.replace("text", "other text")))
+        self.assertFalse(headings_changed(content, content + "<!-- <h2>comment</h2> -->"))
+        self.assertTrue(headings_changed(content, content.replace("sub", "other")))
+        self.assertTrue(headings_changed(content, content.replace(' id="a"', "")))
+        self.assertTrue(headings_changed(content, content + "<h4>new</h4>"))
+
 
 if __name__ == "__main__":
     unittest.main()